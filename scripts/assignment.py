@@ -0,0 +1,273 @@
+"""User-equilibrium traffic assignment (Frank-Wolfe)
+
+An alternative to the incremental capacity-constrained loading in
+``functions.network_flow_model``: the full OD demand is assigned to the
+network with the Frank-Wolfe algorithm (optionally its conjugate variant),
+using the same graph, parameter dicts and speed-flow relationship. Each
+iteration is one all-or-nothing (AON) pass, and the run stops when the
+relative gap drops below a configurable threshold.
+"""
+
+from functools import partial
+from typing import Tuple, Union
+
+import numpy as np
+import geopandas as gpd  # type: ignore
+import igraph  # type: ignore
+
+import kernels
+from edge_state import EdgeState, as_edge_state
+from routing import ParallelRouter, find_shortest_paths
+from utils import build_path_flow_matrix, get_flow_on_edges_from_matrix
+
+# conjugate weights of the previous target are capped at 1 - CONJUGATE_DELTA;
+# at the cap the plain Frank-Wolfe direction is used instead
+CONJUGATE_DELTA = 0.05
+
+
+def edge_costs_at_flow(
+    flow: np.ndarray,
+    class_code: np.ndarray,
+    urban: np.ndarray,
+    length: np.ndarray,
+    toll: np.ndarray,
+    speed_flow: partial,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Generalised edge costs (£/car) and speeds at the given edge flows"""
+    speed = speed_flow(class_code, urban, flow)
+    cost, _, _ = kernels.cost_array(
+        length / speed, length, kernels.voc_array(speed), toll
+    )
+    return cost, speed
+
+
+def all_or_nothing(
+    network: igraph.Graph,
+    router,
+    origins: list,
+    destinations: list,
+    flows: np.ndarray,
+    closed: np.ndarray,
+) -> Tuple[np.ndarray, float]:
+    """Load every OD flow on its current shortest path
+
+    Returns
+    -------
+    flow on each graph edge, and the OD flow without any path
+    """
+    if router is None:
+        list_of_paths = find_shortest_paths(
+            network, origins, destinations, closed=closed, progress=False
+        )
+    else:
+        router.update(network)
+        list_of_paths = router.route(origins, destinations)
+    paths = [path for paths in list_of_paths for path in paths]
+    path_lengths = np.fromiter(map(len, paths), dtype=np.int64, count=len(paths))
+    path_flow_matrix = build_path_flow_matrix(
+        np.fromiter(
+            (e for path in paths for e in path),
+            dtype=np.int32,
+            count=path_lengths.sum(),
+        ),
+        path_lengths,
+        flows,
+        network.ecount(),
+    )
+    non_allocated_flow = flows[path_lengths == 0].sum()
+    return get_flow_on_edges_from_matrix(path_flow_matrix), non_allocated_flow
+
+
+def line_search(
+    flow: np.ndarray,
+    direction: np.ndarray,
+    cost_at_flow,
+    iterations: int = 30,
+) -> float:
+    """Step size in [0, 1] minimising the Beckmann objective along
+    ``direction``: bisection on its derivative sum(d * c(x + a * d))"""
+    moving = direction != 0
+    flow = flow[moving]
+    direction = direction[moving]
+
+    def derivative(step: float) -> float:
+        return (direction * cost_at_flow(flow + step * direction, moving)).sum()
+
+    if derivative(1.0) <= 0:
+        return 1.0
+    lower, upper = 0.0, 1.0
+    for _ in range(iterations):
+        middle = 0.5 * (lower + upper)
+        if derivative(middle) > 0:
+            upper = middle
+        else:
+            lower = middle
+    return 0.5 * (lower + upper)
+
+
+def frank_wolfe_assignment(
+    network: igraph.Graph,
+    road_links: Union[gpd.GeoDataFrame, EdgeState],
+    node_name_to_index: dict,
+    edge_index_to_name: dict,
+    list_of_origins: list,
+    supply_dict: dict,
+    destination_dict: dict,
+    free_flow_speed_dict: dict,
+    flow_breakpoint_dict: dict,
+    min_speed_cap: dict,
+    urban_speed_cap: dict,
+    col_eid: str,
+    max_iterations: int = 100,
+    gap_tolerance: float = 1e-4,
+    conjugate: bool = False,
+    n_workers: int = 1,
+    return_summary: bool = False,
+) -> Union[Tuple[dict, dict, dict], Tuple[dict, dict, dict, dict]]:
+    """Frank-Wolfe user-equilibrium assignment
+
+    Parameters are those of ``functions.network_flow_model``, plus:
+
+    max_iterations
+        maximum number of all-or-nothing passes
+    gap_tolerance
+        stop when the relative gap (c.x - c.y) / c.x falls below this value,
+        where y is the all-or-nothing flow at the current costs c
+    conjugate
+        use conjugate Frank-Wolfe directions (Mitradjieva & Lindberg, 2013)
+    n_workers
+        number of routing processes (see ``routing.ParallelRouter``)
+    return_summary
+        also return the last relative gap, the number of iterations and the
+        cost totals
+
+    Returns
+    -------
+    speed, flow and remaining capacity dicts {edge name: value}; remaining
+    capacities are floored at zero as in ``network_flow_model``
+    """
+    edge_state = as_edge_state(road_links, col_eid)
+    # graph edge index -> dense edge id
+    edge_idx = edge_state.ids(
+        edge_index_to_name[idx] for idx in range(network.ecount())
+    )
+    class_code = edge_state.class_code[edge_idx]
+    urban = edge_state.urban[edge_idx]
+    length = edge_state.length[edge_idx]
+    toll = edge_state.toll[edge_idx]
+    # edges closed beforehand (e.g. disrupted links) carry infinite weights
+    closed = np.isinf(np.array(network.es["weight"], dtype=np.float64))
+
+    speed_flow = partial(
+        kernels.speed_flow_array,
+        free_flow_speed_dict=free_flow_speed_dict,
+        flow_breakpoint_dict=flow_breakpoint_dict,
+        min_speed_cap=min_speed_cap,
+        urban_speed_cap=urban_speed_cap,
+    )
+
+    def cost_at_flow(flow: np.ndarray, subset=slice(None)) -> np.ndarray:
+        cost, _ = edge_costs_at_flow(
+            flow,
+            class_code[subset],
+            urban[subset],
+            length[subset],
+            toll[subset],
+            speed_flow,
+        )
+        return cost
+
+    def set_weights(cost: np.ndarray) -> None:
+        network.es["weight"] = np.where(closed, np.inf, cost).tolist()
+
+    # OD demand in origin order
+    origins = [node_name_to_index[name] for name in list_of_origins]
+    destinations = [
+        [node_name_to_index[name] for name in destination_dict[origin]]
+        for origin in list_of_origins
+    ]
+    od_flows = np.array(
+        [flow for origin in list_of_origins for flow in supply_dict[origin]],
+        dtype=np.float64,
+    )
+    print(f"The total demand is {od_flows.sum()}")
+
+    router = ParallelRouter(n_workers) if n_workers > 1 else None
+    aon = partial(
+        all_or_nothing, network, router, origins, destinations, od_flows, closed
+    )
+
+    # initial solution: all-or-nothing at free-flow costs
+    set_weights(cost_at_flow(np.zeros(network.ecount())))
+    flow, non_allocated_flow = aon()
+    print(f"Non_allocated_flow: {non_allocated_flow}")
+    previous_target = None  # conjugate direction target
+    gap = np.inf
+    iter_flag = 0
+    for iter_flag in range(1, max_iterations + 1):
+        cost = cost_at_flow(flow)
+        set_weights(cost)
+        aon_flow, _ = aon()
+        total_cost = (cost * flow).sum()
+        gap = (total_cost - (cost * aon_flow).sum()) / total_cost
+        print(f"No.{iter_flag} iteration: relative gap = {gap}")
+        if gap < gap_tolerance:
+            break
+
+        target = aon_flow
+        if conjugate and previous_target is not None:
+            # diagonal Hessian of the Beckmann objective (dc/dx)
+            step = np.maximum(1.0, 1e-3 * flow)
+            hessian = (cost_at_flow(flow + step) - cost) / step
+            conjugate_gap = previous_target - flow
+            numerator = (conjugate_gap * hessian * (aon_flow - flow)).sum()
+            denominator = (conjugate_gap * hessian * (aon_flow - previous_target)).sum()
+            if denominator != 0:
+                alpha = min(max(numerator / denominator, 0.0), 1 - CONJUGATE_DELTA)
+                if alpha < 1 - CONJUGATE_DELTA:
+                    target = alpha * previous_target + (1 - alpha) * aon_flow
+            # keep a descent direction, else fall back to plain Frank-Wolfe
+            if (cost * (target - flow)).sum() >= 0:
+                target = aon_flow
+        direction = target - flow
+        step_size = line_search(flow, direction, cost_at_flow)
+        flow = flow + step_size * direction
+        previous_target = target
+        print(f"step size = {step_size}")
+
+    if router is not None:
+        router.close()
+
+    cost, speed = edge_costs_at_flow(flow, class_code, urban, length, toll, speed_flow)
+    set_weights(cost)
+    edge_state.flow[edge_idx] = flow
+    edge_state.speed[edge_idx] = speed
+    edge_state.capacity[edge_idx] = np.maximum(
+        edge_state.capacity[edge_idx] - flow, 0.0
+    )
+    _, time_cost, operate_cost = kernels.cost_array(
+        length / speed, length, kernels.voc_array(speed), toll
+    )
+    print("The flow assignment is completed!")
+    print(f"total travel cost is (£): {(cost * flow).sum()}")
+    print(f"total time-equiv cost is (£): {(time_cost * flow).sum()}")
+    print(f"total operating cost is (£): {(operate_cost * flow).sum()}")
+    print(f"total toll cost is (£): {(toll * flow).sum()}")
+    print(f"The total non-allocated flow is {non_allocated_flow}")
+    results = (
+        edge_state.to_dict("speed"),
+        edge_state.to_dict("flow"),
+        edge_state.to_dict("capacity"),
+    )
+    if return_summary:
+        summary = {
+            "relative_gap": gap,
+            "iterations": iter_flag,
+            "total_cost": (cost * flow).sum(),
+            "time_equiv_cost": (time_cost * flow).sum(),
+            "operating_cost": (operate_cost * flow).sum(),
+            "toll_cost": (toll * flow).sum(),
+            "non_allocated_flow": non_allocated_flow,
+        }
+        return (*results, summary)
+    return results
@@ -0,0 +1,208 @@
+"""Checkpoints of ``network_flow_model`` runs
+
+A checkpoint holds the complete state at the start of an iteration: edge
+states (flow, capacity, speed, costs, closed edges), graph weights,
+remaining demand (origin and destination vertices, flows), cost accumulators,
+non-allocated flow, the iteration counter, the edges re-weighted in the
+last iteration and the paths of the incremental path cache. Restoring it
+into a fresh run (same network and inputs) continues bit-for-bit.
+
+Checkpoints are ``.npz`` files. The state is copied in the main loop and
+written by a background thread to a temporary file that replaces the
+previous checkpoint once complete, so a crash while writing leaves the last
+checkpoint intact.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import igraph  # type: ignore
+
+from demand import ODDemand
+from edge_state import EdgeState
+from routing import PathCache, pack_paths, unpack_paths
+
+EDGE_FIELDS = (
+    "flow",
+    "capacity",
+    "speed",
+    "cost",
+    "time_cost",
+    "operate_cost",
+    "closed",
+)
+
+TOTALS = (
+    "total_cost",
+    "time_equiv_cost",
+    "operating_cost",
+    "toll_cost",
+    "total_non_allocated_flow",
+    "total_remain",
+)
+
+
+def snapshot(
+    iter_flag: int,
+    network: igraph.Graph,
+    edge_state: EdgeState,
+    demand: ODDemand,
+    totals: dict,
+    changed_edges: Optional[np.ndarray] = None,
+    path_cache: Optional[PathCache] = None,
+) -> dict:
+    """Copy of the iteration state as arrays"""
+    state = {
+        "iter_flag": np.int64(iter_flag),
+        "vcount": np.int64(network.vcount()),
+        "weights": np.array(network.es["weight"], dtype=np.float64),
+        "origins": demand.origins.copy(),
+        "counts": np.diff(demand.offsets),
+        "destinations": demand.destinations.copy(),
+        "supplies": demand.counts.copy(),
+        "changed_edges": np.array(
+            [] if changed_edges is None else changed_edges, dtype=np.int64
+        ),
+        "has_changed_edges": np.bool_(changed_edges is not None),
+    }
+    for field in EDGE_FIELDS:
+        state[f"edge_{field}"] = getattr(edge_state, field).copy()
+    for name in TOTALS:
+        state[name] = np.float64(totals[name])
+    if path_cache is not None:
+        cache_origins = list(path_cache.paths)
+        state["cache_reference_weights"] = path_cache.reference_weights.copy()
+        state["cache_origins"] = np.array(cache_origins, dtype=np.int64)
+        state["cache_counts"] = np.array(
+            [len(path_cache.paths[origin]) for origin in cache_origins],
+            dtype=np.int64,
+        )
+        state["cache_destinations"] = np.array(
+            [dest for origin in cache_origins for dest in path_cache.paths[origin]],
+            dtype=np.int64,
+        )
+        state["cache_edges"], state["cache_offsets"] = pack_paths(
+            [
+                path
+                for origin in cache_origins
+                for path in path_cache.paths[origin].values()
+            ]
+        )
+    return state
+
+
+def restore(
+    state: dict,
+    network: igraph.Graph,
+    edge_state: EdgeState,
+    path_cache: Optional[PathCache] = None,
+) -> Tuple[int, ODDemand, dict, Optional[np.ndarray]]:
+    """Load a checkpoint into the network, edge state and path cache
+
+    Returns
+    -------
+    iteration counter, remaining demand, cost and flow totals, edges
+    re-weighted in the last iteration
+    """
+    if state["vcount"] != network.vcount() or len(state["weights"]) != (
+        network.ecount()
+    ):
+        raise ValueError("The checkpoint was saved for a different network")
+    if len(state["edge_flow"]) != len(edge_state):
+        raise ValueError("The checkpoint was saved for different road links")
+    network.es["weight"] = state["weights"].tolist()
+    for field in EDGE_FIELDS:
+        setattr(edge_state, field, state[f"edge_{field}"].copy())
+
+    offsets = np.zeros(len(state["origins"]) + 1, dtype=np.int64)
+    np.cumsum(state["counts"], out=offsets[1:])
+    demand = ODDemand(
+        state["origins"], offsets, state["destinations"], state["supplies"]
+    )
+
+    if path_cache is not None and "cache_origins" in state:
+        path_cache.reference_weights = state["cache_reference_weights"].copy()
+        paths = unpack_paths(state["cache_edges"], state["cache_offsets"])
+        cache_destinations = state["cache_destinations"].tolist()
+        start = 0
+        path_cache.paths.clear()
+        path_cache.edges.clear()
+        for origin, count in zip(
+            state["cache_origins"].tolist(), state["cache_counts"].tolist()
+        ):
+            origin_paths = paths[start : start + count]
+            path_cache.paths[origin] = dict(
+                zip(cache_destinations[start : start + count], origin_paths)
+            )
+            path_cache.edges[origin] = np.unique(
+                np.fromiter((e for path in origin_paths for e in path), dtype=np.intp)
+            )
+            start += count
+
+    totals = {name: state[name].item() for name in TOTALS}
+    changed_edges = state["changed_edges"] if state["has_changed_edges"] else None
+    return int(state["iter_flag"]), demand, totals, changed_edges
+
+
+def load_checkpoint(path: Union[str, Path]) -> Optional[dict]:
+    """The saved state, or None if there is no checkpoint"""
+    if not Path(path).exists():
+        return None
+    with np.load(path) as saved:
+        return {name: saved[name] for name in saved.files}
+
+
+def _write(path: Path, state: dict) -> None:
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "wb") as f:
+        np.savez_compressed(f, **state)
+    os.replace(temp_path, path)
+
+
+class Checkpointer:
+    """Periodic checkpoints written by a background thread
+
+    A checkpoint is due every ``every`` iterations and, if ``interval`` is
+    set, whenever ``interval`` seconds have passed since the last one. A due
+    checkpoint is skipped while the previous one is still being written.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        every: Optional[int] = 1,
+        interval: Optional[float] = None,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.every = every
+        self.interval = interval
+        self._last_time = time.monotonic()
+        self._thread: Optional[threading.Thread] = None
+
+    def due(self, iter_flag: int) -> bool:
+        """Whether to save the state at the start of iteration ``iter_flag``"""
+        completed = iter_flag - 1
+        if self.every and completed % self.every == 0:
+            return True
+        return (
+            self.interval is not None
+            and time.monotonic() - self._last_time >= self.interval
+        )
+
+    def save(self, state: dict) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            print("Checkpoint skipped: the previous one is still being written")
+            return
+        self._last_time = time.monotonic()
+        self._thread = threading.Thread(target=_write, args=(self.path, state))
+        self._thread.start()
+
+    def close(self) -> None:
+        """Wait for the last checkpoint to be written"""
+        if self._thread is not None:
+            self._thread.join()
@@ -4,3 +4,5 @@ CONV_METER_TO_MILE = 0.000621371
 CONV_MILE_TO_KM = 1.60934
 CONV_KM_TO_MILE = 0.621371
 PENCE_TO_POUND = 0.01
+AVERAGE_OCCUPANCY = 1.6  # persons/car
+VALUE_OF_TIME = 20  # pounds/hour
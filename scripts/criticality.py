@@ -0,0 +1,263 @@
+"""Single-link criticality: the extra generalised cost of losing each link
+
+Running ``network_flow_model`` once per closed link is too slow for every
+A/B/M link, so links are ranked in two stages:
+
+1. screening (``screen_links``): the OD pairs are routed once on the
+   free-flow costs without capacities. For each link, only the pairs whose
+   shortest path uses it are routed again with the link closed; the extra
+   cost is the flow-weighted change of their path costs, split into the
+   components of ``cost_func`` (time-equivalent, operating, toll). Pairs
+   left without a path are counted as lost flow.
+2. evaluation (``evaluate_links``): full capacity-constrained runs
+   (``scenarios.run_scenarios``) of the top-N screened links, compared with
+   the run of the undisrupted network.
+
+Both stages are parallelised over links.
+"""
+
+import multiprocessing as mp
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+import network_cache
+import scenarios
+from routing import ParallelRouter, find_shortest_paths, pack_paths
+
+# per-worker inputs, set by _init_worker
+_worker_inputs: dict = {}
+
+COMPONENTS = ("cost", "time_cost", "operate_cost", "toll")
+
+
+def _edge_components(compiled_network: network_cache.CompiledNetwork) -> dict:
+    """Free-flow cost components by graph edge index"""
+    return {
+        "cost": np.array(compiled_network.cost),
+        "time_cost": np.array(compiled_network.time_cost),
+        "operate_cost": np.array(compiled_network.operate_cost),
+        "toll": compiled_network.toll[compiled_network.edge_idx],
+    }
+
+
+def _path_components(
+    edges: np.ndarray, offsets: np.ndarray, edge_components: dict
+) -> dict:
+    """Cost components of packed paths"""
+    path_of_edge = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return {
+        name: np.bincount(
+            path_of_edge, weights=values[edges], minlength=len(offsets) - 1
+        )
+        for name, values in edge_components.items()
+    }
+
+
+def baseline_pairs(
+    compiled_network: network_cache.CompiledNetwork,
+    od_inputs: tuple,
+    n_workers: int = 1,
+) -> dict:
+    """OD pairs, flows and uncapacitated shortest paths on free-flow costs
+
+    Returns
+    -------
+    dict of pair arrays (origin and destination vertex, flow, cost
+    components) and the packed paths (``edges``, ``offsets``)
+    """
+    list_of_origins, supply_dict, destination_dict = od_inputs
+    node_name_to_index = compiled_network.od_node_index(list_of_origins)
+    if node_name_to_index is None:
+        origins = list(list_of_origins)
+        destinations = [list(destination_dict[origin]) for origin in list_of_origins]
+    else:
+        origins = [node_name_to_index[name] for name in list_of_origins]
+        destinations = [
+            [node_name_to_index[name] for name in destination_dict[origin]]
+            for origin in list_of_origins
+        ]
+    network = compiled_network.to_igraph()
+    if n_workers > 1:
+        router = ParallelRouter(n_workers)
+        router.update(network)
+        list_of_paths = router.route(origins, destinations)
+        router.close()
+    else:
+        list_of_paths = find_shortest_paths(network, origins, destinations)
+    edges, offsets = pack_paths([path for paths in list_of_paths for path in paths])
+    pairs = {
+        "origin": np.repeat(origins, [len(dests) for dests in destinations]),
+        "destination": np.fromiter(
+            (dest for dests in destinations for dest in dests), dtype=np.int64
+        ),
+        "flow": np.fromiter(
+            (flow for origin in list_of_origins for flow in supply_dict[origin]),
+            dtype=np.float64,
+        ),
+        "edges": edges,
+        "offsets": offsets,
+    }
+    pairs.update(_path_components(edges, offsets, _edge_components(compiled_network)))
+    return pairs
+
+
+def _init_worker(network_dir: Path, pairs: dict) -> None:
+    compiled_network = network_cache.load_network(network_dir)
+    _worker_inputs["network"] = compiled_network.to_igraph()
+    _worker_inputs["edge_components"] = _edge_components(compiled_network)
+    _worker_inputs["pairs"] = pairs
+    # graph edge -> pairs whose baseline path uses it
+    path_of_edge = np.repeat(
+        np.arange(len(pairs["offsets"]) - 1), np.diff(pairs["offsets"])
+    )
+    order = np.argsort(pairs["edges"], kind="stable")
+    _worker_inputs["pairs_by_edge"] = path_of_edge[order]
+    _worker_inputs["edge_bounds"] = np.searchsorted(
+        pairs["edges"][order], np.arange(compiled_network.edges.shape[0] + 1)
+    )
+
+
+def screen_link(edge: int) -> dict:
+    """Extra uncapacitated cost of closing one graph edge"""
+    network = _worker_inputs["network"]
+    pairs = _worker_inputs["pairs"]
+    bounds = _worker_inputs["edge_bounds"]
+    affected = _worker_inputs["pairs_by_edge"][bounds[edge] : bounds[edge + 1]]
+    row = {"edge": edge, "pairs": len(affected)}
+    row["affected_flow"] = pairs["flow"][affected].sum()
+    if not len(affected):
+        return {
+            **row,
+            **{f"extra_{name}": 0.0 for name in COMPONENTS},
+            "lost_flow": 0.0,
+        }
+
+    # route the affected pairs again, grouped by origin
+    affected = affected[np.argsort(pairs["origin"][affected], kind="stable")]
+    origins, starts = np.unique(pairs["origin"][affected], return_index=True)
+    destinations = np.split(pairs["destination"][affected], starts[1:])
+    closed = np.zeros(network.ecount(), dtype=bool)
+    closed[edge] = True
+    weight = network.es[edge]["weight"]
+    network.es[edge]["weight"] = np.inf
+    try:
+        list_of_paths = find_shortest_paths(
+            network,
+            origins.tolist(),
+            [dests.tolist() for dests in destinations],
+            closed=closed,
+            progress=False,
+        )
+    finally:
+        network.es[edge]["weight"] = weight
+    edges, offsets = pack_paths([path for paths in list_of_paths for path in paths])
+    rerouted = _path_components(edges, offsets, _worker_inputs["edge_components"])
+
+    flow = pairs["flow"][affected]
+    is_lost = np.diff(offsets) == 0
+    for name in COMPONENTS:
+        extra = rerouted[name] - pairs[name][affected]
+        row[f"extra_{name}"] = (flow * extra)[~is_lost].sum()
+    row["lost_flow"] = flow[is_lost].sum()
+    return row
+
+
+def screen_links(
+    network_dir: Union[str, Path],
+    od_inputs: tuple,
+    edges: Optional[List[str]] = None,
+    n_workers: int = 1,
+) -> pd.DataFrame:
+    """Uncapacitated screening of single-link closures
+
+    Parameters
+    ----------
+    network_dir
+        compiled (undisrupted) network, see ``network_cache``
+    od_inputs
+        list of origins, supply dict and destination dict (``od_interpret``)
+    edges
+        e_id of the links to screen (default: all links)
+
+    Returns
+    -------
+    one row per link (e_id, affected pairs and flow, extra cost by component,
+    lost flow), most critical first: by lost flow, then by extra cost
+    """
+    network_dir = Path(network_dir)
+    compiled_network = network_cache.load_network(network_dir)
+    pairs = baseline_pairs(compiled_network, od_inputs, n_workers)
+    edge_names = compiled_network.edge_names
+    if edges is None:
+        graph_edges = list(range(len(edge_names)))
+    else:
+        edge_index = {name: idx for idx, name in enumerate(edge_names)}
+        graph_edges = [edge_index[name] for name in edges if name in edge_index]
+
+    initargs = (network_dir, pairs)
+    if n_workers > 1:
+        with mp.Pool(n_workers, initializer=_init_worker, initargs=initargs) as pool:
+            rows = pool.map(
+                screen_link,
+                graph_edges,
+                chunksize=max(1, len(graph_edges) // (4 * n_workers)),
+            )
+    else:
+        _init_worker(*initargs)
+        rows = [screen_link(edge) for edge in graph_edges]
+
+    screening = pd.DataFrame(rows)
+    screening.insert(0, "e_id", [edge_names[edge] for edge in screening.edge])
+    screening = screening.drop(columns="edge").sort_values(
+        ["lost_flow", "extra_cost"], ascending=False, kind="stable"
+    )
+    return screening.reset_index(drop=True)
+
+
+def evaluate_links(
+    screening: pd.DataFrame,
+    top_n: int,
+    network_dir: Union[str, Path],
+    od_inputs: tuple,
+    model_parameters: dict,
+    output_dir: Union[str, Path],
+    n_workers: int = 1,
+    baseline_paths: Optional[Union[str, Path]] = None,
+) -> pd.DataFrame:
+    """Capacity-constrained runs of the ``top_n`` screened links
+
+    Parameters
+    ----------
+    screening
+        output of ``screen_links``
+    model_parameters, baseline_paths
+        see ``scenarios.run_scenarios``
+
+    Returns
+    -------
+    scenario summary of each link, with the extra costs and non-allocated
+    flow relative to the undisrupted run, most critical first
+    """
+    links = screening.e_id.head(top_n).tolist()
+    summary = scenarios.run_scenarios(
+        [{"name": "base"}]
+        + [{"name": str(e_id), "closed_links": [e_id]} for e_id in links],
+        network_dir,
+        od_inputs,
+        model_parameters,
+        output_dir,
+        n_workers=n_workers,
+        baseline_paths=baseline_paths,
+    )
+    base = summary.iloc[0]
+    summary = summary.iloc[1:].rename(columns={"scenario": "e_id"})
+    summary["e_id"] = links
+    for column in scenarios.SUMMARY_COLUMNS[:5]:
+        summary[f"extra_{column}"] = summary[column] - base[column]
+    summary = summary.sort_values(
+        ["extra_non_allocated_flow", "extra_total_cost"], ascending=False
+    )
+    return summary.drop(columns="closed_links").reset_index(drop=True)
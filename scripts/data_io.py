@@ -0,0 +1,178 @@
+"""Readers of the large input tables
+
+OD matrices are streamed in chunks: only the needed columns are parsed,
+rows are filtered chunk by chunk, and the zone codes of the kept rows are
+stored as categoricals, so the peak memory is about one chunk plus the
+filtered matrix.
+
+``convert_od_matrix`` writes an OD CSV once as Parquet with the zone codes
+dictionary-encoded to int32; the code table (``<name>.zones.parquet``, zone
+of each code) is stored alongside. ``read_od_matrix`` reads either format;
+for Parquet the zone filter is pushed down to the row groups and the codes
+become categoricals without parsing any strings.
+"""
+
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+
+# rows per chunk of streamed CSV files
+CHUNK_SIZE = 1_000_000
+
+
+def read_od_matrix(
+    path: Union[str, Path],
+    zones: Optional[Iterable[str]] = None,
+    col_origin: str = "origins",
+    col_destination: str = "destinations",
+    col_count: str = "counts",
+    chunksize: int = CHUNK_SIZE,
+) -> pd.DataFrame:
+    """OD rows with an origin or a destination in ``zones`` (all rows if
+    None), read chunk by chunk
+
+    Returns
+    -------
+    origin and destination zone codes (categoricals sharing the same
+    categories) and counts, with a fresh index
+    """
+    if zones is not None:
+        zones = pd.Index(pd.unique(np.asarray(list(zones), dtype=object)))
+    if Path(path).suffix == ".parquet":
+        return _read_od_parquet(path, zones, col_origin, col_destination, col_count)
+    parts = []
+    with pd.read_csv(
+        path,
+        usecols=[col_origin, col_destination, col_count],
+        dtype={col_origin: object, col_destination: object, col_count: np.float64},
+        chunksize=chunksize,
+    ) as reader:
+        for chunk in reader:
+            if zones is not None:
+                chunk = chunk[
+                    chunk[col_origin].isin(zones) | chunk[col_destination].isin(zones)
+                ]
+            parts.append(chunk)
+    od_matrix = pd.concat(parts, ignore_index=True)[
+        [col_origin, col_destination, col_count]
+    ]
+    categories = pd.unique(
+        np.concatenate(
+            [od_matrix[col_origin].to_numpy(), od_matrix[col_destination].to_numpy()]
+        )
+    )
+    dtype = pd.CategoricalDtype(np.sort(categories.astype(str)))
+    for column in (col_origin, col_destination):
+        od_matrix[column] = od_matrix[column].astype(dtype)
+    return od_matrix
+
+
+def od_total(
+    path: Union[str, Path], col_count: str = "counts", chunksize: int = CHUNK_SIZE
+) -> float:
+    """Total count of an OD matrix, reading only its count column"""
+    if Path(path).suffix == ".parquet":
+        return float(
+            pq.read_table(path, columns=[col_count]).column(0).to_numpy().sum()
+        )
+    total = 0.0
+    with pd.read_csv(
+        path, usecols=[col_count], dtype=np.float64, chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            total += chunk[col_count].sum()
+    return total
+
+
+def zone_table_path(path: Union[str, Path]) -> Path:
+    """Code table of a converted OD matrix"""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.zones.parquet")
+
+
+def convert_od_matrix(
+    csv_path: Union[str, Path],
+    parquet_path: Union[str, Path],
+    col_origin: str = "origins",
+    col_destination: str = "destinations",
+    col_count: str = "counts",
+    chunksize: int = CHUNK_SIZE,
+) -> None:
+    """Write an OD CSV as Parquet (int32 zone codes, float64 counts), one
+    row group per chunk, with its zone code table"""
+    zones = pd.Index([], dtype=object)
+    schema = pa.schema(
+        [
+            (col_origin, pa.int32()),
+            (col_destination, pa.int32()),
+            (col_count, pa.float64()),
+        ]
+    )
+    with pd.read_csv(
+        csv_path,
+        usecols=[col_origin, col_destination, col_count],
+        dtype={col_origin: object, col_destination: object, col_count: np.float64},
+        chunksize=chunksize,
+    ) as reader, pq.ParquetWriter(parquet_path, schema) as writer:
+        for chunk in reader:
+            # extend the code table with the zones first seen in this chunk
+            new_zones = pd.unique(
+                np.concatenate(
+                    [chunk[col_origin].to_numpy(), chunk[col_destination].to_numpy()]
+                )
+            )
+            new_zones = new_zones[zones.get_indexer(new_zones) < 0]
+            if len(new_zones):
+                zones = zones.append(pd.Index(new_zones, dtype=object))
+            writer.write_table(
+                pa.table(
+                    {
+                        col_origin: zones.get_indexer(chunk[col_origin]).astype(
+                            np.int32
+                        ),
+                        col_destination: zones.get_indexer(
+                            chunk[col_destination]
+                        ).astype(np.int32),
+                        col_count: chunk[col_count].to_numpy(),
+                    },
+                    schema=schema,
+                )
+            )
+    pq.write_table(
+        pa.table({"zone": pa.array(zones.to_numpy(), type=pa.string())}),
+        zone_table_path(parquet_path),
+    )
+
+
+def _read_od_parquet(
+    path: Union[str, Path],
+    zones: Optional[pd.Index],
+    col_origin: str,
+    col_destination: str,
+    col_count: str,
+) -> pd.DataFrame:
+    """OD rows of a converted matrix, filtered on the zone codes"""
+    categories = pq.read_table(zone_table_path(path)).column("zone").to_numpy()
+    filters = None
+    if zones is not None:
+        codes = pd.Index(categories).get_indexer(zones)
+        codes = codes[codes >= 0].astype(np.int32).tolist()
+        filters = [[(col_origin, "in", codes)], [(col_destination, "in", codes)]]
+    table = pq.read_table(
+        path, columns=[col_origin, col_destination, col_count], filters=filters
+    )
+    dtype = pd.CategoricalDtype(pd.Index(categories, dtype=object))
+    od_matrix = pd.DataFrame(
+        {
+            column: pd.Categorical.from_codes(
+                table.column(column).to_numpy(), dtype=dtype
+            )
+            for column in (col_origin, col_destination)
+        }
+    )
+    od_matrix[col_count] = table.column(col_count).to_numpy()
+    return od_matrix
@@ -0,0 +1,187 @@
+"""Disruption runs that reuse the paths of a baseline run
+
+``network_flow_model`` is deterministic: given the same paths, every
+iteration loads the same flows, closes the same edges and leaves the same
+remaining demand. A disruption (closed edges, reduced capacities) therefore
+changes nothing before the first iteration whose baseline paths use a
+disrupted edge.
+
+``PathRecord`` stores the initial weights and capacities of the baseline
+network and the paths routed in every iteration, as flat int32 buffers. A
+disrupted run given that record replays the baseline paths without routing
+up to that first divergent iteration, where only the origins whose baseline
+paths cross an edge with a changed weight are routed again. The paths of
+that iteration then seed a ``routing.PathCache``: in the later iterations
+only the origins whose paths use an edge re-weighted since are routed.
+
+Raising weights only makes paths over those edges longer, so the reused
+paths are still shortest paths; among equal-cost alternatives they may
+differ from the ones a fresh routing would pick.
+"""
+
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+import numpy as np
+
+from routing import PathCache, unpack_paths
+
+
+class PathRecord:
+    """Paths of every iteration of a ``network_flow_model`` run
+
+    Usage::
+
+        record = PathRecord()
+        network_flow_model(..., record_paths=record)  # baseline run
+        record.save(path)
+        network_flow_model(..., baseline_paths=PathRecord.load(path))
+    """
+
+    def __init__(self):
+        # initial weights and capacities by graph edge index
+        self.weights = np.zeros(0)
+        self.capacity = np.zeros(0)
+        # per iteration: origins, path edges, path offsets, paths per origin
+        self.origins: List[np.ndarray] = []
+        self.edges: List[np.ndarray] = []
+        self.offsets: List[np.ndarray] = []
+        self.counts: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return len(self.edges)
+
+    def set_network(self, weights: np.ndarray, capacity: np.ndarray) -> None:
+        """Record the initial weights and capacities (by graph edge index)"""
+        self.weights = np.array(weights, dtype=np.float64)
+        self.capacity = np.array(capacity, dtype=np.float64)
+
+    def add(
+        self,
+        origins: List[int],
+        edges: np.ndarray,
+        offsets: np.ndarray,
+        counts: np.ndarray,
+    ) -> None:
+        """Record the paths of the next iteration: packed paths of all OD
+        pairs (see ``routing.pack_paths``) and the number of pairs of each
+        origin"""
+        self.origins.append(np.asarray(origins, dtype=np.int32))
+        self.edges.append(np.asarray(edges, dtype=np.int32))
+        self.offsets.append(np.asarray(offsets, dtype=np.int64))
+        self.counts.append(np.asarray(counts, dtype=np.int64))
+
+    def paths(self, iteration: int) -> List[List[List[int]]]:
+        """Paths of one iteration (0-based), grouped by origin"""
+        paths = unpack_paths(self.edges[iteration], self.offsets[iteration])
+        bounds = np.zeros(len(self.counts[iteration]) + 1, dtype=np.int64)
+        np.cumsum(self.counts[iteration], out=bounds[1:])
+        return [paths[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def first_divergence(self, changed_edges: np.ndarray) -> int:
+        """First iteration (0-based) whose paths use a changed edge
+        (``len(self)`` if none does)"""
+        for iteration, edges in enumerate(self.edges):
+            if np.isin(edges, changed_edges).any():
+                return iteration
+        return len(self)
+
+    def save(self, path: Union[str, Path]) -> None:
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            capacity=self.capacity,
+            origins=np.concatenate(self.origins),
+            edges=np.concatenate(self.edges),
+            offsets=np.concatenate(self.offsets),
+            counts=np.concatenate(self.counts),
+            origin_bounds=np.cumsum([0] + [len(o) for o in self.origins]),
+            edge_bounds=np.cumsum([0] + [len(e) for e in self.edges]),
+            offset_bounds=np.cumsum([0] + [len(o) for o in self.offsets]),
+            count_bounds=np.cumsum([0] + [len(c) for c in self.counts]),
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "PathRecord":
+        record = cls()
+        with np.load(path) as saved:
+            record.set_network(saved["weights"], saved["capacity"])
+            for field in ("origins", "edges", "offsets", "counts"):
+                bounds = saved[f"{field[:-1]}_bounds"]
+                setattr(record, field, np.split(saved[field], bounds[1:-1]))
+        return record
+
+
+class BaselineReplay:
+    """Routing of a disrupted run from a baseline ``PathRecord``"""
+
+    def __init__(
+        self,
+        record: PathRecord,
+        weights: np.ndarray,
+        capacity: np.ndarray,
+        path_cache: Optional[PathCache] = None,
+    ):
+        """``weights`` and ``capacity``: initial values by graph edge index
+        of the disrupted network; ``path_cache``: cache of the routing
+        function passed to ``route``, seeded with the paths of the divergent
+        iteration"""
+        if len(weights) != len(record.weights):
+            raise ValueError("The network differs from the one of the baseline run")
+        self.record = record
+        self.path_cache = path_cache
+        # edges whose weight or capacity differs from the baseline
+        self.reweighted_edges = np.flatnonzero(weights != record.weights)
+        self.changed_edges = np.union1d(
+            self.reweighted_edges, np.flatnonzero(capacity != record.capacity)
+        )
+        # 0-based iteration where the disrupted run starts to differ
+        self.divergence = record.first_divergence(self.changed_edges)
+
+    def route(
+        self,
+        iteration: int,
+        route_func: Callable[[List[int], List[List[int]]], List[List[List[int]]]],
+        origins: List[int],
+        destinations: List[List[int]],
+    ) -> List[List[List[int]]]:
+        """Paths of an iteration (0-based): replayed before the divergence,
+        re-routed for the origins crossing re-weighted edges at the divergence,
+        and routed through ``route_func`` (and the path cache) afterwards"""
+        if iteration > self.divergence or iteration >= len(self.record):
+            return route_func(origins, destinations)
+        if not np.array_equal(self.record.origins[iteration], origins):
+            raise ValueError(
+                f"Origins of iteration {iteration + 1} differ from the baseline run"
+            )
+        list_of_paths = self.record.paths(iteration)
+        if iteration < self.divergence:
+            return list_of_paths
+
+        # origins with a path over a re-weighted edge
+        edges = self.record.edges[iteration]
+        offsets = self.record.offsets[iteration]
+        hit_count = np.zeros(len(edges) + 1, dtype=np.int64)
+        np.cumsum(np.isin(edges, self.reweighted_edges), out=hit_count[1:])
+        blocked_count = np.zeros(len(offsets), dtype=np.int64)
+        np.cumsum(
+            hit_count[offsets[1:]] > hit_count[offsets[:-1]], out=blocked_count[1:]
+        )
+        bounds = np.zeros(len(origins) + 1, dtype=np.int64)
+        np.cumsum(self.record.counts[iteration], out=bounds[1:])
+        to_route = np.flatnonzero(
+            blocked_count[bounds[1:]] > blocked_count[bounds[:-1]]
+        ).tolist()
+        print(
+            f"Re-routing {len(to_route)} of {len(origins)} origins "
+            f"crossing re-weighted edges (iteration {iteration + 1})"
+        )
+        if to_route:
+            routed = route_func(
+                [origins[i] for i in to_route], [destinations[i] for i in to_route]
+            )
+            for i, paths in zip(to_route, routed):
+                list_of_paths[i] = paths
+        if self.path_cache is not None:
+            self.path_cache.add(origins, destinations, list_of_paths)
+        return list_of_paths
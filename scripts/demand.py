@@ -0,0 +1,233 @@
+"""Origin-destination demand between road nodes in CSR form
+
+OD zones are mapped to their nearest road nodes in one vectorised step and
+the demand is grouped by origin node: the destinations and counts of the
+i-th origin are ``destinations[offsets[i]:offsets[i + 1]]`` and
+``counts[offsets[i]:offsets[i + 1]]``. ``to_dicts`` gives the list/dict
+layout taken by ``functions.network_flow_model``, which converts it back
+(``from_dicts``) and keeps the remaining demand in this form, with vertex
+indices as nodes, for its per-iteration updates.
+"""
+
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# number of unmapped zone codes listed in the summary
+MAX_REPORTED_ZONES = 10
+
+
+class ODDemand:
+    """Demand between unique (origin node, destination node) pairs
+
+    Attributes
+    ----------
+    origins
+        origin nodes (sorted when built from an OD matrix)
+    offsets
+        start of each origin's pairs in ``destinations``/``counts``
+    destinations
+        destination nodes of each origin
+    counts
+        demand of each pair (cars/day)
+    """
+
+    def __init__(
+        self,
+        origins: np.ndarray,
+        offsets: np.ndarray,
+        destinations: np.ndarray,
+        counts: np.ndarray,
+    ):
+        self.origins = np.asarray(origins)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.destinations = np.asarray(destinations)
+        self.counts = np.asarray(counts, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    @classmethod
+    def from_dicts(
+        cls, list_of_origins: list, supply_dict: dict, destination_dict: dict
+    ) -> "ODDemand":
+        """Demand from the list/dict layout, in the order of ``list_of_origins``"""
+        sizes = [len(supply_dict[origin]) for origin in list_of_origins]
+        offsets = np.zeros(len(list_of_origins) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        return cls(
+            _node_array(list_of_origins),
+            offsets,
+            _node_array(
+                [
+                    dest
+                    for origin in list_of_origins
+                    for dest in destination_dict[origin]
+                ]
+            ),
+            np.array(
+                [flow for origin in list_of_origins for flow in supply_dict[origin]],
+                dtype=np.float64,
+            ),
+        )
+
+    def map_nodes(self, node_name_to_index: dict) -> "ODDemand":
+        """The same demand with vertex indices as nodes"""
+        return ODDemand(
+            np.fromiter(
+                (node_name_to_index[name] for name in self.origins),
+                dtype=np.int64,
+                count=len(self.origins),
+            ),
+            self.offsets,
+            np.fromiter(
+                (node_name_to_index[name] for name in self.destinations),
+                dtype=np.int64,
+                count=len(self.destinations),
+            ),
+            self.counts,
+        )
+
+    def pair_origins(self) -> np.ndarray:
+        """Origin of each pair"""
+        return np.repeat(self.origins, np.diff(self.offsets))
+
+    def destination_lists(self) -> list:
+        """Destinations of each origin, as lists"""
+        return [
+            self.destinations[start:end].tolist()
+            for start, end in zip(self.offsets[:-1], self.offsets[1:])
+        ]
+
+    def select(self, keep: np.ndarray, counts: np.ndarray) -> "ODDemand":
+        """Demand of the pairs ``keep`` (boolean mask) with new ``counts``;
+        origins left without pairs are dropped"""
+        kept = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(keep, out=kept[1:])
+        kept_per_origin = kept[self.offsets[1:]] - kept[self.offsets[:-1]]
+        has_pairs = kept_per_origin > 0
+        offsets = np.zeros(has_pairs.sum() + 1, dtype=np.int64)
+        np.cumsum(kept_per_origin[has_pairs], out=offsets[1:])
+        return ODDemand(
+            self.origins[has_pairs],
+            offsets,
+            self.destinations[keep],
+            counts[keep],
+        )
+
+    @classmethod
+    def from_od_matrix(
+        cls,
+        od_matrix: pd.DataFrame,
+        zone_to_node: dict,
+        col_origin: str,
+        col_destination: str,
+        col_count: str,
+    ) -> Tuple["ODDemand", dict]:
+        """Map OD zones to road nodes and sum the demand per node pair
+
+        Rows with a zone missing from ``zone_to_node`` are dropped and
+        summarised once. Demand whose origin and destination map to the same
+        node cannot be routed and is returned separately.
+
+        Returns
+        -------
+        the demand, and the intra-node demand {node: count}
+        """
+        from_node = map_zones(od_matrix[col_origin], zone_to_node)
+        to_node = map_zones(od_matrix[col_destination], zone_to_node)
+        count = od_matrix[col_count].astype(np.float64)
+
+        is_mapped = from_node.notna() & to_node.notna()
+        if not is_mapped.all():
+            report_unmapped_zones(
+                od_matrix.loc[from_node.isna(), col_origin],
+                od_matrix.loc[to_node.isna(), col_destination],
+                count[~is_mapped].sum(),
+            )
+        pairs = pd.DataFrame(
+            {
+                "origin": from_node[is_mapped],
+                "destination": to_node[is_mapped],
+                "count": count[is_mapped],
+            }
+        )
+        is_intra = pairs["origin"] == pairs["destination"]
+        intra_node_dict = pairs[is_intra].groupby("origin")["count"].sum().to_dict()
+        pairs = (
+            pairs[~is_intra]
+            .groupby(["origin", "destination"], sort=True)["count"]
+            .sum()
+            .reset_index()
+        )
+
+        origins, first = np.unique(pairs["origin"].to_numpy(), return_index=True)
+        offsets = np.append(first, len(pairs))
+        demand = cls(
+            origins,
+            offsets,
+            pairs["destination"].to_numpy(),
+            pairs["count"].to_numpy(),
+        )
+        print(
+            f"OD rows: {od_matrix.shape[0]}; "
+            f"unique node pairs: {len(demand)}; "
+            f"intra-node demand: {sum(intra_node_dict.values())} "
+            f"at {len(intra_node_dict)} nodes"
+        )
+        return demand, intra_node_dict
+
+    def to_dicts(self) -> Tuple[list, dict, dict]:
+        """list of origins, {origin: destinations} and {origin: supplies}"""
+        destination_dict = {}
+        supply_dict = {}
+        for i, origin in enumerate(self.origins):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            destination_dict[origin] = self.destinations[start:end].tolist()
+            supply_dict[origin] = self.counts[start:end].tolist()
+        return self.origins.tolist(), destination_dict, supply_dict
+
+
+def _node_array(nodes: list) -> np.ndarray:
+    """Integer node codes as int64 (plain arrays, e.g. for checkpoints),
+    node names as objects"""
+    array = np.array(nodes)
+    if array.dtype.kind in "iu":
+        return array.astype(np.int64)
+    return np.array(nodes, dtype=object)
+
+
+def map_zones(zones: pd.Series, zone_to_node: dict) -> pd.Series:
+    """Zone codes -> node names or vertex indices (NaN if unmapped), looked
+    up once per distinct zone"""
+    if not isinstance(zones.dtype, pd.CategoricalDtype):
+        zones = zones.astype("category")
+    # object array: integer node codes stay integers; code -1 (missing zone)
+    # picks the trailing NaN
+    nodes = np.array(
+        [zone_to_node.get(zone, np.nan) for zone in zones.cat.categories] + [np.nan],
+        dtype=object,
+    )
+    return pd.Series(nodes[zones.cat.codes.to_numpy()], index=zones.index)
+
+
+def report_unmapped_zones(
+    origin_zones: pd.Series, destination_zones: pd.Series, lost_demand: float
+) -> None:
+    """One summary of the OD zones without an accessible road node"""
+    for label, zones in (
+        ("home/origin", origin_zones),
+        ("workplace/destination", destination_zones),
+    ):
+        if len(zones) == 0:
+            continue
+        unique_zones = pd.unique(zones)
+        examples = ", ".join(map(str, unique_zones[:MAX_REPORTED_ZONES]))
+        if len(unique_zones) > MAX_REPORTED_ZONES:
+            examples += ", ..."
+        print(
+            f"No accessible network node attached to {len(unique_zones)} "
+            f"{label} zones ({len(zones)} OD rows): {examples}"
+        )
+    print(f"OD demand dropped for unmapped zones: {lost_demand}")
@@ -0,0 +1,174 @@
+"""Array-backed edge state for the network flow model
+
+Edge properties and the accumulated flow, remaining capacity and speed are
+held as contiguous NumPy arrays indexed by a dense integer edge id (the row
+order of the road link table). Bulk updates are scatter/gather operations
+on those arrays instead of rebuilding string-keyed dicts.
+"""
+
+from typing import Iterable, Optional, Union
+
+import numpy as np
+import geopandas as gpd  # type: ignore
+
+import constants as cons
+import kernels
+
+
+class EdgeState:
+    """Edge attributes and accumulated state of a road network
+
+    Attributes
+    ----------
+    e_id
+        edge names, position = dense edge id
+    index
+        edge name -> dense edge id
+    class_code
+        road class codes (see ``kernels.encode_road_classes``)
+    urban
+        urban flags
+    length
+        edge lengths (miles)
+    toll
+        average toll costs (£/car)
+    flow
+        accumulated edge flows (cars/day)
+    capacity
+        remaining edge capacities (cars/day)
+    speed
+        average flow rates (miles/hour)
+    cost, time_cost, operate_cost
+        total, time-equivalent and operating travel costs of the edges (£)
+    closed
+        edges closed to traffic (saturated)
+    """
+
+    FIELDS = (
+        "class_code",
+        "urban",
+        "length",
+        "toll",
+        "flow",
+        "capacity",
+        "speed",
+        "cost",
+        "time_cost",
+        "operate_cost",
+        "closed",
+    )
+
+    def __init__(
+        self,
+        e_id: Iterable,
+        class_code: np.ndarray,
+        urban: np.ndarray,
+        length: np.ndarray,
+        toll: np.ndarray,
+        flow: np.ndarray,
+        capacity: np.ndarray,
+        speed: np.ndarray,
+        index: Optional[dict] = None,
+    ):
+        if isinstance(e_id, np.ndarray) and e_id.dtype == object:
+            self.e_id = e_id  # never modified: may be shared
+        else:
+            self.e_id = np.asarray(list(e_id), dtype=object)
+        # edge name -> dense edge id (built unless given, e.g. shared)
+        if index is None:
+            index = {name: idx for idx, name in enumerate(self.e_id)}
+        self.index = index
+        self.class_code = np.asarray(class_code, dtype=np.int8)
+        self.urban = np.asarray(urban, dtype=bool)
+        self.length = np.asarray(length, dtype=np.float64)
+        self.toll = np.asarray(toll, dtype=np.float64)
+        self.flow = np.array(flow, dtype=np.float64)
+        self.capacity = np.array(capacity, dtype=np.float64)
+        self.speed = np.array(speed, dtype=np.float64)
+        self.cost = np.zeros(len(self.e_id))
+        self.time_cost = np.zeros(len(self.e_id))
+        self.operate_cost = np.zeros(len(self.e_id))
+        self.closed = np.zeros(len(self.e_id), dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.e_id)
+
+    @classmethod
+    def from_road_links(
+        cls, road_links: gpd.GeoDataFrame, col_eid: str = "e_id"
+    ) -> "EdgeState":
+        """Build the state from road links prepared by
+        ``label_urban_roads`` and ``initialise_igraph_network``"""
+        return cls(
+            e_id=road_links[col_eid],
+            class_code=kernels.encode_road_classes(
+                road_links["combined_label"].to_numpy()
+            ),
+            # missing urban labels are treated as urban, as in speed_flow_func
+            urban=road_links["urban"].to_numpy() != 0,
+            length=road_links.geometry.length.to_numpy() * cons.CONV_METER_TO_MILE,
+            toll=road_links["average_toll_cost"].to_numpy(),
+            flow=road_links["acc_flow"].to_numpy(),
+            capacity=road_links["acc_capacity"].to_numpy(),
+            speed=road_links["ave_flow_rate"].to_numpy(),
+        )
+
+    def ids(self, names: Iterable) -> np.ndarray:
+        """Edge names -> dense edge ids"""
+        index = self.index
+        return np.fromiter((index[name] for name in names), dtype=np.intp)
+
+    def gather(self, field: str, idx: np.ndarray) -> np.ndarray:
+        return getattr(self, field)[idx]
+
+    def scatter(self, field: str, idx: np.ndarray, values: np.ndarray) -> None:
+        getattr(self, field)[idx] = values
+
+    def set_costs(self, idx: np.ndarray) -> np.ndarray:
+        """Recompute the travel costs of edges ``idx`` from their current
+        speeds and return the total costs (edge weights)"""
+        speed = self.speed[idx]
+        time = self.length[idx] / speed  # hour
+        voc = kernels.voc_array(speed)  # £/km
+        cost, time_cost, operate_cost = kernels.cost_array(
+            time, self.length[idx], voc, self.toll[idx]
+        )
+        self.cost[idx] = cost
+        self.time_cost[idx] = time_cost
+        self.operate_cost[idx] = operate_cost
+        return cost
+
+    def load_costs(
+        self,
+        cost_dict: Optional[dict],
+        timecost_dict: Optional[dict],
+        operatecost_dict: Optional[dict],
+    ):
+        """Fill the cost arrays from {edge name: cost} dicts; arrays whose
+        dict is None keep their values (e.g. costs loaded beforehand)"""
+        for field, cost_dict_ in (
+            ("cost", cost_dict),
+            ("time_cost", timecost_dict),
+            ("operate_cost", operatecost_dict),
+        ):
+            if cost_dict_ is None:
+                continue
+            self.scatter(
+                field,
+                self.ids(cost_dict_.keys()),
+                np.fromiter(cost_dict_.values(), float),
+            )
+
+    def to_dict(self, field: str) -> dict:
+        """{edge name: value} view of one field"""
+        return dict(zip(self.e_id.tolist(), getattr(self, field).tolist()))
+
+
+def as_edge_state(
+    road_links: Union[gpd.GeoDataFrame, EdgeState], col_eid: str = "e_id"
+) -> EdgeState:
+    """Edge state of prepared road links, or the given edge state itself
+    (e.g. from ``network_cache.CompiledNetwork.edge_state``)"""
+    if isinstance(road_links, EdgeState):
+        return road_links
+    return EdgeState.from_road_links(road_links, col_eid)
@@ -0,0 +1,139 @@
+# %%
+from pathlib import Path
+import os
+import pandas as pd
+import geopandas as gpd  # type: ignore
+
+from utils import load_config
+import functions as func
+import data_io
+import network_cache
+import scenarios
+
+import json
+import warnings
+
+warnings.simplefilter("ignore")
+
+base_path = Path(load_config()["paths"]["base_path"])
+base_path /= "processed_data"
+casestudy_path = Path(load_config()["paths"]["casestudy_path"])
+
+# %%
+"""
+Batch runs of the flow model over flood scenarios (non-interactive).
+
+list of inputs:
+ - Parameter dicts.
+ - Compiled road network (see network_cache; built on the first run).
+ - Population-weighed centroids of admin units.
+ - O-D matrix (*travel to work by car).
+ - Scenarios: inputs/flood_scenarios.json, a list of
+   {"name", "closed_links", "capacity_factors"} (see scenarios.py);
+   without it, the flooded road links of parameters/flooded_road_links.json.
+"""
+
+# model parameters
+with open(base_path / "parameters" / "flow_breakpoint_dict.json", "r") as f:
+    flow_breakpoint_dict = json.load(f)
+
+with open(base_path / "parameters" / "flow_cap_dict.json", "r") as f:
+    flow_capacity_dict = json.load(f)
+
+with open(base_path / "parameters" / "free_flow_speed_dict.json", "r") as f:
+    free_flow_speed_dict = json.load(f)
+
+with open(base_path / "parameters" / "min_speed_cap.json", "r") as f:
+    min_speed_cap = json.load(f)
+
+with open(base_path / "parameters" / "urban_speed_cap.json", "r") as f:
+    urban_speed_cap = json.load(f)
+
+# scenarios
+scenario_file = casestudy_path / "inputs" / "flood_scenarios.json"
+if scenario_file.exists():
+    scenario_list = scenarios.load_scenarios(scenario_file)
+else:
+    with open(base_path / "parameters" / "flooded_road_links.json", "r") as f:
+        flooded_road_list = json.load(f)
+    scenario_list = [
+        {"name": "base"},
+        {"name": "flooded", "closed_links": flooded_road_list},
+    ]
+print(f"The number of scenarios: {len(scenario_list)}")
+
+# %%
+# undisrupted road network (closures are applied per scenario)
+road_path = base_path / "networks" / "road"
+compiled_network = network_cache.compile_road_network(
+    road_path, flow_capacity_dict, free_flow_speed_dict
+)
+
+# population-weighted centroids (combined spatial units)
+zone_centroids = gpd.read_parquet(
+    base_path / "census_datasets" / "admin_pwc" / "zone_pwc.geoparquet"
+)
+
+# %%
+#!!! for case study
+oa_selected = pd.read_csv(casestudy_path / "inputs" / "oa_selected.csv")
+oa_set = set(oa_selected.OA21CD.unique())
+
+#!!!  O-D matrix (selected-OA, 2011): converted once to Parquet with int32
+# zone codes, then read keeping the rows from or to the selected OAs
+od_path = base_path / "census_datasets" / "od_matrix"
+if not (od_path / "od_gb_2011_disaggregate_oa.parquet").exists():
+    data_io.convert_od_matrix(
+        od_path / "od_gb_2011_disaggregate_oa.csv",
+        od_path / "od_gb_2011_disaggregate_oa.parquet",
+    )
+od_df = data_io.read_od_matrix(
+    od_path / "od_gb_2011_disaggregate_oa.parquet", zones=oa_set
+)
+od_df.rename(
+    columns={
+        "origins": "Area of usual residence",
+        "destinations": "Area of workplace",
+        "counts": "car",
+    },
+    inplace=True,
+)
+
+# %%
+# find the nearest road node for each zone
+zone_to_node = func.find_nearest_node(
+    zone_centroids,
+    compiled_network.road_nodes(),
+    cache_path=base_path / "census_datasets" / "admin_pwc" / "zone_to_node.npz",
+)
+# zones -> vertex indices: the model works on integer node codes
+node_name_to_index = compiled_network.node_name_to_index
+zone_to_vertex = {zone: node_name_to_index[node] for zone, node in zone_to_node.items()}
+# attach od info of each zone to their nearest road network nodes
+list_of_origin_nodes, dict_of_destination_nodes, dict_of_origin_supplies, _ = (
+    func.od_interpret(
+        od_df,
+        zone_to_vertex,
+        col_origin="Area of usual residence",
+        col_destination="Area of workplace",
+        col_count="car",
+    )
+)
+
+# %%
+# flow simulation of all scenarios
+summary = scenarios.run_scenarios(
+    scenario_list,
+    road_path / "compiled" / "base",
+    (list_of_origin_nodes, dict_of_origin_supplies, dict_of_destination_nodes),
+    {
+        "free_flow_speed_dict": free_flow_speed_dict,
+        "flow_breakpoint_dict": flow_breakpoint_dict,
+        "min_speed_cap": min_speed_cap,
+        "urban_speed_cap": urban_speed_cap,
+        "col_eid": "e_id",
+    },
+    casestudy_path / "outputs" / "scenarios",
+    n_workers=os.cpu_count() or 1,
+)
+print(summary)
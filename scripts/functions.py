@@ -1,6 +1,6 @@
 # %%
+import os
 from typing import Union, Tuple
-from collections import defaultdict
 from functools import partial
 import numpy as np
 import pandas as pd
@@ -9,9 +9,27 @@ import geopandas as gpd  # type: ignore
 import igraph  # type: ignore
 
 import constants as cons
-from utils import get_flow_on_edges
+import kernels
+import checkpoint
+from delta import BaselineReplay, PathRecord
+from demand import ODDemand
+from edge_state import EdgeState, as_edge_state
+from metrics import NULL_METRICS, Metrics
+from routing import (
+    ParallelRouter,
+    PathCache,
+    find_shortest_paths,
+    find_shortest_paths_packed,
+    pack_paths,
+)
+from snapping import snap_zones
+from urban_mask import load_or_build_urban_mask
+from utils import (
+    build_path_flow_matrix,
+    content_hash,
+    get_flow_on_edges_from_matrix,
+)
 
-from tqdm.auto import tqdm
 import warnings
 
 warnings.simplefilter("ignore")
@@ -54,44 +72,61 @@ def select_partial_roads(
 
 
 # urban road classification
-def create_urban_mask(etisplus_urban_roads: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+def create_urban_mask(
+    etisplus_urban_roads: gpd.GeoDataFrame,
+    n_workers: int = 1,
+    tile_size: float = 50_000,
+    cache_dir: Union[str, None] = None,
+) -> gpd.GeoDataFrame:
     etisplus_urban_roads = etisplus_urban_roads[
         etisplus_urban_roads["Urban"] == 1
     ].reset_index(drop=True)
-    buf_geom = etisplus_urban_roads.geometry.buffer(
-        500
-    )  # create a buffer of 500 meters
-    uni_geom = buf_geom.unary_union  # feature union within the same layer
-    temp = gpd.GeoDataFrame(geometry=[uni_geom])
-    new_geom = (
-        temp.explode()
-    )  # explode multi-polygons into separate individual polygons
-    cvx_geom = (
-        new_geom.convex_hull
-    )  # generate convex polygon for each individual polygon
-
-    urban_mask = gpd.GeoDataFrame(
-        geometry=cvx_geom[0], crs=etisplus_urban_roads.crs
+    # convex hulls of the separate polygons of the union of 500-meter buffers,
+    # built per tile of tile_size meters (see urban_mask.build_urban_mask)
+    urban_mask = load_or_build_urban_mask(
+        etisplus_urban_roads,
+        cache_dir=cache_dir,
+        buffer_distance=500,
+        tile_size=tile_size,
+        n_workers=n_workers,
     ).to_crs("27700")
     return urban_mask
 
 
 def label_urban_roads(
-    road_links: gpd.GeoDataFrame, urban_mask: gpd.GeoDataFrame
+    road_links: gpd.GeoDataFrame,
+    urban_mask: gpd.GeoDataFrame,
+    cache_path: Union[str, None] = None,
 ) -> gpd.GeoDataFrame:
-    temp_file = road_links.sjoin(urban_mask, how="left")
-    temp_file["urban"] = temp_file["index_right"].apply(
-        lambda x: 0 if pd.isna(x) else 1
-    )
-    max_values = temp_file.groupby("e_id")["urban"].max()
-    road_links = road_links.merge(max_values, on="e_id", how="left")
+    # urban = 1 if the link intersects any urban polygon, from one bulk
+    # STRtree query (pairs of link/polygon positions, no joined frame)
+    urban = None
+    if cache_path is not None:
+        key = content_hash(
+            b"".join(road_links.geometry.to_wkb()),
+            b"".join(urban_mask.geometry.to_wkb()),
+        )
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                if str(cached["key"]) == key:
+                    urban = cached["urban"]
+    if urban is None:
+        link_idx, _ = urban_mask.sindex.query(
+            road_links.geometry, predicate="intersects"
+        )
+        urban = np.zeros(road_links.shape[0], dtype=np.int64)
+        urban[link_idx] = 1
+        if cache_path is not None:
+            np.savez(cache_path, key=key, urban=urban)
+    road_links = road_links.reset_index(drop=True)
+    road_links["urban"] = urban
     return road_links
 
 
 def voc_func(speed: float) -> float:  # speed: mile/hour
     # d = distance * conv_mile_to_km  # km
     s = speed * cons.CONV_MILE_TO_KM  # km/hour
-    lpkm = 0.178 - 0.00299 * s + 0.0000205 * (s**2)  # fuel cost (liter/km)
+    lpkm = 0.178 - 0.00299 * s + 0.0000205 * (s * s)  # fuel cost (liter/km)
     voc = 140 * lpkm * cons.PENCE_TO_POUND  # average petrol cost: 140 pence/liter
     return voc  # pound/km
 
@@ -103,8 +138,8 @@ def cost_func(
     voc: float,
     toll: float,
 ) -> Tuple[float, float, float]:  # time: hour, distance: mile/hour, voc: pound/km
-    ave_occ = 1.6
-    vot = 20  # value of time: pounds/hour
+    ave_occ = cons.AVERAGE_OCCUPANCY
+    vot = cons.VALUE_OF_TIME  # value of time: pounds/hour
     d = distance * cons.CONV_MILE_TO_KM  # km
     c_time = time * ave_occ * vot
     c_operating = d * voc
@@ -204,25 +239,23 @@ def filter_less_than_one(arr: np.ndarray) -> np.ndarray:
 
 
 # find nearest network node for each admin centroid
-def find_nearest_node(zones: gpd.GeoDataFrame, road_nodes: gpd.GeoDataFrame) -> dict:
-    nearest_node_dict = {}  # node_idx: zone_idx
-    for zidx, z in zones.iterrows():
-        closest_road_node = road_nodes.sindex.nearest(z.geometry, return_all=False)[1][
-            0
-        ]
-        # for the first [x]:
-        #   [0] represents the index of geometry;
-        #   [1] represents the index of gdf
-        # the second [x] represents the No. of closest item in the returned list,
-        #   which only return one nearest node in this case
-        nearest_node_dict[zidx] = closest_road_node
-
-    zone_to_node = {}
-    for zidx in range(zones.shape[0]):
-        z = zones.loc[zidx, "code"]
-        nidx = nearest_node_dict[zidx]
-        n = road_nodes.loc[nidx, "nd_id"]
-        zone_to_node[z] = n
+def find_nearest_node(
+    zones: gpd.GeoDataFrame,
+    road_nodes: gpd.GeoDataFrame,
+    max_distance: Union[float, None] = None,
+    cache_path: Union[str, None] = None,
+) -> dict:
+    # one bulk KD-tree query for all zone centroids (see snapping.snap_zones);
+    # zones without a node within max_distance are left out of the mapping
+    nearest_nodes = snap_zones(
+        zones,
+        road_nodes,
+        col_zone="code",
+        col_node="nd_id",
+        max_distance=max_distance,
+        cache_path=cache_path,
+    )
+    zone_to_node = dict(zip(nearest_nodes["code"], nearest_nodes["nd_id"]))
 
     return zone_to_node
 
@@ -230,39 +263,23 @@ def find_nearest_node(zones: gpd.GeoDataFrame, road_nodes: gpd.GeoDataFrame) ->
 # interpret od matrix
 # {list of origins,
 # list of destinations attached to each origin,
-# list of supplies from each origin}
+# list of supplies from each origin,
+# intra-node demand (origin node == destination node)}
 def od_interpret(
     od_matrix: pd.DataFrame,
     zone_to_node: dict,
     col_origin: str,
     col_destination: str,
     col_count: str,
-) -> Tuple[list, dict, dict]:
-
-    list_of_origins = []
-    destination_dict: dict[str, list[str]] = defaultdict(list)
-    supply_dict: dict[str, list[float]] = defaultdict(list)
-
-    for idx in tqdm(range(od_matrix.shape[0]), desc="Processing"):
-        from_zone = od_matrix.loc[idx, col_origin]
-        to_zone = od_matrix.loc[idx, col_destination]
-        count: float = od_matrix.loc[idx, col_count]  # type: ignore
-        try:
-            from_node = zone_to_node[from_zone]
-        except KeyError:
-            print(f"No accessible network node to attached to home/origin {from_zone}!")
-        try:
-            to_node = zone_to_node[to_zone]
-        except KeyError:
-            print(
-                f"No accessible network node attached to workplace/destination {to_zone}!"
-            )
-
-        list_of_origins.append(from_node)  # origin
-        destination_dict[from_node].append(to_node)  # origin -> destinations
-        supply_dict[from_node].append(count)  # origin -> supply
-
-    return list_of_origins, destination_dict, supply_dict
+) -> Tuple[list, dict, dict, dict]:
+    # OD zones snapped to the same pair of road nodes are merged, and demand
+    # within a single node is reported instead of being routed
+    # (dict view of demand.ODDemand)
+    od_demand, intra_node_dict = ODDemand.from_od_matrix(
+        od_matrix, zone_to_node, col_origin, col_destination, col_count
+    )
+    list_of_origins, destination_dict, supply_dict = od_demand.to_dicts()
+    return list_of_origins, destination_dict, supply_dict, intra_node_dict
 
 
 # network creation
@@ -272,56 +289,45 @@ def create_igraph_network(
     road_nodes: gpd.GeoDataFrame,
     initialSpeeds: dict,
 ) -> Tuple[igraph.Graph, dict]:
+    # vertex names: (id, {x, y})
+    node_x = road_nodes.geometry.x.tolist()
+    node_y = road_nodes.geometry.y.tolist()
     nodeList = [
-        (
-            name_to_index[node.id],
-            {
-                "lon": node.geometry.x,
-                "lat": node.geometry.y,
-            },
-        )
-        for _, node in road_nodes.iterrows()
-    ]  # (id, {x, y})
-
-    edgeNameList = []
-    edgeList = []
-    edgeLengthList = []
-    edgeTypeList = []
-    edgeFormList = []
-    edgeTollList = []
-    for _, link in road_links.iterrows():
-        edge_name = link.e_id
-        edge_from = link.from_id
-        edge_to = link.to_id
-        edge_length = link.geometry.length * cons.CONV_METER_TO_MILE  # miles
-        edge_type = link.road_classification[0]
-        edge_form = link.form_of_way
-        edge_toll = link.average_toll_cost
-        edgeNameList.append(edge_name)
-        edgeList.append((name_to_index[edge_from], name_to_index[edge_to]))
-        edgeLengthList.append(edge_length)
-        edgeTypeList.append(edge_type)
-        edgeFormList.append(edge_form)
-        edgeTollList.append(edge_toll)
-
-    edgeSpeedList = np.vectorize(initial_speed_func)(
-        edgeTypeList,
-        edgeFormList,
+        (idx, {"lon": x, "lat": y})
+        for idx, x, y in zip(road_nodes.id.map(name_to_index).tolist(), node_x, node_y)
+    ]
+
+    edgeNameList = road_links.e_id.tolist()
+    edgeList = np.column_stack(
+        [
+            road_links.from_id.map(name_to_index).to_numpy(),
+            road_links.to_id.map(name_to_index).to_numpy(),
+        ]
+    ).tolist()
+    edgeLengthList = (
+        road_links.geometry.length.to_numpy() * cons.CONV_METER_TO_MILE
+    )  # miles
+    edgeTypeList = road_links.road_classification.str[0].to_numpy()
+    edgeFormList = road_links.form_of_way.to_numpy()
+    edgeTollList = road_links.average_toll_cost.to_numpy(dtype=np.float64)
+
+    edgeSpeedList = kernels.initial_speed_array(
+        kernels.encode_initial_classes(edgeTypeList, edgeFormList),
         initialSpeeds,
     )  # miles/hour
 
     # travel time
-    timeList = np.array(edgeLengthList) / np.array(edgeSpeedList)  # hour
+    timeList = edgeLengthList / edgeSpeedList  # hour
 
     # total travel cost (time-equivalent)
-    vocList = np.vectorize(voc_func)(edgeSpeedList)  # £/km
-    costList, timeCostList, operateCostList = np.vectorize(cost_func)(
+    vocList = kernels.voc_array(edgeSpeedList)  # £/km
+    costList, timeCostList, operateCostList = kernels.cost_array(
         timeList, edgeLengthList, vocList, edgeTollList
     )  # hour
     weightList = costList.tolist()  # pounds
 
-    test_net = igraph.Graph(directed=False)
-    test_net.add_vertices(nodeList)
+    test_net = igraph.Graph(n=len(nodeList), directed=False)
+    test_net.vs["name"] = nodeList
     test_net.vs["nd_id"] = road_nodes.id.tolist()
     test_net.add_edges(edgeList)
     test_net.es["edge_name"] = edgeNameList
@@ -364,112 +370,100 @@ def initialise_igraph_network(
     return road_links
 
 
-def update_od_matrix(
-    temp_flow_matrix: pd.DataFrame,
-    supply_dict: dict,
-    destination_dict: dict,
-) -> Tuple[list, dict, dict, float]:
-    # drop the origin-destination pairs ("path = []")
-    temp_df = temp_flow_matrix[temp_flow_matrix["path"].apply(lambda x: len(x) == 0)]
-    non_allocated_flow = temp_df.flow.sum()
+def count_non_allocated_flow(demand: ODDemand, has_path: np.ndarray) -> float:
+    """Flow of the OD pairs without a path (cut off by closed edges)
+
+    These pairs keep their full remaining flow, unscaled by r, and it is
+    reported as non-allocated when they are dropped. (Pairs without a path
+    used to be filtered out before the scaling, unreported, so the
+    non-allocated flow was always 0.)
+    """
+    non_allocated_flow = demand.counts[~has_path].sum()
     print(f"Non_allocated_flow: {non_allocated_flow}")
+    return non_allocated_flow
 
-    for _, row in temp_df.iterrows():
-        origin_temp = row["origin"]
-        destination_temp = row["destination"]
-        idx_temp = destination_dict[origin_temp].index(destination_temp)
-        destination_dict[origin_temp].remove(destination_temp)
-        del supply_dict[origin_temp][idx_temp]
-
-    # drop origins with zero supply
-    new_supply_dict = {}
-    new_destination_dict = {}
-    new_list_of_origins = []
-    for origin, list_of_counts in supply_dict.items():
-        tt_supply = sum(list_of_counts)
-        if tt_supply > 0:
-            new_list_of_origins.append(origin)
-            new_counts = [od_flow for od_flow in list_of_counts if od_flow != 0]
-            new_supply_dict[origin] = new_counts
-            new_destination_dict[origin] = [
-                dest
-                for idx, dest in enumerate(destination_dict[origin])
-                if list_of_counts[idx] != 0
-            ]
-
-    return (
-        new_list_of_origins,
-        new_supply_dict,
-        new_destination_dict,
-        non_allocated_flow,
-    )
+
+def update_od_matrix(
+    demand: ODDemand,
+    remaining_flow: np.ndarray,
+    has_path: np.ndarray,
+) -> Tuple[ODDemand, float]:
+    """Drop the OD pairs without a path (their flow is not allocated) and
+    those without remaining flow
+
+    Parameters
+    ----------
+    demand
+        demand routed in the current iteration
+    remaining_flow
+        flow of each pair left after the iteration
+    has_path
+        pairs with a path
+
+    Returns
+    -------
+    remaining demand, and the non-allocated flow
+    """
+    non_allocated_flow = count_non_allocated_flow(demand, has_path)
+    keep = has_path & (remaining_flow != 0)
+    return demand.select(keep, remaining_flow), non_allocated_flow
 
 
 def update_network_structure(
     network: igraph.Graph,
-    length_dict: dict,
-    speed_dict: dict,
-    toll_dict: dict,
-    temp_edge_flow: pd.DataFrame,
-) -> Tuple[igraph.Graph, dict, dict]:
-    zero_capacity_edges = set(
-        temp_edge_flow.loc[temp_edge_flow["remaining_capacity"] < 1, "e_id"].tolist()
-    )
-    net_edges = network.es["edge_name"]
-    idx_to_remove = [
-        idx for idx, element in enumerate(net_edges) if element in zero_capacity_edges
-    ]
-
-    # drop links that have reached their full capacities
-    network.delete_edges(idx_to_remove)
-    number_of_edges = len(list(network.es))
+    edge_state: EdgeState,
+    edge_idx: np.ndarray,
+    graph_edges: np.ndarray,
+) -> igraph.Graph:
+    """Close the saturated edges and re-weight the other loaded edges
+
+    Saturated edges are not deleted: they get an infinite weight, which the
+    router treats as a closed edge, so graph edge indices stay stable for the
+    whole run. Only the weights of the edges loaded in this iteration change.
+
+    Parameters
+    ----------
+    network
+        igraph network
+    edge_state
+        accumulated edge states
+    edge_idx
+        dense edge id of each graph edge
+    graph_edges
+        graph indices of the edges loaded in the current iteration
+
+    Returns
+    -------
+    network with updated edge weights
+    """
+    loaded_edges = edge_idx[graph_edges]
+    is_saturated = edge_state.capacity[loaded_edges] < 1
+
+    # close links that have reached their full capacities
+    closed_edges = graph_edges[is_saturated]
+    edge_state.closed[loaded_edges[is_saturated]] = True
+    network.es[closed_edges.tolist()]["weight"] = np.inf
+    number_of_edges = len(edge_state) - edge_state.closed.sum()
     print(f"The remaining number of edges in the network: {number_of_edges}")
 
     # update edge weights (time: seconds)
-    remaining_edges = network.es["edge_name"]
-    lengthList = list(
-        map(length_dict.get, filter(length_dict.__contains__, remaining_edges))
-    )
-    speedList = list(
-        map(speed_dict.get, filter(speed_dict.__contains__, remaining_edges))
-    )
-    timeList = np.where(
-        np.array(speedList) != 0, np.array(lengthList) / np.array(speedList), np.nan
-    )  # hours (omg: here has some problems!!!)
-    tollList = list(map(toll_dict.get, filter(toll_dict.__contains__, remaining_edges)))
+    open_edges = graph_edges[~is_saturated]
+    lengthList = edge_state.length[edge_idx[open_edges]]
+    speedList = edge_state.speed[edge_idx[open_edges]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        timeList = np.where(
+            speedList != 0, lengthList / speedList, np.nan
+        )  # hours (omg: here has some problems!!!)
 
     if np.isnan(timeList).any():
         print("ERROR: Network contains congested edges.")
         exit()
     else:
-        vocList = np.vectorize(voc_func)(speedList)
-        costList, timeCostList, operateCostList = np.vectorize(cost_func)(
-            timeList, lengthList, vocList, tollList
-        )  # hours
-        weightList = costList.tolist()  # pounds
-        network.es["weight"] = weightList
-
-        # update idx_to_name dict
-        edge_index_to_name = {
-            idx: name for idx, name in enumerate(network.es["edge_name"])
-        }
         # estimate edge traveling cost (£)
-        edge_cost_dict = dict(
-            zip(
-                network.es["edge_name"],
-                weightList,
-            )
-        )
-        edge_timecost_dict = dict(zip(network.es["edge_name"], timeCostList))
-        edge_operatecost_dict = dict(zip(network.es["edge_name"], operateCostList))
-
-    return (
-        network,
-        edge_index_to_name,
-        edge_cost_dict,
-        edge_timecost_dict,
-        edge_operatecost_dict,
-    )
+        weightList = edge_state.set_costs(edge_idx[open_edges]).tolist()  # pounds
+        network.es[open_edges.tolist()]["weight"] = weightList
+
+    return network
 
 
 def map_tuple(tup: Tuple, mapping: dict) -> Tuple:
@@ -486,11 +480,11 @@ def cauculate_total_weight(list_of_paths: list, network: igraph.Graph) -> float:
 
 def network_flow_model(
     network: igraph.Graph,
-    edge_cost_dict: dict,
-    edge_timeC_dict: dict,
-    edge_operateC_dict: dict,
-    road_links: gpd.GeoDataFrame,
-    node_name_to_index: dict,
+    edge_cost_dict: Union[dict, None],
+    edge_timeC_dict: Union[dict, None],
+    edge_operateC_dict: Union[dict, None],
+    road_links: Union[gpd.GeoDataFrame, EdgeState],
+    node_name_to_index: Union[dict, None],
     edge_index_to_name: dict,
     list_of_origins: list,
     supply_dict: dict,
@@ -500,7 +494,18 @@ def network_flow_model(
     min_speed_cap: dict,
     urban_speed_cap: dict,
     col_eid: str,
-) -> Tuple[dict, dict, dict]:
+    n_workers: int = 1,
+    incremental: bool = False,
+    reroute_tolerance: float = 0.0,
+    return_summary: bool = False,
+    record_paths: Union[PathRecord, None] = None,
+    baseline_paths: Union[PathRecord, None] = None,
+    checkpoint_path: Union[str, None] = None,
+    checkpoint_every: Union[int, None] = 1,
+    checkpoint_interval: Union[float, None] = None,
+    resume: bool = False,
+    metrics: Union[Metrics, None] = None,
+) -> Union[Tuple[dict, dict, dict], Tuple[dict, dict, dict, dict]]:
 
     # record total cost of travelling: weight * flow
     total_cost = 0
@@ -508,168 +513,245 @@ def network_flow_model(
     operating_cost = 0
     toll_cost = 0
 
-    partial_speed_flow_func = partial(
-        speed_flow_func,
+    partial_speed_flow_array = partial(
+        kernels.speed_flow_array,
         free_flow_speed_dict=free_flow_speed_dict,
         flow_breakpoint_dict=flow_breakpoint_dict,
         min_speed_cap=min_speed_cap,
         urban_speed_cap=urban_speed_cap,
     )
 
-    total_remain = sum(sum(values) for values in supply_dict.values())
+    # remaining demand as flat arrays: origin and destination vertex indices
+    # and flow of each OD pair
+    demand = ODDemand.from_dicts(list_of_origins, supply_dict, destination_dict)
+    if node_name_to_index is not None:
+        demand = demand.map_nodes(node_name_to_index)
+    total_remain = demand.counts.sum()
     print(f"The initial total supply is {total_remain}")
     number_of_edges = len(list(network.es))
     print(f"The initial number of edges in the network: {number_of_edges}")
-    print(f"The initial number of origins: {len(list_of_origins)}")
-    number_of_destinations = sum(len(value) for value in destination_dict.values())
-    print(f"The initial number of destinations: {number_of_destinations}")
-
-    # road link properties
-    edge_cbtype_dict = road_links.set_index(col_eid)["combined_label"].to_dict()
-    edge_isUrban_dict = road_links.set_index(col_eid)["urban"].to_dict()
-    edge_length_dict = (
-        road_links.set_index(col_eid)["geometry"].length * cons.CONV_METER_TO_MILE
-    ).to_dict()
-    edge_toll_dict = road_links.set_index(col_eid)[
-        "average_toll_cost"
-    ].to_dict()  # tolls
-
-    acc_flow_dict = road_links.set_index(col_eid)["acc_flow"].to_dict()
-    acc_capacity_dict = road_links.set_index(col_eid)["acc_capacity"].to_dict()
-    acc_speed_dict = road_links.set_index(col_eid)["ave_flow_rate"].to_dict()
+    print(f"The initial number of origins: {len(demand.origins)}")
+    print(f"The initial number of destinations: {len(demand)}")
+    # per-iteration records (stage timings, RSS, counts and totals)
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    # road link properties and accumulated states
+    edge_state = as_edge_state(road_links, col_eid)
+    # (cost dicts of None: the edge state holds the initial costs already)
+    edge_state.load_costs(edge_cost_dict, edge_timeC_dict, edge_operateC_dict)
+    # graph edge index -> dense edge id
+    edge_idx = edge_state.ids(
+        edge_index_to_name[idx] for idx in range(network.ecount())
+    )
+    # edges closed beforehand (e.g. disrupted links) carry infinite weights
+    initial_weights = np.array(network.es["weight"], dtype=np.float64)
+    edge_state.closed[edge_idx[np.isinf(initial_weights)]] = True
+    if record_paths is not None:
+        record_paths.set_network(initial_weights, edge_state.capacity[edge_idx])
+    # shortest-path phase: serial, or sharded over a process pool
+    router = ParallelRouter(n_workers) if n_workers > 1 else None
+    changed_edges = None  # graph edges re-weighted since the last routing
+    path_cache = (
+        PathCache(initial_weights, reroute_tolerance)
+        if incremental or baseline_paths is not None
+        else None
+    )
+    # replay the paths of an undisrupted run up to the first iteration
+    # whose paths use a disrupted edge; from there on, the paths are reused
+    # through the path cache
+    replay = None
+    if baseline_paths is not None:
+        replay = BaselineReplay(
+            baseline_paths, initial_weights, edge_state.capacity[edge_idx], path_cache
+        )
+        print(
+            f"Baseline paths are replayed up to iteration {replay.divergence + 1} "
+            f"of {len(baseline_paths)}"
+        )
 
     # starts
     iter_flag = 1
     total_non_allocated_flow = 0
+    # periodic checkpoints of the iteration state (background writes)
+    checkpointer = None
+    if checkpoint_path is not None:
+        checkpointer = checkpoint.Checkpointer(
+            checkpoint_path, checkpoint_every, checkpoint_interval
+        )
+        state = checkpoint.load_checkpoint(checkpoint_path) if resume else None
+        if state is not None:
+            iter_flag, demand, totals, changed_edges = checkpoint.restore(
+                state, network, edge_state, path_cache
+            )
+            total_cost = totals["total_cost"]
+            time_equiv_cost = totals["time_equiv_cost"]
+            operating_cost = totals["operating_cost"]
+            toll_cost = totals["toll_cost"]
+            total_non_allocated_flow = totals["total_non_allocated_flow"]
+            total_remain = totals["total_remain"]
+            print(f"Resumed from the checkpoint at iteration {iter_flag}")
+
+    metrics.emit(
+        "run_start",
+        iteration=iter_flag,
+        origins=len(demand.origins),
+        pairs=len(demand),
+        edges=network.ecount(),
+        total_supply=total_remain,
+    )
     while total_remain > 0:
         print(f"No.{iter_flag} iteration starts:")
-        list_of_spath = []
+        metrics.start_iteration(iter_flag)
+        routed_pairs = len(demand)
         # find the shortest path for each origin-destination pair
-        for i in tqdm(range(len(list_of_origins)), desc="Processing"):
-            name_of_origin_node = list_of_origins[i]
-            idx_of_origin_node = node_name_to_index[name_of_origin_node]
-            list_of_name_destination_node = destination_dict[
-                name_of_origin_node
-            ]  # a list of destination nodes
-            list_of_idx_destination_node = [
-                node_name_to_index[i] for i in list_of_name_destination_node
-            ]
-            flows = supply_dict[name_of_origin_node]
-            paths = network.get_shortest_paths(
-                v=idx_of_origin_node,
-                to=list_of_idx_destination_node,  #!!! debug here
-                weights="weight",
-                mode="out",
-                output="epath",
+        list_of_idx_origin_node = demand.origins.tolist()
+        list_of_idx_destination_node = demand.destination_lists()
+        # routers returning lists of paths per origin, and packed paths
+        # (flat int32 edge buffer + offsets)
+        if router is None:
+            route = partial(
+                find_shortest_paths, network, closed=edge_state.closed[edge_idx]
             )
-            # [origin, destination list, path list, flow list]
-            list_of_spath.append(
-                [name_of_origin_node, list_of_name_destination_node, paths, flows]
+            packed_route = partial(
+                find_shortest_paths_packed,
+                network,
+                closed=edge_state.closed[edge_idx],
             )
-
-        # calculate od flow matrix
-        # [origin, destination, path, flow]
-        temp_flow_matrix = pd.DataFrame(
-            list_of_spath,
-            columns=[
-                "origin",
-                "destination",
-                "path",
-                "flow",
-            ],
-        ).explode(["destination", "path", "flow"])
+        else:
+            router.update(network, changed_edges=changed_edges)
+            route = router.route
+            packed_route = router.route_packed
+        if path_cache is not None:
+            # re-route only the origins whose paths use re-weighted edges
+            if changed_edges is not None:
+                path_cache.update_weights(
+                    changed_edges, network.es[changed_edges.tolist()]["weight"]
+                )
+            route = partial(path_cache.route, route)
+        # paths of all OD pairs as one flat int32 edge buffer plus offsets
+        if replay is not None:
+            list_of_paths = replay.route(
+                iter_flag - 1,
+                route,
+                list_of_idx_origin_node,
+                list_of_idx_destination_node,
+            )
+        elif path_cache is not None:
+            list_of_paths = route(list_of_idx_origin_node, list_of_idx_destination_node)
+        else:
+            list_of_paths = None
+            path_edges, path_offsets = packed_route(
+                list_of_idx_origin_node, list_of_idx_destination_node
+            )
+        if list_of_paths is not None:
+            path_edges, path_offsets = pack_paths(
+                [path for paths in list_of_paths for path in paths]
+            )
+            del list_of_paths
+        if record_paths is not None:
+            record_paths.add(
+                list_of_idx_origin_node,
+                path_edges,
+                path_offsets,
+                np.diff(demand.offsets),
+            )
+        metrics.lap("routing")
+        path_lengths = np.diff(path_offsets)
+        # OD pairs without a path (cut off by closed edges) are not loaded
+        has_path = path_lengths > 0
+        if not has_path.any():
+            # every remaining pair is cut off: nothing left to load
+            non_allocated_flow = count_non_allocated_flow(demand, has_path)
+            total_non_allocated_flow += non_allocated_flow
+            if metrics.enabled:
+                metrics.end_iteration(
+                    routed_pairs=routed_pairs,
+                    unrouted_pairs=routed_pairs,
+                    loaded_edges=0,
+                    total_remain=0.0,
+                    non_allocated_flow=non_allocated_flow,
+                    total_non_allocated_flow=total_non_allocated_flow,
+                    total_cost=total_cost,
+                    time_equiv_cost=time_equiv_cost,
+                    operating_cost=operating_cost,
+                    toll_cost=toll_cost,
+                )
+            print("Iteration stops: no remaining OD pair has a path.")
+            break
 
         # calculate edge flows
-        # [edge_name, flow]
-        temp_edge_flow = get_flow_on_edges(temp_flow_matrix, col_eid, "path", "flow")
-        temp_edge_flow[col_eid] = temp_edge_flow[col_eid].map(
-            edge_index_to_name
-        )  # edge name
-
-        # road form -> combined type
-        temp_edge_flow["combined_label"] = temp_edge_flow[col_eid].map(edge_cbtype_dict)
-        temp_edge_flow["isUrban"] = temp_edge_flow[col_eid].map(
-            edge_isUrban_dict
-        )  # urban/suburban
-        temp_edge_flow["temp_acc_flow"] = temp_edge_flow[col_eid].map(
-            acc_flow_dict
-        )  # flow
-        temp_edge_flow["temp_acc_capacity"] = temp_edge_flow[col_eid].map(
-            acc_capacity_dict
-        )  # capacity
-        temp_edge_flow["est_overflow"] = (
-            temp_edge_flow["flow"] - temp_edge_flow["temp_acc_capacity"]
-        )  # estimated overflow: positive -> has overflow
-
-        max_overflow = temp_edge_flow["est_overflow"].max()
+        # (OD pair x edge) flow matrix -> flow on each loaded graph edge
+        path_flow_matrix = build_path_flow_matrix(
+            path_edges, path_lengths, demand.counts, network.ecount()
+        )
+        graph_edges = np.flatnonzero(path_flow_matrix.getnnz(axis=0))
+        loaded_edges = edge_idx[graph_edges]
+        edge_flow = get_flow_on_edges_from_matrix(path_flow_matrix)[graph_edges]
+
+        temp_acc_flow = edge_state.gather("flow", loaded_edges)
+        temp_acc_capacity = edge_state.gather("capacity", loaded_edges)
+        # estimated overflow: positive -> has overflow
+        max_overflow = (edge_flow - temp_acc_capacity).max()
         print(f"The maximum amount of overflow of edges: {max_overflow}")
+        metrics.lap("loading")
 
         # break
         if max_overflow <= 0:
-            temp_edge_flow["total_flow"] = (
-                temp_edge_flow["flow"] + temp_edge_flow["temp_acc_flow"]
-            )
-            temp_edge_flow["speed"] = np.vectorize(partial_speed_flow_func)(
-                temp_edge_flow["combined_label"],
-                temp_edge_flow["isUrban"],
-                temp_edge_flow["total_flow"],
-            )
-            temp_edge_flow["remaining_capacity"] = (
-                temp_edge_flow["temp_acc_capacity"] - temp_edge_flow["flow"]
-            )
-            # update dicts
-            # accumulated edge flows
-            temp_dict = temp_edge_flow.set_index(col_eid)["total_flow"].to_dict()
-            acc_flow_dict.update(
-                {key: temp_dict[key] for key in acc_flow_dict.keys() & temp_dict.keys()}
-            )
-            # average flow rate
-            temp_dict = temp_edge_flow.set_index(col_eid)["speed"].to_dict()
-            acc_speed_dict.update(
-                {
-                    key: temp_dict[key]
-                    for key in acc_speed_dict.keys() & temp_dict.keys()
-                }
-            )
-            # accumulated remaining capacities
-            temp_dict = temp_edge_flow.set_index(col_eid)[
-                "remaining_capacity"
-            ].to_dict()
-            acc_capacity_dict.update(
-                {
-                    key: temp_dict[key]
-                    for key in acc_capacity_dict.keys() & temp_dict.keys()
-                }
+            total_flow = edge_flow + temp_acc_flow
+            # update edge states
+            edge_state.scatter("flow", loaded_edges, total_flow)
+            edge_state.scatter(
+                "speed",
+                loaded_edges,
+                partial_speed_flow_array(
+                    edge_state.gather("class_code", loaded_edges),
+                    edge_state.gather("urban", loaded_edges),
+                    total_flow,
+                ),
             )
+            edge_state.scatter("capacity", loaded_edges, temp_acc_capacity - edge_flow)
+            metrics.lap("speed_update")
 
             #!!! update traveling costs (£)
-            temp_cost = (
-                temp_edge_flow["e_id"].map(edge_cost_dict) * temp_edge_flow["flow"]
-            )
-            total_cost += temp_cost.sum()
-            temp_cost = (
-                temp_edge_flow["e_id"].map(edge_timeC_dict) * temp_edge_flow["flow"]
-            )
-            time_equiv_cost += temp_cost.sum()
-            temp_cost = (
-                temp_edge_flow["e_id"].map(edge_operateC_dict) * temp_edge_flow["flow"]
-            )
-            operating_cost += temp_cost.sum()
-            temp_cost = (
-                temp_edge_flow["e_id"].map(edge_toll_dict) * temp_edge_flow["flow"]
-            )
-            toll_cost += temp_cost.sum()
+            total_cost += (edge_state.gather("cost", loaded_edges) * edge_flow).sum()
+            time_equiv_cost += (
+                edge_state.gather("time_cost", loaded_edges) * edge_flow
+            ).sum()
+            operating_cost += (
+                edge_state.gather("operate_cost", loaded_edges) * edge_flow
+            ).sum()
+            toll_cost += (edge_state.gather("toll", loaded_edges) * edge_flow).sum()
+
+            # OD pairs without a path
+            non_allocated_flow = count_non_allocated_flow(demand, has_path)
+            total_non_allocated_flow += non_allocated_flow
+            metrics.lap("costs")
+            if metrics.enabled:
+                metrics.end_iteration(
+                    routed_pairs=routed_pairs,
+                    unrouted_pairs=int((~has_path).sum()),
+                    loaded_edges=len(graph_edges),
+                    saturated_edges=int((edge_state.capacity[loaded_edges] < 1).sum()),
+                    max_overflow=max_overflow,
+                    r=1.0,
+                    total_remain=0.0,
+                    non_allocated_flow=non_allocated_flow,
+                    total_non_allocated_flow=total_non_allocated_flow,
+                    total_cost=total_cost,
+                    time_equiv_cost=time_equiv_cost,
+                    operating_cost=operating_cost,
+                    toll_cost=toll_cost,
+                )
 
             print("Iteration stops: there is no edge overflow.")
             break
 
         # calculate the ratio of flow adjustment (0 < r < 1)
-        temp_edge_flow["r"] = np.where(
-            temp_edge_flow["flow"] != 0,
-            temp_edge_flow["temp_acc_capacity"] / temp_edge_flow["flow"],
-            np.nan,
-        )
-        r = temp_edge_flow.r.min()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = np.nanmin(
+                np.where(edge_flow != 0, temp_acc_capacity / edge_flow, np.nan)
+            )
         if r < 0:
             print("Error: negative r!")
             break
@@ -681,89 +763,101 @@ def network_flow_model(
             break
         print(f"r = {r}")  # set as NaN when flow is zero
 
-        # update flow matrix
-        temp_flow_matrix = temp_flow_matrix[
-            temp_flow_matrix["path"].apply(lambda x: len(x) != 0)
-        ]
-        temp_flow_matrix["flow"] = temp_flow_matrix["flow"] * r
-
         # update edge flows
-        temp_edge_flow["adjusted_flow"] = temp_edge_flow["flow"] * r
-        temp_edge_flow["total_flow"] = (
-            temp_edge_flow.temp_acc_flow + temp_edge_flow.adjusted_flow
-        )
-        temp_edge_flow["speed"] = np.vectorize(partial_speed_flow_func)(
-            temp_edge_flow.combined_label,
-            temp_edge_flow.isUrban,
-            temp_edge_flow.total_flow,
-        )
-        temp_edge_flow["remaining_capacity"] = (
-            temp_edge_flow.temp_acc_capacity - temp_edge_flow.adjusted_flow
-        )
-        temp_edge_flow.loc[
-            temp_edge_flow.remaining_capacity < 0, "remaining_capacity"
-        ] = 0.0  # capacity is non-negative
+        path_flow_matrix.data *= r
+        adjusted_flow = get_flow_on_edges_from_matrix(path_flow_matrix)[graph_edges]
+        total_flow = temp_acc_flow + adjusted_flow
+        # capacity is non-negative
+        remaining_capacity = np.maximum(temp_acc_capacity - adjusted_flow, 0.0)
+        metrics.lap("loading")
 
         #!!! update total cost of travelling
-        temp_cost = temp_edge_flow["e_id"].map(edge_cost_dict) * temp_edge_flow["flow"]
-        total_cost += temp_cost.sum()
-        temp_cost = temp_edge_flow["e_id"].map(edge_timeC_dict) * temp_edge_flow["flow"]
-        time_equiv_cost += temp_cost.sum()
-        temp_cost = (
-            temp_edge_flow["e_id"].map(edge_operateC_dict) * temp_edge_flow["flow"]
-        )
-        operating_cost += temp_cost.sum()
-        temp_cost = temp_edge_flow["e_id"].map(edge_toll_dict) * temp_edge_flow["flow"]
-        toll_cost += temp_cost.sum()
-
-        # update dicts
-        # accumulated flows
-        temp_dict = temp_edge_flow.set_index(col_eid)["total_flow"].to_dict()
-        acc_flow_dict.update(
-            {key: temp_dict[key] for key in acc_flow_dict.keys() & temp_dict.keys()}
-        )
-        # average flow rate
-        temp_dict = temp_edge_flow.set_index(col_eid)["speed"].to_dict()
-        acc_speed_dict.update(
-            {key: temp_dict[key] for key in acc_speed_dict.keys() & temp_dict.keys()}
-        )
-        # accumulated remaining capacities
-        temp_dict = temp_edge_flow.set_index(col_eid)["remaining_capacity"].to_dict()
-        acc_capacity_dict.update(
-            {key: temp_dict[key] for key in acc_capacity_dict.keys() & temp_dict.keys()}
+        total_cost += (edge_state.gather("cost", loaded_edges) * edge_flow).sum()
+        time_equiv_cost += (
+            edge_state.gather("time_cost", loaded_edges) * edge_flow
+        ).sum()
+        operating_cost += (
+            edge_state.gather("operate_cost", loaded_edges) * edge_flow
+        ).sum()
+        toll_cost += (edge_state.gather("toll", loaded_edges) * edge_flow).sum()
+        metrics.lap("costs")
+
+        # update edge states
+        edge_state.scatter("flow", loaded_edges, total_flow)
+        edge_state.scatter(
+            "speed",
+            loaded_edges,
+            partial_speed_flow_array(
+                edge_state.gather("class_code", loaded_edges),
+                edge_state.gather("urban", loaded_edges),
+                total_flow,
+            ),
         )
+        edge_state.scatter("capacity", loaded_edges, remaining_capacity)
+        metrics.lap("speed_update")
 
-        # if remaining supply < 1 -> 0
-        supply_dict = {
-            k: filter_less_than_one(np.array(v) * (1 - r)).tolist()
-            for k, v in supply_dict.items()
-        }
-        total_remain = sum(sum(values) for values in supply_dict.values())
-        print(f"The total remaining supply is: {total_remain}")
+        # if remaining supply < 1 -> 0; the flow of OD pairs without a path
+        # is counted as non-allocated by update_od_matrix
+        remaining_flow = filter_less_than_one(demand.counts * (1 - r))
 
         # update od matrix
-        list_of_origins, supply_dict, destination_dict, non_allocated_flow = (
-            update_od_matrix(temp_flow_matrix, supply_dict, destination_dict)
-        )
+        demand, non_allocated_flow = update_od_matrix(demand, remaining_flow, has_path)
+        total_remain = demand.counts.sum()
+        print(f"The total remaining supply is: {total_remain}")
 
         total_non_allocated_flow += non_allocated_flow  # record the overall flow loss
-        number_of_destinations = sum(len(value) for value in destination_dict.values())
-        print(f"The remaining number of origins: {len(list_of_origins)}")
-        print(f"The remaining number of destinations: {number_of_destinations}")
+        print(f"The remaining number of origins: {len(demand.origins)}")
+        print(f"The remaining number of destinations: {len(demand)}")
+        metrics.lap("demand_update")
 
         # update network structure (nodes and edges)
         #!!! update edge-related costs
-        (
-            network,
-            edge_index_to_name,
-            edge_cost_dict,
-            edge_timeC_dict,
-            edge_operateC_dict,
-        ) = update_network_structure(
-            network, edge_length_dict, acc_speed_dict, edge_toll_dict, temp_edge_flow
-        )
+        network = update_network_structure(network, edge_state, edge_idx, graph_edges)
+        changed_edges = graph_edges
+        metrics.lap("graph_update")
 
         iter_flag += 1
+        if checkpointer is not None and checkpointer.due(iter_flag):
+            checkpointer.save(
+                checkpoint.snapshot(
+                    iter_flag,
+                    network,
+                    edge_state,
+                    demand,
+                    {
+                        "total_cost": total_cost,
+                        "time_equiv_cost": time_equiv_cost,
+                        "operating_cost": operating_cost,
+                        "toll_cost": toll_cost,
+                        "total_non_allocated_flow": total_non_allocated_flow,
+                        "total_remain": total_remain,
+                    },
+                    changed_edges,
+                    path_cache,
+                )
+            )
+            metrics.lap("checkpoint")
+        if metrics.enabled:
+            metrics.end_iteration(
+                routed_pairs=routed_pairs,
+                unrouted_pairs=int((~has_path).sum()),
+                loaded_edges=len(graph_edges),
+                saturated_edges=int((edge_state.capacity[loaded_edges] < 1).sum()),
+                max_overflow=max_overflow,
+                r=r,
+                total_remain=total_remain,
+                non_allocated_flow=non_allocated_flow,
+                total_non_allocated_flow=total_non_allocated_flow,
+                total_cost=total_cost,
+                time_equiv_cost=time_equiv_cost,
+                operating_cost=operating_cost,
+                toll_cost=toll_cost,
+            )
+
+    if router is not None:
+        router.close()
+    if checkpointer is not None:
+        checkpointer.close()
 
     print("The flow simulation is completed!")
     print(f"total travel cost is (£): {total_cost}")
@@ -771,4 +865,28 @@ def network_flow_model(
     print(f"total operating cost is (£): {operating_cost}")
     print(f"total toll cost is (£): {toll_cost}")
     print(f"The total non-allocated flow is {total_non_allocated_flow}")
-    return acc_speed_dict, acc_flow_dict, acc_capacity_dict
+    metrics.emit(
+        "run_end",
+        iterations=iter_flag,
+        total_cost=total_cost,
+        time_equiv_cost=time_equiv_cost,
+        operating_cost=operating_cost,
+        toll_cost=toll_cost,
+        non_allocated_flow=total_non_allocated_flow,
+    )
+    results = (
+        edge_state.to_dict("speed"),
+        edge_state.to_dict("flow"),
+        edge_state.to_dict("capacity"),
+    )
+    if return_summary:
+        summary = {
+            "total_cost": total_cost,
+            "time_equiv_cost": time_equiv_cost,
+            "operating_cost": operating_cost,
+            "toll_cost": toll_cost,
+            "non_allocated_flow": total_non_allocated_flow,
+            "iterations": iter_flag,
+        }
+        return (*results, summary)
+    return results
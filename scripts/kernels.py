@@ -0,0 +1,125 @@
+"""Vectorised edge performance kernels
+
+Array counterparts of the scalar speed, vehicle operating cost and travel cost
+functions in ``functions.py``. Each kernel evaluates a whole set of edges in a
+few NumPy passes and returns exactly the values of its scalar twin.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+import constants as cons
+
+# combined road labels (M, A_single, A_dual, B) -> integer class codes
+ROAD_CLASSES = ("M", "A_single", "A_dual", "B")
+CLASS_CODES = {label: code for code, label in enumerate(ROAD_CLASSES)}
+UNKNOWN_CLASS = -1
+
+# speed decrease per unit of hourly flow above the breakpoint
+# (B roads keep a constant speed)
+SPEED_FLOW_SLOPES = {"M": 0.033, "A_single": 0.05, "A_dual": 0.033, "B": 0.0}
+
+
+def encode_road_classes(labels: np.ndarray) -> np.ndarray:
+    """Convert combined road labels into int8 class codes
+    (-1 for labels outside M/A_single/A_dual/B)"""
+    labels = np.asarray(labels, dtype=object)
+    codes = np.full(labels.shape, UNKNOWN_CLASS, dtype=np.int8)
+    for label, code in CLASS_CODES.items():
+        codes[labels == label] = code
+    return codes
+
+
+def encode_initial_classes(
+    road_types: np.ndarray, forms_of_road: np.ndarray
+) -> np.ndarray:
+    """Class codes following the branching of ``initial_speed_func``:
+    A roads are single carriageways only if the form is exactly
+    "Single Carriageway"."""
+    road_types = np.asarray(road_types, dtype=object)
+    forms_of_road = np.asarray(forms_of_road, dtype=object)
+    codes = np.full(road_types.shape, UNKNOWN_CLASS, dtype=np.int8)
+    codes[road_types == "M"] = CLASS_CODES["M"]
+    codes[road_types == "B"] = CLASS_CODES["B"]
+    is_a = road_types == "A"
+    codes[is_a] = CLASS_CODES["A_dual"]
+    codes[is_a & (forms_of_road == "Single Carriageway")] = CLASS_CODES["A_single"]
+    return codes
+
+
+def class_lookup(param_dict: dict, codes: np.ndarray) -> np.ndarray:
+    """Look up a per-class parameter for every edge (NaN if not defined)"""
+    table = np.array(
+        [float(param_dict.get(label, np.nan)) for label in ROAD_CLASSES] + [np.nan]
+    )
+    # UNKNOWN_CLASS (-1) picks the trailing NaN
+    return table[np.asarray(codes, dtype=np.intp)]
+
+
+def initial_speed_array(codes: np.ndarray, free_flow_speed_dict: dict) -> np.ndarray:
+    """Free-flow speeds (miles/hour), see ``initial_speed_func``"""
+    return class_lookup(free_flow_speed_dict, codes)
+
+
+def speed_flow_array(
+    codes: np.ndarray,
+    isurban: np.ndarray,
+    vp: np.ndarray,
+    free_flow_speed_dict: dict,
+    flow_breakpoint_dict: dict,
+    min_speed_cap: dict,
+    urban_speed_cap: dict,
+) -> np.ndarray:
+    """Flow-dependent speeds (miles/hour), see ``speed_flow_func``
+
+    Parameters
+    ----------
+    codes
+        road class codes from ``encode_road_classes``
+    isurban
+        urban flags (non-zero -> urban)
+    vp
+        accumulated edge flows (cars/day)
+    """
+    codes = np.asarray(codes, dtype=np.intp)
+    vp = np.asarray(vp, dtype=np.float64) / 24
+    initial_speed = class_lookup(free_flow_speed_dict, codes)
+    flow_breakpoint = class_lookup(flow_breakpoint_dict, codes)
+    slope = class_lookup(SPEED_FLOW_SLOPES, codes)
+    with np.errstate(invalid="ignore"):
+        congested = (vp > flow_breakpoint) & (codes != CLASS_CODES["B"])
+        vt = np.where(
+            congested,
+            np.maximum(
+                initial_speed - slope * (vp - flow_breakpoint),
+                class_lookup(min_speed_cap, codes),
+            ),
+            initial_speed,
+        )
+        urban = np.asarray(isurban) != 0
+        return np.where(urban, np.minimum(class_lookup(urban_speed_cap, codes), vt), vt)
+
+
+def voc_array(speed: np.ndarray) -> np.ndarray:
+    """Vehicle operating costs (£/km), see ``voc_func``"""
+    s = np.asarray(speed, dtype=np.float64) * cons.CONV_MILE_TO_KM  # km/hour
+    lpkm = 0.178 - 0.00299 * s + 0.0000205 * (s * s)  # fuel cost (liter/km)
+    return 140 * lpkm * cons.PENCE_TO_POUND
+
+
+def cost_array(
+    time: np.ndarray,
+    distance: np.ndarray,
+    voc: np.ndarray,
+    toll: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Total, time-equivalent and operating costs (£), see ``cost_func``"""
+    time = np.asarray(time, dtype=np.float64)
+    d = np.asarray(distance, dtype=np.float64) * cons.CONV_MILE_TO_KM  # km
+    voc = np.asarray(voc, dtype=np.float64)
+    toll = np.asarray(toll, dtype=np.float64)
+    c_time = time * cons.AVERAGE_OCCUPANCY * cons.VALUE_OF_TIME
+    c_operating = d * voc
+    cost = time * cons.AVERAGE_OCCUPANCY * cons.VALUE_OF_TIME + d * voc + toll
+    return cost, c_time, c_operating
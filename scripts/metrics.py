@@ -0,0 +1,136 @@
+"""Structured metrics of network flow model runs
+
+``Metrics`` times the stages of each iteration and writes JSON records to a
+sink: one ``"stage"`` record per stage (``lap`` marks the end of a stage),
+one ``"iteration"`` record per iteration (stage timings, wall time, RSS and
+the fields given by the model) and free-form records such as
+``"run_start"``/``"run_end"``. Sinks are any object with
+``write(record: dict)`` (and optionally ``close()``):
+
+- ``JSONLSink``: one JSON line per record, appended to a file;
+- ``StdoutSink``: JSON lines on stdout;
+- ``MemorySink``: records kept in a list.
+
+Usage::
+
+    metrics = Metrics(JSONLSink("run.jsonl"))
+    network_flow_model(..., metrics=metrics)
+    metrics.close()
+
+Without metrics (the default) the model calls the no-op methods of
+``NULL_METRICS`` and skips computing the record fields.
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process (None where /proc is missing)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _to_json(value):
+    # numpy scalars and arrays
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+class JSONLSink:
+    def __init__(self, path: Union[str, Path]):
+        self._file = open(path, "a", buffering=1)  # line buffered
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, default=_to_json) + "\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class StdoutSink:
+    def write(self, record: dict) -> None:
+        sys.stdout.write(json.dumps(record, default=_to_json) + "\n")
+
+
+class MemorySink:
+    def __init__(self):
+        self.records: List[dict] = []
+
+    def write(self, record: dict) -> None:
+        self.records.append(record)
+
+
+class Metrics:
+    """Stage timings and per-iteration records of one or more runs"""
+
+    enabled = True
+
+    def __init__(self, sink, stage_records: bool = True):
+        self.sink = sink
+        self.stage_records = stage_records
+        self.iteration: Optional[int] = None
+        self._stages: dict = {}
+        self._iteration_start = self._lap_start = time.perf_counter()
+
+    def emit(self, event: str, **fields) -> None:
+        self.sink.write({"event": event, "time": time.time(), **fields})
+
+    def start_iteration(self, iteration: int) -> None:
+        self.iteration = iteration
+        self._stages = {}
+        self._iteration_start = self._lap_start = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        """End a stage of the current iteration: the time since the end of
+        the previous stage (repeated stages add up)"""
+        now = time.perf_counter()
+        seconds = now - self._lap_start
+        self._lap_start = now
+        self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+        if self.stage_records:
+            self.emit("stage", iteration=self.iteration, stage=stage, seconds=seconds)
+
+    def end_iteration(self, **fields) -> None:
+        """Write the iteration record"""
+        self.emit(
+            "iteration",
+            iteration=self.iteration,
+            seconds=time.perf_counter() - self._iteration_start,
+            stages=self._stages,
+            rss=rss_bytes(),
+            **fields,
+        )
+
+    def close(self) -> None:
+        if hasattr(self.sink, "close"):
+            self.sink.close()
+
+
+class NullMetrics:
+    """Disabled metrics"""
+
+    enabled = False
+
+    def emit(self, event: str, **fields) -> None:
+        pass
+
+    def start_iteration(self, iteration: int) -> None:
+        pass
+
+    def lap(self, stage: str) -> None:
+        pass
+
+    def end_iteration(self, **fields) -> None:
+        pass
+
+
+NULL_METRICS = NullMetrics()
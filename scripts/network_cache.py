@@ -0,0 +1,411 @@
+"""Compiled, memory-mappable road network
+
+The prepared network (selected roads, urban labels, tolls, initial costs,
+capacities and speeds) is written once to a directory of .npy files:
+
+- topology: edge end points by edge index, also as a text edge list
+  (``edges.txt``, read by igraph's C reader), plus a CSR adjacency
+  (``indptr``, ``adjacency``, ``adjacency_edge``) for array-based backends;
+- node ids and coordinates, edge names and the edge attribute arrays of
+  ``edge_state.EdgeState``, and the road link row of each graph edge
+  (``edge_idx``);
+- the initial edge costs (weights, time-equivalent and operating costs);
+- the prepared road link table (``road_links.geoparquet``), read only to
+  export results;
+- ``manifest.json``, holding the cache key, written last.
+
+Arrays are loaded with ``mmap_mode="r"``, so several processes mapping the
+same directory share the pages read-only; the name mappings and the igraph
+graph (which cannot be shared) are built once per process, on first use.
+The key is a hash of the input file contents and the parameter dicts (see
+``network_key``).
+"""
+
+import hashlib
+import json
+import os
+from functools import cached_property
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd  # type: ignore
+import igraph  # type: ignore
+
+import functions as func
+from edge_state import EdgeState
+from utils import content_hash
+
+MANIFEST = "manifest.json"
+EDGE_LIST = "edges.txt"
+# bumped when the saved arrays change, so older caches are rebuilt
+CACHE_VERSION = 2
+# content digests of the input files, by file fingerprint
+FILE_DIGESTS = "file_digests.json"
+
+ARRAYS = (
+    "edges",
+    "indptr",
+    "adjacency",
+    "adjacency_edge",
+    "node_id",
+    "node_index",
+    "node_x",
+    "node_y",
+    "edge_name",
+    "edge_idx",
+    "e_id",
+    "class_code",
+    "urban",
+    "length",
+    "toll",
+    "capacity",
+    "speed",
+    "cost",
+    "time_cost",
+    "operate_cost",
+)
+
+
+def file_fingerprint(path: Union[str, Path]) -> str:
+    """Path, size and modification time of an input file"""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def file_digest(path: Union[str, Path], digests: dict) -> str:
+    """Content hash of an input file, reused from ``digests`` (fingerprint
+    -> digest) while the file's size and modification time are unchanged"""
+    fingerprint = file_fingerprint(path)
+    if fingerprint not in digests:
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                digest.update(block)
+        digests[fingerprint] = digest.hexdigest()
+    return digests[fingerprint]
+
+
+def network_key(
+    input_files: list, digest_path: Optional[Path] = None, **parameters
+) -> str:
+    """Cache key of a network built from ``input_files`` with ``parameters``
+    (JSON-serialisable values, e.g. the parameter dicts and scenario)
+
+    Input files are identified by their contents; with ``digest_path`` the
+    digests are stored there and only recomputed for files whose size or
+    modification time changed.
+    """
+    digests = {}
+    if digest_path is not None and Path(digest_path).exists():
+        with open(digest_path) as f:
+            digests = json.load(f)
+    stored = dict(digests)
+    file_digests = [file_digest(path, digests) for path in input_files]
+    if digest_path is not None:
+        # keep the digests of the current files only
+        current = {file_fingerprint(path) for path in input_files}
+        digests = {fp: digest for fp, digest in digests.items() if fp in current}
+        if digests != stored:
+            Path(digest_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(digest_path, "w") as f:
+                json.dump(digests, f)
+    return content_hash(
+        CACHE_VERSION,
+        *file_digests,
+        json.dumps(parameters, sort_keys=True, default=str),
+    )
+
+
+def _string_array(values) -> np.ndarray:
+    """Fixed-width array (object arrays cannot be memory-mapped)"""
+    array = np.asarray(values)
+    return array.astype(str) if array.dtype == object else array
+
+
+def save_network(
+    cache_dir: Union[str, Path],
+    key: str,
+    network: igraph.Graph,
+    road_links: gpd.GeoDataFrame,
+    edge_timeC_dict: dict,
+    edge_operateC_dict: dict,
+    col_eid: str = "e_id",
+) -> None:
+    """Write the network built by ``create_igraph_network`` (its weights
+    are the initial costs), its time-equivalent and operating cost dicts,
+    and the road links prepared by ``initialise_igraph_network``"""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest = cache_dir / MANIFEST
+    if manifest.exists():
+        manifest.unlink()  # invalid while the arrays are rewritten
+
+    edge_state = EdgeState.from_road_links(road_links, col_eid)
+    edges = np.array(network.get_edgelist(), dtype=np.int32).reshape(-1, 2)
+    # CSR adjacency: both directions of every edge, grouped by vertex
+    tails = np.concatenate([edges[:, 0], edges[:, 1]])
+    order = np.argsort(tails, kind="stable")
+    indptr = np.zeros(network.vcount() + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=network.vcount()), out=indptr[1:])
+    names = network.vs["name"]
+    edge_names = network.es["edge_name"]
+    arrays = {
+        "edges": edges,
+        "indptr": indptr,
+        "adjacency": np.concatenate([edges[:, 1], edges[:, 0]])[order],
+        "adjacency_edge": np.tile(np.arange(len(edges), dtype=np.int32), 2)[order],
+        "node_id": _string_array(network.vs["nd_id"]),
+        "node_index": np.array([name[0] for name in names], dtype=np.int64),
+        "node_x": np.array([name[1]["lon"] for name in names], dtype=np.float64),
+        "node_y": np.array([name[1]["lat"] for name in names], dtype=np.float64),
+        "edge_name": _string_array(edge_names),
+        "edge_idx": edge_state.ids(edge_names),
+        "e_id": _string_array(edge_state.e_id.tolist()),
+        "class_code": edge_state.class_code,
+        "urban": edge_state.urban,
+        "length": edge_state.length,
+        "toll": edge_state.toll,
+        "capacity": edge_state.capacity,
+        "speed": edge_state.speed,
+        # initial costs by graph edge index
+        "cost": np.array(network.es["weight"], dtype=np.float64),
+        "time_cost": np.array([edge_timeC_dict[e] for e in edge_names], dtype=float),
+        "operate_cost": np.array(
+            [edge_operateC_dict[e] for e in edge_names], dtype=float
+        ),
+    }
+    for name, array in arrays.items():
+        np.save(cache_dir / f"{name}.npy", array)
+    np.savetxt(cache_dir / EDGE_LIST, edges, fmt="%d")
+    road_links.to_parquet(cache_dir / "road_links.geoparquet")
+    with open(manifest, "w") as f:
+        json.dump(
+            {
+                "key": key,
+                "vertices": network.vcount(),
+                "edges": network.ecount(),
+                "crs": None if road_links.crs is None else road_links.crs.to_wkt(),
+            },
+            f,
+        )
+
+
+class CompiledNetwork:
+    """Read-only view of a saved network (memory-mapped arrays)
+
+    The name mappings and cost dicts are built on first use and shared by
+    all callers in the process: do not modify them.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], manifest: dict):
+        self.cache_dir = Path(cache_dir)
+        self.key = manifest["key"]
+        self.crs = manifest["crs"]
+        for name in ARRAYS:
+            setattr(self, name, np.load(self.cache_dir / f"{name}.npy", mmap_mode="r"))
+
+    @cached_property
+    def edge_names(self) -> list:
+        """graph edge index -> edge name"""
+        return self.edge_name.tolist()
+
+    @cached_property
+    def node_name_to_index(self) -> dict:
+        return {name: idx for idx, name in enumerate(self.node_id.tolist())}
+
+    def od_node_index(self, od_nodes: list) -> Optional[dict]:
+        """Mapping of OD nodes to vertex indices: ``node_name_to_index`` for
+        node names, None when the nodes are already vertex indices (integer
+        codes, see ``network_flow_model.py``)"""
+        if len(od_nodes) and isinstance(od_nodes[0], (int, np.integer)):
+            return None
+        return self.node_name_to_index
+
+    @cached_property
+    def edge_index_to_name(self) -> dict:
+        return dict(enumerate(self.edge_names))
+
+    @cached_property
+    def _e_id(self) -> np.ndarray:
+        return np.array(self.e_id.tolist(), dtype=object)
+
+    @cached_property
+    def _e_id_index(self) -> dict:
+        return {name: idx for idx, name in enumerate(self._e_id)}
+
+    @cached_property
+    def _cost_dicts(self) -> tuple:
+        return tuple(
+            dict(zip(self.edge_names, getattr(self, field).tolist()))
+            for field in ("cost", "time_cost", "operate_cost")
+        )
+
+    def to_igraph(self) -> igraph.Graph:
+        """The graph of ``create_igraph_network`` (same vertex and edge
+        order, initial costs as weights, "nd_id" and "edge_name"
+        attributes), except that the vertex "name" tuples are not rebuilt:
+        the coordinates are the "lon"/"lat" attributes"""
+        network = igraph.Graph.Read_Edgelist(
+            str(self.cache_dir / EDGE_LIST), directed=False
+        )
+        # vertices after the last one with an edge
+        network.add_vertices(len(self.node_id) - network.vcount())
+        network.vs["nd_id"] = self.node_id.tolist()
+        network.vs["lon"] = self.node_x.tolist()
+        network.vs["lat"] = self.node_y.tolist()
+        network.es["edge_name"] = self.edge_names
+        network.es["weight"] = self.cost.tolist()
+        return network
+
+    def road_nodes(self) -> gpd.GeoDataFrame:
+        """Node ids and points, in vertex order"""
+        return gpd.GeoDataFrame(
+            {"nd_id": self.node_id.tolist()},
+            geometry=gpd.points_from_xy(self.node_x, self.node_y),
+            crs=self.crs,
+        )
+
+    def road_links(self) -> gpd.GeoDataFrame:
+        """The prepared road link table (with geometries)"""
+        return gpd.read_parquet(self.cache_dir / "road_links.geoparquet")
+
+    def cost_dicts(self):
+        """Initial {edge name: cost} dicts (total, time-equivalent,
+        operating); not needed with ``edge_state``, which holds the costs"""
+        return self._cost_dicts
+
+    def edge_state(self) -> EdgeState:
+        """Fresh edge state (flows at zero, initial costs) in road link
+        order; pass None as the cost dicts of ``network_flow_model``"""
+        edge_state = EdgeState(
+            e_id=self._e_id,
+            class_code=self.class_code,
+            urban=self.urban,
+            length=self.length,
+            toll=self.toll,
+            flow=np.zeros(len(self.e_id)),
+            capacity=self.capacity,
+            speed=self.speed,
+            index=self._e_id_index,
+        )
+        for field in ("cost", "time_cost", "operate_cost"):
+            edge_state.scatter(field, self.edge_idx, getattr(self, field))
+        return edge_state
+
+
+def load_network(
+    cache_dir: Union[str, Path], key: Optional[str] = None
+) -> Optional[CompiledNetwork]:
+    """The saved network, or None if there is none (or its key differs)"""
+    manifest_path = Path(cache_dir) / MANIFEST
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if key is not None and manifest["key"] != key:
+        return None
+    return CompiledNetwork(cache_dir, manifest)
+
+
+def compile_road_network(
+    road_path: Path,
+    flow_capacity_dict: dict,
+    free_flow_speed_dict: dict,
+    removed_links: Optional[list] = None,
+    name: str = "base",
+) -> CompiledNetwork:
+    """Major road network (A, B and motorways) with urban labels and tolls,
+    from the compiled cache ``road_path / "compiled" / name`` when it is up
+    to date, otherwise built from the road files and cached
+
+    Parameters
+    ----------
+    road_path
+        directory of the OS open roads, ETIS-plus roads and tolls files
+    removed_links
+        e_id of links dropped from the network (e.g. flooded roads)
+    """
+    cache_dir = road_path / "compiled" / name
+    key = network_key(
+        [
+            road_path / "osoprd_road_links.geoparquet",
+            road_path / "osoprd_road_nodes.geoparquet",
+            road_path / "etisplus_road_links.geoparquet",
+            road_path / "tolls.csv",
+        ],
+        digest_path=road_path / "compiled" / FILE_DIGESTS,
+        removed_links=removed_links,
+        flow_capacity_dict=flow_capacity_dict,
+        free_flow_speed_dict=free_flow_speed_dict,
+    )
+    compiled_network = load_network(cache_dir, key)
+    if compiled_network is not None:
+        return compiled_network
+
+    # OS open roads
+    osoprd_link = gpd.read_parquet(road_path / "osoprd_road_links.geoparquet")
+    osoprd_node = gpd.read_parquet(road_path / "osoprd_road_nodes.geoparquet")
+
+    # ETISPLUS roads
+    etisplus_road_links = gpd.read_parquet(road_path / "etisplus_road_links.geoparquet")
+    etisplus_urban_roads = etisplus_road_links[["Urban", "geometry"]]
+    etisplus_urban_roads = etisplus_urban_roads[etisplus_urban_roads["Urban"] == 1]
+
+    # select major roads
+    road_link_file, road_node_file = func.select_partial_roads(
+        road_links=osoprd_link,
+        road_nodes=osoprd_node,
+        col_name="road_classification",
+        list_of_values=["A Road", "B Road", "Motorway"],
+    )
+
+    # classify the selected major road links into urban/suburban
+    # (cached per ETIS-plus release)
+    urban_mask = func.create_urban_mask(
+        etisplus_urban_roads,
+        n_workers=os.cpu_count() or 1,
+        cache_dir=road_path / "compiled",
+    )
+    road_link_file = func.label_urban_roads(
+        road_link_file, urban_mask, cache_path=road_path / "urban_road_links.npz"
+    )
+
+    # drop disrupted roads if necessary (optional)
+    if removed_links is not None:
+        road_link_file = road_link_file[~road_link_file.e_id.isin(removed_links)]
+        road_link_file.reset_index(drop=True, inplace=True)
+
+    # attach toll charges to the selected major roads
+    tolls = pd.read_csv(road_path / "tolls.csv")
+    road_link_file["average_toll_cost"] = 0
+    tolls_mapping = (
+        tolls.iloc[1:, :].set_index("e_id")["Average_cost (£/passage)"].to_dict()
+    )
+    road_link_file["average_toll_cost"] = road_link_file["e_id"].apply(
+        lambda x: tolls_mapping.get(x, 0)
+    )
+    road_link_file.loc[
+        road_link_file.road_classification_number == "M6", "average_toll_cost"
+    ] = 8.0  # £/car
+
+    # network creation (igragh)
+    node_name_to_index = {
+        name: index for index, name in enumerate(road_node_file.nd_id)
+    }
+    network, _, edge_timeC_dict, edge_operateC_dict = func.create_igraph_network(
+        node_name_to_index, road_link_file, road_node_file, free_flow_speed_dict
+    )
+
+    # network initialisation
+    road_link_file = func.initialise_igraph_network(
+        road_link_file,
+        flow_capacity_dict,
+        free_flow_speed_dict,
+        col_road_classification="road_classification",
+    )
+    save_network(
+        cache_dir, key, network, road_link_file, edge_timeC_dict, edge_operateC_dict
+    )
+    return load_network(cache_dir)
@@ -5,6 +5,8 @@ import geopandas as gpd  # type: ignore
 
 from utils import load_config
 import functions as func
+import data_io
+import network_cache
 
 import json
 import warnings
@@ -45,20 +47,26 @@ with open(base_path / "parameters" / "flooded_road_links.json", "r") as f:
     flooded_road_list = json.load(f)
 
 # %%
-# OS open roads
-osoprd_link = gpd.read_parquet(
-    base_path / "networks" / "road" / "osoprd_road_links.geoparquet"
-)
-osoprd_node = gpd.read_parquet(
-    base_path / "networks" / "road" / "osoprd_road_nodes.geoparquet"
-)
+# road network: compiled once (see network_cache) and rebuilt only when the
+# input files, parameters or scenario change
+user_input = input("Please choose a scenario (base/flooded): ")
+if user_input != "base" and user_input != "flooded":
+    print("Error: please check the scenario input!")
 
-# ETISPLUS roads
-etisplus_road_links = gpd.read_parquet(
-    base_path / "networks" / "road" / "etisplus_road_links.geoparquet"
+compiled_network = network_cache.compile_road_network(
+    base_path / "networks" / "road",
+    flow_capacity_dict,
+    free_flow_speed_dict,
+    removed_links=flooded_road_list if user_input == "flooded" else None,
+    name=user_input,
 )
-etisplus_urban_roads = etisplus_road_links[["Urban", "geometry"]]
-etisplus_urban_roads = etisplus_urban_roads[etisplus_urban_roads["Urban"] == 1]
+
+# network, costs and edge states from the memory-mapped arrays
+test_net_ig = compiled_network.to_igraph()
+road_node_file = compiled_network.road_nodes()
+node_name_to_index = compiled_network.node_name_to_index
+node_index_to_name = {value: key for key, value in node_name_to_index.items()}
+edge_index_to_name = compiled_network.edge_index_to_name
 
 # population-weighted centroids (combined spatial units)
 zone_centroids = gpd.read_parquet(
@@ -66,50 +74,29 @@ zone_centroids = gpd.read_parquet(
 )
 
 # %%
-# select major roads
-road_link_file, road_node_file = func.select_partial_roads(
-    road_links=osoprd_link,
-    road_nodes=osoprd_node,
-    col_name="road_classification",
-    list_of_values=["A Road", "B Road", "Motorway"],
+# O-D matrix (2011): total count only
+od_total = data_io.od_total(
+    base_path / "census_datasets" / "od_matrix" / "od_gb_2011.csv", col_count="car"
 )
-
-# classify the selected major road links into urban/suburban
-urban_mask = func.create_urban_mask(etisplus_urban_roads)
-road_link_file = func.label_urban_roads(road_link_file, urban_mask)
-
-# drop disrupted roads if necessary (optional)
-user_input = input("Please choose a scenario (base/flooded): ")
-if user_input != "base" and user_input != "flooded":
-    print("Error: please check the scenario input!")
-if user_input == "flooded":
-    road_link_file = road_link_file[~road_link_file.e_id.isin(flooded_road_list)]
-    road_link_file.reset_index(drop=True, inplace=True)
-
-# attach toll charges to the selected major roads
-tolls = pd.read_csv(base_path / "networks" / "road" / "tolls.csv")
-road_link_file["average_toll_cost"] = 0
-tolls_mapping = (
-    tolls.iloc[1:, :].set_index("e_id")["Average_cost (£/passage)"].to_dict()
-)
-road_link_file["average_toll_cost"] = road_link_file["e_id"].apply(
-    lambda x: tolls_mapping.get(x, 0)
-)
-road_link_file.loc[
-    road_link_file.road_classification_number == "M6", "average_toll_cost"
-] = 8.0  # £/car
+print(f"total flows: {od_total}")  # 14_203_635 trips/day
 
 # %%
-# O-D matrix (2011)
-od_df = pd.read_csv(base_path / "census_datasets" / "od_matrix" / "od_gb_2011.csv")
-print(f"total flows: {od_df.car.sum()}")  # 14_203_635 trips/day
+#!!! for case study
+oa_selected = pd.read_csv(casestudy_path / "inputs" / "oa_selected.csv")
+oa_set = set(oa_selected.OA21CD.unique())
 
-# %%
-#!!!  O-D matrix (selected-OA, 2011)
-od_gb_oa = pd.read_csv(
-    base_path / "census_datasets" / "od_matrix" / "od_gb_2011_disaggregate_oa.csv"
+#!!!  O-D matrix (selected-OA, 2011): converted once to Parquet with int32
+# zone codes, then read keeping the rows from or to the selected OAs
+od_path = base_path / "census_datasets" / "od_matrix"
+if not (od_path / "od_gb_2011_disaggregate_oa.parquet").exists():
+    data_io.convert_od_matrix(
+        od_path / "od_gb_2011_disaggregate_oa.csv",
+        od_path / "od_gb_2011_disaggregate_oa.parquet",
+    )
+od_df = data_io.read_od_matrix(
+    od_path / "od_gb_2011_disaggregate_oa.parquet", zones=oa_set
 )
-od_gb_oa.rename(
+od_df.rename(
     columns={
         "origins": "Area of usual residence",
         "destinations": "Area of workplace",
@@ -118,60 +105,40 @@ od_gb_oa.rename(
     inplace=True,
 )
 
-#!!! for case study
-oa_selected = pd.read_csv(casestudy_path / "inputs" / "oa_selected.csv")
-oa_set = set(oa_selected.OA21CD.unique())
-od_df = od_gb_oa[
-    od_gb_oa["Area of usual residence"].isin(oa_set)
-    | od_gb_oa["Area of workplace"].isin(oa_set)
-]
-od_df.reset_index(drop=True, inplace=True)
-
 # %%
 # find the nearest road node for each zone
-zone_to_node = func.find_nearest_node(zone_centroids, road_node_file)
-# attach od info of each zone to their nearest road network nodes
-list_of_origin_nodes, dict_of_destination_nodes, dict_of_origin_supplies = (
-    func.od_interpret(
-        od_df,
-        zone_to_node,
-        col_origin="Area of usual residence",
-        col_destination="Area of workplace",
-        col_count="car",
-    )
+# (cached: reused while the centroids and road nodes are unchanged)
+zone_to_node = func.find_nearest_node(
+    zone_centroids,
+    road_node_file,
+    cache_path=base_path / "census_datasets" / "admin_pwc" / "zone_to_node.npz",
 )
-# extract identical origin nodes
-list_of_origin_nodes = list(set(list_of_origin_nodes))
-list_of_origin_nodes.sort()
-
-# %%
-# network creation (igragh)
-node_name_to_index = {name: index for index, name in enumerate(road_node_file.nd_id)}
-node_index_to_name = {value: key for key, value in node_name_to_index.items()}
-test_net_ig, edge_cost_dict, edge_timeC_dict, edge_operateC_dict = (
-    func.create_igraph_network(
-        node_name_to_index, road_link_file, road_node_file, free_flow_speed_dict
-    )
-)  # this returns a network and edge weights dict(edge_name, edge_weight)
-edge_index_to_name = {idx: name for idx, name in enumerate(test_net_ig.es["edge_name"])}
-
-# network initialisation
-road_link_file = func.initialise_igraph_network(
-    road_link_file,
-    flow_capacity_dict,
-    free_flow_speed_dict,
-    col_road_classification="road_classification",
+# zones -> vertex indices: the model works on integer node codes
+zone_to_vertex = {zone: node_name_to_index[node] for zone, node in zone_to_node.items()}
+# attach od info of each zone to their nearest road network nodes
+# (unique node pairs; demand within a single node is not routed)
+(
+    list_of_origin_nodes,
+    dict_of_destination_nodes,
+    dict_of_origin_supplies,
+    dict_of_intra_node_demand,
+) = func.od_interpret(
+    od_df,
+    zone_to_vertex,
+    col_origin="Area of usual residence",
+    col_destination="Area of workplace",
+    col_count="car",
 )
 
 # %%
 # flow simulation
 speed_dict, acc_flow_dict, acc_capacity_dict = func.network_flow_model(
     test_net_ig,  # network
-    edge_cost_dict,  #!!!
-    edge_timeC_dict,  # !!!
-    edge_operateC_dict,  # !!!
-    road_link_file,  # road
-    node_name_to_index,  # road
+    None,  # costs: held by the edge state
+    None,
+    None,
+    compiled_network.edge_state(),  # road
+    None,  # road: OD nodes are vertex indices
     edge_index_to_name,  # road
     list_of_origin_nodes,  # od
     dict_of_origin_supplies,  # od
@@ -185,6 +152,7 @@ speed_dict, acc_flow_dict, acc_capacity_dict = func.network_flow_model(
 
 # %%
 # append estimation of: speeds, flows, and remaining capacities
+road_link_file = compiled_network.road_links()
 road_link_file.ave_flow_rate = road_link_file.e_id.map(speed_dict)
 road_link_file.acc_flow = road_link_file.e_id.map(acc_flow_dict)
 road_link_file.acc_capacity = road_link_file.e_id.map(acc_capacity_dict)
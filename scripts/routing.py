@@ -0,0 +1,413 @@
+"""Shortest-path routing for the network flow model
+
+The serial router runs igraph's Dijkstra once per origin. The parallel router
+shards the origins across a pool of worker processes; the graph topology and
+the current edge weights sit in ``multiprocessing.shared_memory`` blocks, so
+workers rebuild their local igraph only when the topology changes and just
+re-read the weights when they are updated.
+
+Edges are closed by giving them an infinite weight rather than deleting them,
+which keeps edge indices stable. igraph still returns a path over infinite
+weights when no finite one exists, so paths using closed edges are replaced
+by empty paths (no route).
+"""
+
+from typing import Callable, List, Optional, Tuple
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+import weakref
+
+import numpy as np
+import igraph  # type: ignore
+
+from tqdm.auto import tqdm
+
+# per-worker graph cache: rebuilt when the topology block changes and
+# re-weighted when the weight version changes
+_worker_graph: dict = {
+    "topology": None,
+    "weights": None,
+    "graph": None,
+    "closed": None,
+}
+
+
+def find_shortest_paths(
+    network: igraph.Graph,
+    origins: List[int],
+    destinations: List[List[int]],
+    closed: Optional[np.ndarray] = None,
+    progress: bool = True,
+) -> List[List[List[int]]]:
+    """Shortest edge paths from each origin to its destinations
+
+    Parameters
+    ----------
+    network
+        igraph network with a "weight" edge attribute
+    origins
+        origin vertex indices
+    destinations
+        destination vertex indices of each origin
+    closed
+        boolean mask of closed edges (infinite weight), by edge index
+
+    Returns
+    -------
+    for each origin, the list of edge paths (edge indices) to its destinations
+    """
+    list_of_paths = []
+    for i in tqdm(range(len(origins)), desc="Processing", disable=not progress):
+        paths = network.get_shortest_paths(
+            v=origins[i],
+            to=destinations[i],
+            weights="weight",
+            mode="out",
+            output="epath",
+        )
+        list_of_paths.append(paths)
+    if closed is not None and closed.any():
+        list_of_paths = [drop_closed_paths(paths, closed) for paths in list_of_paths]
+    return list_of_paths
+
+
+def find_shortest_paths_packed(
+    network: igraph.Graph,
+    origins: List[int],
+    destinations: List[List[int]],
+    closed: Optional[np.ndarray] = None,
+    progress: bool = True,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Same as ``find_shortest_paths``, packed as by ``pack_paths`` one
+    origin at a time (only one origin's paths are held as lists)"""
+    list_of_edges = []
+    list_of_offsets = [np.zeros(1, dtype=np.int64)]
+    number_of_edges = 0
+    for i in tqdm(range(len(origins)), desc="Processing", disable=not progress):
+        paths = network.get_shortest_paths(
+            v=origins[i],
+            to=destinations[i],
+            weights="weight",
+            mode="out",
+            output="epath",
+        )
+        edges, offsets = pack_paths(paths)
+        list_of_edges.append(edges)
+        list_of_offsets.append(offsets[1:] + number_of_edges)
+        number_of_edges += len(edges)
+    edges = np.concatenate(list_of_edges) if list_of_edges else np.zeros(0, np.int32)
+    offsets = np.concatenate(list_of_offsets)
+    if closed is not None and closed.any():
+        edges, offsets = drop_closed_packed(edges, offsets, closed)
+    return edges, offsets
+
+
+def drop_closed_packed(
+    edges: np.ndarray, offsets: np.ndarray, closed: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Empty the packed paths running over closed edges"""
+    closed_count = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum(closed[edges], out=closed_count[1:])
+    is_blocked = closed_count[offsets[1:]] > closed_count[offsets[:-1]]
+    if not is_blocked.any():
+        return edges, offsets
+    lengths = np.where(is_blocked, 0, np.diff(offsets))
+    new_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    keep = np.repeat(~is_blocked, np.diff(offsets))
+    return edges[keep], new_offsets
+
+
+def drop_closed_paths(paths: List[List[int]], closed: np.ndarray) -> List[List[int]]:
+    """Replace paths running over closed edges by empty paths"""
+    edges, offsets = pack_paths(paths)
+    closed_count = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum(closed[edges], out=closed_count[1:])
+    is_blocked = closed_count[offsets[1:]] > closed_count[offsets[:-1]]
+    return [[] if blocked else path for path, blocked in zip(paths, is_blocked)]
+
+
+def pack_paths(list_of_paths: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack a list of edge paths into a flat int32 edge buffer and offsets"""
+    lengths = np.fromiter(map(len, list_of_paths), dtype=np.int64)
+    offsets = np.zeros(len(list_of_paths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    edges = np.fromiter(
+        (e for path in list_of_paths for e in path), dtype=np.int32, count=offsets[-1]
+    )
+    return edges, offsets
+
+
+def unpack_paths(edges: np.ndarray, offsets: np.ndarray) -> List[List[int]]:
+    return [
+        edges[offsets[i] : offsets[i + 1]].tolist() for i in range(len(offsets) - 1)
+    ]
+
+
+def _worker_network(
+    topology: Tuple[str, int, int, bool], weights: Tuple[str, int]
+) -> Tuple[igraph.Graph, np.ndarray]:
+    if _worker_graph["topology"] != topology:
+        topology_name, number_of_vertices, number_of_edges, directed = topology
+        shm = shared_memory.SharedMemory(name=topology_name)
+        edge_list = np.ndarray((number_of_edges, 2), dtype=np.int32, buffer=shm.buf)
+        _worker_graph["graph"] = igraph.Graph(
+            n=number_of_vertices, edges=edge_list.tolist(), directed=directed
+        )
+        del edge_list
+        shm.close()
+        _worker_graph["topology"] = topology
+        _worker_graph["weights"] = None
+    graph = _worker_graph["graph"]
+    if _worker_graph["weights"] != weights:
+        shm = shared_memory.SharedMemory(name=weights[0])
+        weight_array = np.ndarray((graph.ecount(),), dtype=np.float64, buffer=shm.buf)
+        graph.es["weight"] = weight_array.tolist()
+        _worker_graph["closed"] = np.isinf(weight_array)
+        del weight_array
+        shm.close()
+        _worker_graph["weights"] = weights
+    return graph, _worker_graph["closed"]
+
+
+def _route_chunk(args) -> Tuple[np.ndarray, np.ndarray]:
+    topology, weights, origins, destinations = args
+    graph, closed = _worker_network(topology, weights)
+    return find_shortest_paths_packed(
+        graph, origins, destinations, closed=closed, progress=False
+    )
+
+
+def _release(blocks: list) -> None:
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+    blocks.clear()
+
+
+class ParallelRouter:
+    """Process-pool shortest-path router over a shared-memory graph
+
+    Usage::
+
+        router = ParallelRouter(n_workers=8)
+        router.update(network)  # after each change of weights
+        list_of_paths = router.route(origins, destinations)
+        router.close()
+
+    The results are identical to ``find_shortest_paths`` on the same graph.
+    """
+
+    def __init__(self, n_workers: int, chunks_per_worker: int = 4):
+        self.n_workers = n_workers
+        self.chunks_per_worker = chunks_per_worker
+        # start the resource tracker first so the workers share it with this
+        # process and attaching to a block does not schedule its removal
+        resource_tracker.ensure_running()
+        self._pool = mp.Pool(n_workers)
+        self._blocks: list = []
+        self._topology: Optional[Tuple[str, int, int, bool]] = None
+        self._topology_shm: Optional[shared_memory.SharedMemory] = None
+        self._weights: Optional[Tuple[str, int]] = None
+        self._weights_shm: Optional[shared_memory.SharedMemory] = None
+        self._weights_version = 0
+        self._finalizer = weakref.finalize(self, _release, self._blocks)
+
+    def _new_block(self, nbytes: int) -> shared_memory.SharedMemory:
+        shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self._blocks.append(shm)
+        return shm
+
+    def _drop_block(self, shm: Optional[shared_memory.SharedMemory]) -> None:
+        if shm is not None:
+            self._blocks.remove(shm)
+            shm.close()
+            shm.unlink()
+
+    def update(
+        self, network: igraph.Graph, changed_edges: Optional[np.ndarray] = None
+    ) -> None:
+        """Publish the current edge weights, and the topology if the number of
+        vertices or edges changed (edges are closed through their weights, so
+        the topology is normally fixed for a run)
+
+        Parameters
+        ----------
+        network
+            igraph network
+        changed_edges
+            indices of the edges re-weighted since the last update
+            (None -> rewrite all weights)
+        """
+        topology_changed = (
+            self._topology is None
+            or self._topology[1] != network.vcount()
+            or self._topology[2] != network.ecount()
+        )
+        if topology_changed:
+            edge_list = np.array(network.get_edgelist(), dtype=np.int32).reshape(-1, 2)
+            self._drop_block(self._topology_shm)
+            self._topology_shm = self._new_block(edge_list.nbytes)
+            shared_edges = np.ndarray(
+                edge_list.shape, dtype=np.int32, buffer=self._topology_shm.buf
+            )
+            shared_edges[:] = edge_list
+            self._topology = (
+                self._topology_shm.name,
+                network.vcount(),
+                network.ecount(),
+                network.is_directed(),
+            )
+            self._drop_block(self._weights_shm)
+            self._weights_shm = self._new_block(network.ecount() * 8)
+            changed_edges = None
+
+        shared_weights = np.ndarray(
+            (network.ecount(),), dtype=np.float64, buffer=self._weights_shm.buf
+        )
+        if changed_edges is None:
+            shared_weights[:] = network.es["weight"]
+        else:
+            changed_edges = np.asarray(changed_edges, dtype=np.intp)
+            shared_weights[changed_edges] = network.es[changed_edges.tolist()]["weight"]
+        self._weights_version += 1
+        self._weights = (self._weights_shm.name, self._weights_version)
+
+    def route_packed(
+        self, origins: List[int], destinations: List[List[int]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Paths of all OD pairs on the last published network, packed as
+        by ``pack_paths``"""
+        if self._topology is None:
+            raise RuntimeError("ParallelRouter.update() must be called first")
+        number_of_chunks = min(len(origins), self.n_workers * self.chunks_per_worker)
+        bounds = np.linspace(0, len(origins), number_of_chunks + 1).astype(int)
+        tasks = [
+            (self._topology, self._weights, origins[lo:hi], destinations[lo:hi])
+            for lo, hi in zip(bounds[:-1], bounds[1:])
+        ]
+        list_of_edges = []
+        list_of_offsets = [np.zeros(1, dtype=np.int64)]
+        number_of_edges = 0
+        for edges, offsets in tqdm(
+            self._pool.imap(_route_chunk, tasks), total=len(tasks), desc="Processing"
+        ):
+            list_of_edges.append(edges)
+            list_of_offsets.append(offsets[1:] + number_of_edges)
+            number_of_edges += len(edges)
+        return (
+            np.concatenate(list_of_edges) if list_of_edges else np.zeros(0, np.int32),
+            np.concatenate(list_of_offsets),
+        )
+
+    def route(
+        self, origins: List[int], destinations: List[List[int]]
+    ) -> List[List[List[int]]]:
+        """Same as ``find_shortest_paths`` on the last published network"""
+        paths = unpack_paths(*self.route_packed(origins, destinations))
+        list_of_paths: List[List[List[int]]] = []
+        start = 0
+        for dests in destinations:
+            list_of_paths.append(paths[start : start + len(dests)])
+            start += len(dests)
+        return list_of_paths
+
+    def close(self) -> None:
+        self._pool.close()
+        self._pool.join()
+        self._finalizer()
+
+
+class PathCache:
+    """Shortest paths of each origin, reused until an edge they use changes
+
+    An edge counts as changed when it is closed or its weight moved by more
+    than ``tolerance`` (relative) from the weight it had when it was last
+    counted as changed. Only origins whose cached paths use a changed edge
+    are routed again. Weights of edges off a shortest path can only make that
+    path longer relative to itself, so with ``tolerance=0`` the reused paths
+    remain shortest paths as long as weights do not decrease; any significant
+    decrease therefore drops the whole cache.
+    Among equal-cost alternatives the reused path may differ from the one a
+    fresh Dijkstra run would pick.
+
+    Usage::
+
+        cache = PathCache(np.array(network.es["weight"]), tolerance=0.01)
+        list_of_paths = cache.route(route_func, origins, destinations)
+        cache.update_weights(changed_edges, new_weights)  # after re-weighting
+    """
+
+    def __init__(self, weights: np.ndarray, tolerance: float = 0.0):
+        self.tolerance = tolerance
+        # weights as of the last significant change of each edge
+        self.reference_weights = np.array(weights, dtype=np.float64)
+        # origin -> {destination: path}, and the edges used by those paths
+        self.paths: dict = {}
+        self.edges: dict = {}
+
+    def update_weights(self, edges: np.ndarray, weights: np.ndarray) -> None:
+        """Record new weights of ``edges`` and drop the origins affected"""
+        edges = np.asarray(edges, dtype=np.intp)
+        weights = np.asarray(weights, dtype=np.float64)
+        reference = self.reference_weights[edges]
+        with np.errstate(invalid="ignore"):
+            relative_change = np.abs(weights - reference) / reference
+        is_changed = np.isinf(weights) & ~np.isinf(reference)
+        is_changed |= ~np.isinf(weights) & (relative_change > self.tolerance)
+        if not is_changed.any():
+            return
+        changed_edges = edges[is_changed]
+        self.reference_weights[changed_edges] = weights[is_changed]
+        if (weights[is_changed] < reference[is_changed]).any():
+            # a cheaper edge may open a shorter path for any origin
+            self.paths.clear()
+            self.edges.clear()
+            return
+        is_dirty = np.zeros(len(self.reference_weights), dtype=bool)
+        is_dirty[changed_edges] = True
+        for origin in [o for o, used in self.edges.items() if is_dirty[used].any()]:
+            del self.paths[origin]
+            del self.edges[origin]
+
+    def add(
+        self,
+        origins: List[int],
+        destinations: List[List[int]],
+        list_of_paths: List[List[List[int]]],
+    ) -> None:
+        """Cache the paths of ``origins``, shortest at the current weights
+        (e.g. routed elsewhere)"""
+        for origin, dests, paths in zip(origins, destinations, list_of_paths):
+            self.paths[origin] = dict(zip(dests, paths))
+            self.edges[origin] = np.unique(
+                np.fromiter((e for path in paths for e in path), dtype=np.intp)
+            )
+
+    def route(
+        self,
+        route_func: Callable[[List[int], List[List[int]]], List[List[List[int]]]],
+        origins: List[int],
+        destinations: List[List[int]],
+    ) -> List[List[List[int]]]:
+        """Shortest paths of all origins, routing only those without valid
+        cached paths through ``route_func(origins, destinations)``"""
+        to_route = [
+            i
+            for i, origin in enumerate(origins)
+            if origin not in self.paths
+            or not all(dest in self.paths[origin] for dest in destinations[i])
+        ]
+        if to_route:
+            self.add(
+                [origins[i] for i in to_route],
+                [destinations[i] for i in to_route],
+                route_func(
+                    [origins[i] for i in to_route],
+                    [destinations[i] for i in to_route],
+                ),
+            )
+        return [
+            [self.paths[origin][dest] for dest in dests]
+            for origin, dests in zip(origins, destinations)
+        ]
@@ -0,0 +1,203 @@
+"""Batch runs of the network flow model over disruption scenarios
+
+A scenario is a dict (e.g. one entry of a JSON list)::
+
+    {
+        "name": "flood_001",
+        "closed_links": ["e_id", ...],          # optional
+        "capacity_factors": {"e_id": 0.5, ...}, # optional
+    }
+
+Closed links keep their place in the graph with an infinite weight, and
+links whose reduced capacity falls below one car are closed as well. The
+network is loaded from the compiled cache (``network_cache``) in every
+worker, so the preprocessing and the OD interpretation are done once for
+the whole batch.
+
+Each scenario writes ``<name>.npz`` (speed, flow and remaining capacity by
+road link, in the order of ``e_id``) and ``<name>.log`` (model output and
+progress bars) to the output directory; the costs and non-allocated flow of
+all scenarios are collected in ``summary.csv``.
+
+Given the paths recorded in a run of the undisrupted network
+(``delta.PathRecord``), each scenario reuses them up to its first iteration
+that routes over a closed link.
+"""
+
+import contextlib
+import json
+import multiprocessing as mp
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import igraph  # type: ignore
+
+import functions as func
+import network_cache
+from delta import PathRecord
+from edge_state import EdgeState
+
+# per-worker inputs, set by _init_worker
+_worker_inputs: dict = {}
+
+SUMMARY_COLUMNS = [
+    "total_cost",
+    "time_equiv_cost",
+    "operating_cost",
+    "toll_cost",
+    "non_allocated_flow",
+    "iterations",
+]
+
+
+def load_scenarios(path: Union[str, Path]) -> List[dict]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def apply_scenario(
+    compiled_network: network_cache.CompiledNetwork, scenario: dict
+) -> Tuple[igraph.Graph, EdgeState]:
+    """Fresh graph and edge state with the scenario's closures and
+    capacity reductions"""
+    network = compiled_network.to_igraph()
+    edge_state = compiled_network.edge_state()
+
+    capacity_factors = {
+        e_id: factor
+        for e_id, factor in scenario.get("capacity_factors", {}).items()
+        if e_id in edge_state.index
+    }
+    if capacity_factors:
+        edge_state.capacity[edge_state.ids(capacity_factors.keys())] *= np.fromiter(
+            capacity_factors.values(), dtype=np.float64
+        )
+    closed_links = [
+        e for e in scenario.get("closed_links", []) if e in edge_state.index
+    ]
+    is_closed = edge_state.capacity < 1
+    is_closed[edge_state.ids(closed_links)] = True
+    number_of_unknown = len(scenario.get("closed_links", [])) - len(closed_links)
+    if number_of_unknown:
+        print(f"{number_of_unknown} closed links are not in the network")
+
+    weights = np.array(compiled_network.cost)
+    weights[is_closed[compiled_network.edge_idx]] = np.inf
+    network.es["weight"] = weights.tolist()
+    return network, edge_state
+
+
+def _init_worker(
+    network_dir: Path,
+    od_inputs: tuple,
+    model_parameters: dict,
+    output_dir: Path,
+    baseline_paths: Optional[Path] = None,
+) -> None:
+    # memory-mapped: the network arrays are shared by all workers
+    _worker_inputs["network"] = network_cache.load_network(network_dir)
+    _worker_inputs["baseline_paths"] = (
+        None if baseline_paths is None else PathRecord.load(baseline_paths)
+    )
+    _worker_inputs["od_inputs"] = od_inputs
+    _worker_inputs["model_parameters"] = model_parameters
+    _worker_inputs["output_dir"] = output_dir
+
+
+def run_scenario(scenario: dict) -> dict:
+    """Run one scenario in the current worker and save its results"""
+    compiled_network = _worker_inputs["network"]
+    list_of_origins, supply_dict, destination_dict = _worker_inputs["od_inputs"]
+    output_dir = _worker_inputs["output_dir"]
+    name = scenario["name"]
+
+    # model output and progress bars (stderr) go to the scenario's log
+    with open(output_dir / f"{name}.log", "w") as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            network, edge_state = apply_scenario(compiled_network, scenario)
+            speed_dict, flow_dict, capacity_dict, summary = func.network_flow_model(
+                network,
+                None,  # costs: held by the edge state
+                None,
+                None,
+                edge_state,
+                compiled_network.od_node_index(list_of_origins),
+                compiled_network.edge_index_to_name,
+                list_of_origins,
+                supply_dict,
+                destination_dict,
+                **_worker_inputs["model_parameters"],
+                return_summary=True,
+                baseline_paths=_worker_inputs["baseline_paths"],
+            )
+
+    e_id = compiled_network.e_id.tolist()
+    np.savez_compressed(
+        output_dir / f"{name}.npz",
+        speed=np.array([speed_dict[e] for e in e_id]),
+        flow=np.array([flow_dict[e] for e in e_id]),
+        capacity=np.array([capacity_dict[e] for e in e_id]),
+    )
+    return {
+        "scenario": name,
+        "closed_links": len(scenario.get("closed_links", [])),
+        **summary,
+    }
+
+
+def run_scenarios(
+    scenarios: List[dict],
+    network_dir: Union[str, Path],
+    od_inputs: tuple,
+    model_parameters: dict,
+    output_dir: Union[str, Path],
+    n_workers: int = 1,
+    baseline_paths: Optional[Union[str, Path]] = None,
+) -> pd.DataFrame:
+    """Run all scenarios, ``n_workers`` at a time
+
+    Parameters
+    ----------
+    network_dir
+        compiled (undisrupted) network, see ``network_cache``
+    od_inputs
+        list of origins, supply dict and destination dict (``od_interpret``)
+    model_parameters
+        remaining keyword arguments of ``functions.network_flow_model``
+        (speed-flow dicts, col_eid, routing options)
+    baseline_paths
+        ``PathRecord`` file of a run of the undisrupted network with the same
+        OD inputs and parameters
+
+    Returns
+    -------
+    summary table, also written to ``output_dir / "summary.csv"``
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    initargs = (
+        Path(network_dir),
+        od_inputs,
+        model_parameters,
+        output_dir,
+        None if baseline_paths is None else Path(baseline_paths),
+    )
+    rows = []
+    if n_workers > 1:
+        with mp.Pool(n_workers, initializer=_init_worker, initargs=initargs) as pool:
+            for row in pool.imap_unordered(run_scenario, scenarios):
+                print(f"Scenario {row['scenario']} is completed!")
+                rows.append(row)
+    else:
+        _init_worker(*initargs)
+        for row in map(run_scenario, scenarios):
+            print(f"Scenario {row['scenario']} is completed!")
+            rows.append(row)
+
+    summary = pd.DataFrame(rows, columns=["scenario", "closed_links"] + SUMMARY_COLUMNS)
+    order = {scenario["name"]: idx for idx, scenario in enumerate(scenarios)}
+    summary = summary.sort_values("scenario", key=lambda s: s.map(order))
+    summary.to_csv(output_dir / "summary.csv", index=False)
+    return summary.reset_index(drop=True)
@@ -0,0 +1,96 @@
+"""Bulk snapping of zone centroids to road network nodes
+
+All centroids are matched in one KD-tree query against the node coordinates
+(planar distances in the CRS units of the inputs, as with ``sindex.nearest``).
+Results can be cached in an .npz file keyed by a hash of the zone and node
+inputs, so repeated runs on the same data skip the query.
+"""
+
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd  # type: ignore
+from scipy.spatial import cKDTree
+
+from utils import content_hash
+
+
+def point_coordinates(points: gpd.GeoSeries) -> np.ndarray:
+    """(x, y) array of point geometries"""
+    return np.column_stack([points.x.to_numpy(), points.y.to_numpy()])
+
+
+def nearest_nodes(
+    zone_xy: np.ndarray,
+    node_xy: np.ndarray,
+    k: int = 1,
+    max_distance: Optional[float] = None,
+    cache_path: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """k nearest nodes of every zone
+
+    Returns
+    -------
+    node positions and distances, both of shape (number of zones, k); missing
+    candidates (beyond ``max_distance``) have position -1 and distance inf
+    """
+    key = content_hash(zone_xy, node_xy, k, max_distance)
+    if cache_path is not None and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if str(cached["key"]) == key:
+                return cached["nodes"], cached["distances"]
+    distances, nodes = cKDTree(node_xy).query(
+        zone_xy,
+        k=k,
+        distance_upper_bound=np.inf if max_distance is None else max_distance,
+    )
+    nodes = np.asarray(nodes, dtype=np.int64).reshape(len(zone_xy), k)
+    distances = np.asarray(distances, dtype=np.float64).reshape(len(zone_xy), k)
+    nodes[np.isinf(distances)] = -1
+    if cache_path is not None:
+        np.savez(cache_path, key=key, nodes=nodes, distances=distances)
+    return nodes, distances
+
+
+def snap_zones(
+    zones: gpd.GeoDataFrame,
+    road_nodes: gpd.GeoDataFrame,
+    col_zone: str = "code",
+    col_node: str = "nd_id",
+    k: int = 1,
+    max_distance: Optional[float] = None,
+    cache_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """Candidate road nodes of each zone centroid
+
+    Returns
+    -------
+    one row per (zone, candidate): zone code, candidate rank (0 = nearest),
+    node id and distance; zones without a node within ``max_distance`` have
+    no rows
+    """
+    nodes, distances = nearest_nodes(
+        point_coordinates(zones.geometry),
+        point_coordinates(road_nodes.geometry),
+        k=k,
+        max_distance=max_distance,
+        cache_path=cache_path,
+    )
+    is_found = (nodes >= 0).ravel()
+    candidates = pd.DataFrame(
+        {
+            col_zone: np.repeat(zones[col_zone].to_numpy(), k),
+            "rank": np.tile(np.arange(k), len(zones)),
+            col_node: road_nodes[col_node].to_numpy()[nodes.ravel()],
+            "distance": distances.ravel(),
+        }
+    )
+    number_of_unsnapped = len(zones) - np.count_nonzero(is_found[::k])
+    if number_of_unsnapped:
+        print(
+            f"{number_of_unsnapped} zones have no road node "
+            f"within {max_distance} (CRS units)"
+        )
+    return candidates[is_found].reset_index(drop=True)
@@ -0,0 +1,108 @@
+"""Tiled construction of the urban mask
+
+The urban mask is the set of convex hulls of the connected parts of the
+union of 500 m buffers around the ETIS-plus urban roads. Instead of one
+global union, the roads are split into square tiles (by the centre of their
+bounding box); each tile is buffered and unioned in a process pool, and the
+parts of neighbouring tiles that intersect are unioned again before taking
+the hulls, which gives the same polygons as the global union.
+
+The mask can be cached as GeoParquet, one file per input: the file name
+carries a hash of the road geometries and the build parameters.
+"""
+
+import multiprocessing as mp
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import geopandas as gpd  # type: ignore
+import shapely
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from utils import content_hash
+
+
+def _union_tile(args) -> np.ndarray:
+    """Polygons of the union of the buffered lines of one tile"""
+    geometries, distance = args
+    # 16 segments per quarter circle, as GeoSeries.buffer
+    buffers = shapely.buffer(geometries, distance, quad_segs=16)
+    return shapely.get_parts(shapely.union_all(buffers))
+
+
+def tile_ids(geometries: np.ndarray, tile_size: float) -> np.ndarray:
+    """Grid cell of every geometry, by the centre of its bounding box"""
+    bounds = shapely.bounds(geometries)
+    x = (bounds[:, 0] + bounds[:, 2]) / 2
+    y = (bounds[:, 1] + bounds[:, 3]) / 2
+    column = np.floor((x - x.min()) / tile_size).astype(np.int64)
+    row = np.floor((y - y.min()) / tile_size).astype(np.int64)
+    return row * (column.max() + 1) + column
+
+
+def merge_tile_parts(parts: np.ndarray) -> np.ndarray:
+    """Union the tile polygons that intersect across tile borders
+
+    Returns
+    -------
+    polygons of the global union
+    """
+    tree = shapely.STRtree(parts)
+    left, right = tree.query(parts, predicate="intersects")
+    is_pair = left < right
+    adjacency = sparse.coo_matrix(
+        (np.ones(is_pair.sum()), (left[is_pair], right[is_pair])),
+        shape=(len(parts), len(parts)),
+    )
+    _, labels = connected_components(adjacency, directed=False)
+    sizes = np.bincount(labels)
+    merged = [parts[sizes[labels] == 1]]
+    for label in np.flatnonzero(sizes > 1):
+        merged.append(shapely.get_parts(shapely.union_all(parts[labels == label])))
+    return np.concatenate(merged)
+
+
+def build_urban_mask(
+    urban_roads: gpd.GeoDataFrame,
+    buffer_distance: float = 500,
+    tile_size: float = 50_000,
+    n_workers: int = 1,
+) -> gpd.GeoDataFrame:
+    """Convex hulls of the buffered urban roads, built tile by tile"""
+    geometries = urban_roads.geometry.to_numpy()
+    tiles = tile_ids(geometries, tile_size)
+    order = np.argsort(tiles, kind="stable")
+    starts = np.flatnonzero(np.diff(tiles[order], prepend=-1))
+    tasks = [(geometries[idx], buffer_distance) for idx in np.split(order, starts[1:])]
+    if n_workers > 1:
+        with mp.Pool(n_workers) as pool:
+            tile_parts = pool.map(_union_tile, tasks)
+    else:
+        tile_parts = [_union_tile(task) for task in tasks]
+    parts = merge_tile_parts(np.concatenate(tile_parts))
+    return gpd.GeoDataFrame(geometry=shapely.convex_hull(parts), crs=urban_roads.crs)
+
+
+def load_or_build_urban_mask(
+    urban_roads: gpd.GeoDataFrame,
+    cache_dir: Optional[Union[str, Path]] = None,
+    buffer_distance: float = 500,
+    tile_size: float = 50_000,
+    n_workers: int = 1,
+) -> gpd.GeoDataFrame:
+    """Urban mask from the GeoParquet cache in ``cache_dir`` if it was built
+    from the same roads, otherwise built (and cached)"""
+    if cache_dir is None:
+        return build_urban_mask(urban_roads, buffer_distance, tile_size, n_workers)
+    key = content_hash(
+        b"".join(urban_roads.geometry.to_wkb()), buffer_distance, urban_roads.crs
+    )
+    cache_path = Path(cache_dir) / f"urban_mask_{key[:16]}.geoparquet"
+    if cache_path.exists():
+        return gpd.read_parquet(cache_path)
+    urban_mask = build_urban_mask(urban_roads, buffer_distance, tile_size, n_workers)
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    urban_mask.to_parquet(cache_path)
+    return urban_mask
@@ -3,7 +3,8 @@
 """
 import os
 import json
-from collections import defaultdict
+import hashlib
+from itertools import chain
 from math import sin, cos, atan2, sqrt, pi
 from typing import Dict, List, Optional, Tuple, Union
 
@@ -14,6 +15,7 @@ import numpy as np
 import pandas as pd
 import snkit
 from shapely.geometry import LineString, Polygon
+from scipy import sparse
 from scipy.spatial import cKDTree
 
 
@@ -52,8 +54,8 @@ def add_lines(
 
 def ckdnearest(gdA: gpd.GeoDataFrame, gdB: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """Taken from https://gis.stackexchange.com/questions/222315/finding-nearest-point-in-other-geodataframe-using-geopandas"""
-    nA = np.array(list(gdA.geometry.apply(lambda x: (x.x, x.y))))
-    nB = np.array(list(gdB.geometry.apply(lambda x: (x.x, x.y))))
+    nA = np.column_stack([gdA.geometry.x.to_numpy(), gdA.geometry.y.to_numpy()])
+    nB = np.column_stack([gdB.geometry.x.to_numpy(), gdB.geometry.y.to_numpy()])
     btree = cKDTree(nB)
     dist, idx = btree.query(nA, k=1)
     gdB_nearest = gdB.iloc[idx].drop(columns="geometry").reset_index(drop=True)
@@ -261,6 +263,21 @@ def getDistance(loc1: Tuple[Number, Number], loc2: Tuple[Number, Number]) -> flo
     return km
 
 
+def content_hash(*parts) -> str:
+    """Hex digest identifying the given arrays/strings, used as cache key"""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(f"{part.dtype}{part.shape}".encode())
+            digest.update(part.tobytes())
+        elif isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(str(part).encode())
+    return digest.hexdigest()
+
+
 def get_flow_on_edges(
     save_paths_df: pd.DataFrame,
     edge_id_column: str,
@@ -296,11 +313,60 @@ def get_flow_on_edges(
             edge_2      10
             edge_3      20
     """
-    edge_flows: Dict[str, float] = defaultdict(float)
-    for row in save_paths_df.itertuples():
-        for item in getattr(row, edge_path_column):
-            edge_flows[item] += getattr(row, flow_column)
+    edge_codes, edge_ids = pd.factorize(
+        pd.Series(list(chain.from_iterable(save_paths_df[edge_path_column])))
+    )
+    path_lengths = save_paths_df[edge_path_column].map(len).to_numpy()
+    path_flow_matrix = build_path_flow_matrix(
+        edge_codes,
+        path_lengths,
+        save_paths_df[flow_column].to_numpy(dtype=np.float64),
+        len(edge_ids),
+    )
 
     return pd.DataFrame(
-        [(k, v) for k, v in edge_flows.items()], columns=[edge_id_column, flow_column]
+        {
+            edge_id_column: edge_ids,
+            flow_column: get_flow_on_edges_from_matrix(path_flow_matrix),
+        }
+    )
+
+
+def build_path_flow_matrix(
+    path_edges: np.ndarray,
+    path_lengths: np.ndarray,
+    flows: np.ndarray,
+    number_of_edges: int,
+) -> sparse.csr_matrix:
+    """Build the (OD pair x edge) incidence matrix weighted by OD flows
+    Parameters
+    ---------
+    path_edges
+        integer edge indices of all paths, concatenated in OD pair order
+    path_lengths
+        number of edges in the path of each OD pair
+    flows
+        flow of each OD pair
+    number_of_edges
+        number of columns (edge indices run from 0 to number_of_edges - 1)
+    Result
+    -------
+    CSR matrix with the OD flow at (OD pair, edge) for every edge on its path
+    """
+    path_lengths = np.asarray(path_lengths, dtype=np.int64)
+    indptr = np.zeros(len(path_lengths) + 1, dtype=np.int64)
+    np.cumsum(path_lengths, out=indptr[1:])
+    data = np.repeat(np.asarray(flows, dtype=np.float64), path_lengths)
+    return sparse.csr_matrix(
+        (data, np.asarray(path_edges, dtype=np.int32), indptr),
+        shape=(len(path_lengths), number_of_edges),
     )
+
+
+def get_flow_on_edges_from_matrix(path_flow_matrix: sparse.csr_matrix) -> np.ndarray:
+    """Total flow on each edge: one sparse mat-vec over the OD pairs.
+    Flows of each edge are summed in OD pair order, as in get_flow_on_edges.
+    Rescaling the OD flows (e.g. ``path_flow_matrix.data *= r``) is done in
+    place on the matrix, so it does not need to be rebuilt.
+    """
+    return path_flow_matrix.T @ np.ones(path_flow_matrix.shape[0])
@@ -0,0 +1,140 @@
+"""Small synthetic road networks for the model tests"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd  # type: ignore
+import pytest
+from shapely.geometry import LineString, Point  # type: ignore
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+import functions as func  # noqa: E402
+import network_cache  # noqa: E402
+
+SPEED_PARAMETERS = dict(
+    free_flow_speed_dict={"M": 70.0, "A_single": 50.0, "A_dual": 60.0, "B": 40.0},
+    flow_breakpoint_dict={"M": 300.0, "A_single": 200.0, "A_dual": 250.0, "B": 150.0},
+    min_speed_cap={"M": 20.0, "A_single": 15.0, "A_dual": 18.0, "B": 10.0},
+    urban_speed_cap={"M": 60.0, "A_single": 30.0, "A_dual": 35.0, "B": 30.0},
+)
+CAPACITY = {"M": 4000.0, "A_single": 1500.0, "A_dual": 2500.0, "B": 1000.0}
+
+
+def road_network(points, pairs, capacity_scale=1.0, seed=0):
+    """Network inputs of ``network_flow_model`` for links between ``points``"""
+    rng = np.random.default_rng(seed)
+    ids = [f"nd{i:05d}" for i in range(len(points))]
+    nodes = gpd.GeoDataFrame(
+        {"id": ids}, geometry=[Point(p) for p in points], crs="27700"
+    )
+    links = gpd.GeoDataFrame(
+        {
+            "id": [f"e{k:06d}" for k in range(len(pairs))],
+            "start_node": [ids[i] for i, _ in pairs],
+            "end_node": [ids[j] for _, j in pairs],
+            "road_classification": rng.choice(
+                ["A Road", "B Road", "Motorway"], len(pairs), p=[0.5, 0.3, 0.2]
+            ),
+            "form_of_way": rng.choice(
+                ["Single Carriageway", "Dual Carriageway"], len(pairs)
+            ),
+            "road_classification_number": "X",
+        },
+        geometry=[LineString([points[i], points[j]]) for i, j in pairs],
+        crs="27700",
+    )
+    road_links, road_nodes = func.select_partial_roads(
+        links, nodes, "road_classification", ["A Road", "B Road", "Motorway"]
+    )
+    road_links["urban"] = rng.integers(0, 2, len(road_links))
+    road_links["average_toll_cost"] = 0.0
+    node_name_to_index = {name: i for i, name in enumerate(road_nodes.nd_id)}
+    network, cost_dict, time_cost_dict, operate_cost_dict = func.create_igraph_network(
+        node_name_to_index,
+        road_links,
+        road_nodes,
+        SPEED_PARAMETERS["free_flow_speed_dict"],
+    )
+    road_links = func.initialise_igraph_network(
+        road_links,
+        {k: v * capacity_scale for k, v in CAPACITY.items()},
+        SPEED_PARAMETERS["free_flow_speed_dict"],
+        col_road_classification="road_classification",
+    )
+    return dict(
+        network=network,
+        edge_cost_dict=cost_dict,
+        edge_timeC_dict=time_cost_dict,
+        edge_operateC_dict=operate_cost_dict,
+        road_links=road_links,
+        road_nodes=road_nodes,
+        node_name_to_index=node_name_to_index,
+        edge_index_to_name=dict(enumerate(network.es["edge_name"])),
+    )
+
+
+def grid_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        ((i % n) * 1000.0 + rng.uniform(-100, 100), (i // n) * 1000.0)
+        for i in range(n * n)
+    ]
+
+
+def grid_pairs(n):
+    return [
+        (i, j)
+        for i in range(n * n)
+        for j in ([i + 1] if i % n < n - 1 else [])
+        + ([i + n] if i // n < n - 1 else [])
+    ]
+
+
+def od_dicts(od: pd.DataFrame):
+    """list of origins, {origin: supplies}, {origin: destinations}"""
+    origins = sorted(od["origin"].unique().tolist())
+    groups = od.groupby("origin")
+    return (
+        origins,
+        {o: groups.get_group(o)["count"].tolist() for o in origins},
+        {o: groups.get_group(o)["destination"].tolist() for o in origins},
+    )
+
+
+def grid_network():
+    """Fresh inputs of the 8x8 grid (the model modifies the graph)"""
+    return road_network(grid_points(8), grid_pairs(8), capacity_scale=0.3)
+
+
+def compile_network(inputs, network_dir):
+    """Save the network inputs as a compiled network in ``network_dir``"""
+    network_cache.save_network(
+        network_dir,
+        "key",
+        inputs["network"],
+        inputs["road_links"],
+        inputs["edge_timeC_dict"],
+        inputs["edge_operateC_dict"],
+    )
+    return network_cache.load_network(network_dir)
+
+
+@pytest.fixture
+def grid():
+    """8x8 grid and random OD pairs between its vertices"""
+    inputs = grid_network()
+    rng = np.random.default_rng(1)
+    n_vertices = inputs["network"].vcount()
+    od = pd.DataFrame(
+        {
+            "origin": rng.integers(0, n_vertices, 300),
+            "destination": rng.integers(0, n_vertices, 300),
+            "count": rng.integers(1, 400, 300).astype(float),
+        }
+    )
+    od = od[od["origin"] != od["destination"]]
+    od = od.groupby(["origin", "destination"], as_index=False)["count"].sum()
+    return inputs, od
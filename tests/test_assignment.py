@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from assignment import frank_wolfe_assignment
+from conftest import SPEED_PARAMETERS, grid_pairs, grid_points, od_dicts, road_network
+
+
+def assign(od, max_iterations, **kwargs):
+    inputs = road_network(grid_points(12), grid_pairs(12))
+    list_of_origins, supply_dict, destination_dict = od_dicts(od)
+    return frank_wolfe_assignment(
+        inputs["network"],
+        inputs["road_links"],
+        {i: i for i in range(inputs["network"].vcount())},
+        inputs["edge_index_to_name"],
+        list_of_origins,
+        supply_dict,
+        destination_dict,
+        col_eid="e_id",
+        max_iterations=max_iterations,
+        gap_tolerance=0.0,
+        return_summary=True,
+        **SPEED_PARAMETERS,
+        **kwargs,
+    )
+
+
+def relative_gap(od, conjugate, max_iterations):
+    *_, summary = assign(od, max_iterations, conjugate=conjugate)
+    return summary["relative_gap"]
+
+
+def congested_od():
+    # congested 12x12 grid
+    rng = np.random.default_rng(1)
+    od = pd.DataFrame(
+        {
+            "origin": rng.integers(0, 144, 600),
+            "destination": rng.integers(0, 144, 600),
+            "count": 20 * rng.integers(1, 400, 600).astype(float),
+        }
+    )
+    od = od[od["origin"] != od["destination"]]
+    return od.groupby(["origin", "destination"], as_index=False)["count"].sum()
+
+
+def test_conjugate_converges_at_least_as_fast():
+    od = congested_od()
+    plain = relative_gap(od, conjugate=False, max_iterations=50)
+    conjugate = relative_gap(od, conjugate=True, max_iterations=50)
+    assert conjugate <= plain
+
+
+def test_gap_decreases_with_iterations():
+    od = congested_od()
+    assert relative_gap(od, False, 20) < relative_gap(od, False, 2)
+
+
+def test_parallel_assignment_matches_serial():
+    od = congested_od()
+    assert assign(od, 10, n_workers=2) == assign(od, 10)
@@ -0,0 +1,51 @@
+import numpy as np
+
+import criticality
+from conftest import compile_network, grid_pairs, grid_points, od_dicts, road_network
+
+
+def test_screening_matches_brute_force_rerouting(grid, tmp_path):
+    _, od = grid
+    # without the link 0-8, the link 0-1 is the only one to vertex 0
+    pairs = [pair for pair in grid_pairs(8) if pair != (0, 8)]
+    inputs = road_network(grid_points(8), pairs)
+    compile_network(inputs, tmp_path)
+    network = inputs["network"]
+    od_inputs = od_dicts(od)
+    origins, destinations, flows = (
+        od["origin"].to_numpy(),
+        od["destination"].to_numpy(),
+        od["count"].to_numpy(),
+    )
+
+    def pair_costs(weights):
+        distances = np.array(network.distances(weights=weights.tolist()))
+        return distances[origins, destinations]
+
+    weights = np.array(network.es["weight"])
+    base_costs = pair_costs(weights)
+    rows = {}
+    for edge, e_id in enumerate(network.es["edge_name"]):
+        closed = weights.copy()
+        closed[edge] = np.inf
+        costs = pair_costs(closed)
+        is_lost = np.isinf(costs)
+        rows[e_id] = (
+            (flows * (costs - base_costs))[~is_lost].sum(),
+            flows[is_lost].sum(),
+        )
+
+    screening = criticality.screen_links(tmp_path, od_inputs)
+    assert sorted(screening.e_id) == sorted(rows)
+    assert screening.lost_flow.iloc[0] > 0
+    for row in screening.itertuples():
+        extra_cost, lost_flow = rows[row.e_id]
+        assert np.isclose(row.extra_cost, extra_cost)
+        assert row.lost_flow == lost_flow
+        assert np.isclose(
+            row.extra_cost,
+            row.extra_time_cost + row.extra_operate_cost + row.extra_toll,
+        )
+
+    parallel = criticality.screen_links(tmp_path, od_inputs, n_workers=2)
+    assert parallel.equals(screening)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_io
+
+
+@pytest.fixture
+def od_csv(tmp_path):
+    rng = np.random.default_rng(0)
+    zones = np.array([f"E{i:08d}" for i in range(50)], dtype=object)
+    od = pd.DataFrame(
+        {
+            "origins": rng.choice(zones, 1000),
+            "destinations": rng.choice(zones, 1000),
+            "mode": "car",
+            "counts": rng.integers(0, 50, 1000).astype(float),
+        }
+    )
+    path = tmp_path / "od.csv"
+    od.to_csv(path, index=False)
+    return path, od, zones[::4].tolist()
+
+
+def as_plain(od_matrix):
+    return od_matrix.astype({"origins": str, "destinations": str}).reset_index(
+        drop=True
+    )
+
+
+def test_read_od_matrix_matches_pandas_filter(od_csv):
+    path, od, zones = od_csv
+    expected = od[od.origins.isin(zones) | od.destinations.isin(zones)][
+        ["origins", "destinations", "counts"]
+    ]
+    od_matrix = data_io.read_od_matrix(path, zones, chunksize=64)
+    assert od_matrix.origins.dtype == od_matrix.destinations.dtype
+    pd.testing.assert_frame_equal(as_plain(od_matrix), as_plain(expected))
+    pd.testing.assert_frame_equal(
+        as_plain(data_io.read_od_matrix(path, chunksize=64)),
+        as_plain(od[["origins", "destinations", "counts"]]),
+    )
+    assert data_io.od_total(path, chunksize=64) == od.counts.sum()
+
+
+def test_converted_od_matrix_reads_like_csv(od_csv, tmp_path):
+    path, od, zones = od_csv
+    parquet_path = tmp_path / "od.parquet"
+    data_io.convert_od_matrix(path, parquet_path, chunksize=64)
+    for selection in (zones, None):
+        pd.testing.assert_frame_equal(
+            as_plain(data_io.read_od_matrix(parquet_path, selection)),
+            as_plain(data_io.read_od_matrix(path, selection)),
+        )
+    assert data_io.od_total(parquet_path) == od.counts.sum()
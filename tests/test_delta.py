@@ -0,0 +1,35 @@
+import numpy as np
+
+from conftest import grid_network
+from delta import BaselineReplay, PathRecord
+from test_flow_model import run_model
+
+
+def disrupted_grid(closed_edges):
+    inputs = grid_network()
+    weights = np.array(inputs["network"].es["weight"])
+    weights[closed_edges] = np.inf
+    inputs["network"].es["weight"] = weights.tolist()
+    return inputs
+
+
+def test_baseline_replay_matches_full_disrupted_run(grid):
+    inputs, od = grid
+    record = PathRecord()
+    baseline = run_model(inputs, od, record_paths=record)
+    assert len(record) > 4
+
+    # edges first used in the second iteration: the first one is replayed
+    closed_edges = np.setdiff1d(record.edges[1], record.edges[0])
+    replay = BaselineReplay(
+        record,
+        np.array(disrupted_grid(closed_edges)["network"].es["weight"]),
+        record.capacity,
+    )
+    assert replay.divergence == 1
+
+    expected = run_model(disrupted_grid(closed_edges), od)
+    replayed = run_model(disrupted_grid(closed_edges), od, baseline_paths=record)
+    assert replayed == expected
+    assert expected[3]["iterations"] > 4
+    assert expected != baseline
@@ -0,0 +1,118 @@
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions as func
+from demand import ODDemand
+
+
+@pytest.fixture
+def od_matrix():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "origin": rng.integers(0, 40, 500),
+            "destination": rng.integers(0, 40, 500),
+            "count": rng.integers(1, 100, 500).astype(float),
+        }
+    )
+
+
+def zone_nodes(n_zones=40, n_nodes=15, n_unmapped=3, seed=0):
+    # several zones per node, and a few zones without a node
+    rng = np.random.default_rng(seed)
+    nodes = rng.integers(0, n_nodes, n_zones)
+    return {z: f"n{nodes[z]}" for z in range(n_unmapped, n_zones)}
+
+
+def test_od_interpret_merges_node_pairs(od_matrix):
+    zone_to_node = zone_nodes()
+    pair_counts = defaultdict(float)
+    intra_node = defaultdict(float)
+    for from_zone, to_zone, count in od_matrix.itertuples(index=False):
+        if from_zone not in zone_to_node or to_zone not in zone_to_node:
+            continue
+        from_node, to_node = zone_to_node[from_zone], zone_to_node[to_zone]
+        if from_node == to_node:
+            intra_node[from_node] += count
+        else:
+            pair_counts[(from_node, to_node)] += count
+
+    origins, destination_dict, supply_dict, intra_node_dict = func.od_interpret(
+        od_matrix, zone_to_node, "origin", "destination", "count"
+    )
+    assert origins == sorted({o for o, _ in pair_counts})
+    actual = {
+        (origin, dest): count
+        for origin in origins
+        for dest, count in zip(destination_dict[origin], supply_dict[origin])
+    }
+    assert actual == pytest.approx(dict(pair_counts))
+    assert intra_node and intra_node_dict == pytest.approx(dict(intra_node))
+
+
+def test_select_matches_dict_filter(od_matrix):
+    demand, _ = ODDemand.from_od_matrix(
+        od_matrix, zone_nodes(), "origin", "destination", "count"
+    )
+    rng = np.random.default_rng(1)
+    keep = rng.random(len(demand)) < 0.3
+    counts = rng.random(len(demand))
+
+    list_of_origins, destination_dict, supply_dict = demand.to_dicts()
+    expected = {}
+    i = 0
+    for origin in list_of_origins:
+        for dest in destination_dict[origin]:
+            if keep[i]:
+                expected.setdefault(origin, []).append((dest, counts[i]))
+            i += 1
+
+    selected = demand.select(keep, counts)
+    origins, destinations, supplies = selected.to_dicts()
+    assert origins == list(expected)
+    assert {
+        origin: list(zip(destinations[origin], supplies[origin])) for origin in origins
+    } == expected
+    assert selected.offsets[-1] == len(selected) == keep.sum()
+
+
+def test_dict_layout_round_trip(od_matrix):
+    demand, _ = ODDemand.from_od_matrix(
+        od_matrix, zone_nodes(), "origin", "destination", "count"
+    )
+    list_of_origins, destination_dict, supply_dict = demand.to_dicts()
+    round_trip = ODDemand.from_dicts(list_of_origins, supply_dict, destination_dict)
+    for field in ("origins", "offsets", "destinations", "counts"):
+        np.testing.assert_array_equal(
+            getattr(round_trip, field), getattr(demand, field)
+        )
+
+    node_name_to_index = {f"n{i}": i for i in range(15)}
+    mapped = round_trip.map_nodes(node_name_to_index)
+    assert mapped.origins.dtype == np.int64
+    assert mapped.pair_origins().tolist() == [
+        node_name_to_index[name] for name in demand.pair_origins()
+    ]
+    assert mapped.destination_lists() == [
+        [node_name_to_index[name] for name in dests]
+        for dests in demand.destination_lists()
+    ]
+
+
+def test_update_od_matrix_drops_cut_off_and_empty_pairs():
+    demand = ODDemand.from_dicts(
+        [0, 1, 2],
+        {0: [10.0, 5.0], 1: [3.0], 2: [8.0, 1.0]},
+        {0: [1, 2], 1: [2], 2: [0, 1]},
+    )
+    has_path = np.array([True, False, True, True, False])
+    remaining_flow = np.array([4.0, 2.0, 0.0, 3.0, 0.5])
+    remaining, non_allocated_flow = func.update_od_matrix(
+        demand, remaining_flow, has_path
+    )
+    # full flows of the pairs without a path, unscaled
+    assert non_allocated_flow == 5.0 + 1.0
+    assert remaining.to_dicts() == ([0, 2], {0: [1], 2: [0]}, {0: [4.0], 2: [3.0]})
@@ -0,0 +1,105 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import checkpoint
+import functions as func
+from metrics import Metrics
+from conftest import SPEED_PARAMETERS, grid_network, od_dicts, road_network
+
+
+def run_model(inputs, od, **kwargs):
+    list_of_origins, supply_dict, destination_dict = od_dicts(od)
+    return func.network_flow_model(
+        inputs["network"],
+        inputs["edge_cost_dict"],
+        inputs["edge_timeC_dict"],
+        inputs["edge_operateC_dict"],
+        inputs["road_links"],
+        None,  # OD nodes are vertex indices
+        inputs["edge_index_to_name"],
+        list_of_origins,
+        supply_dict,
+        destination_dict,
+        col_eid="e_id",
+        return_summary=True,
+        **SPEED_PARAMETERS,
+        **kwargs,
+    )
+
+
+def test_resume_with_vertex_codes(grid, tmp_path):
+    inputs, od = grid
+    expected = run_model(inputs, od)
+    assert expected[3]["iterations"] > 3
+
+    path = tmp_path / "run.npz"
+    fresh = grid_network()
+    run_model(fresh, od, checkpoint_path=path, checkpoint_every=3)
+    resumed = grid_network()
+    result = run_model(resumed, od, checkpoint_path=path, resume=True)
+
+    assert result[3] == expected[3]
+    for actual, reference in zip(result[:3], expected[:3]):
+        assert actual == reference
+
+
+class Interrupt(Exception):
+    pass
+
+
+class InterruptingSink:
+    """Metrics sink stopping the run at the end of an iteration"""
+
+    def __init__(self, iteration):
+        self.iteration = iteration
+
+    def write(self, record):
+        if record["event"] == "iteration" and record["iteration"] == self.iteration:
+            raise Interrupt
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_resume_after_interruption(grid, tmp_path, incremental):
+    inputs, od = grid
+    expected = run_model(inputs, od, incremental=incremental)
+
+    path = tmp_path / "run.npz"
+    with pytest.raises(Interrupt):
+        run_model(
+            grid_network(),
+            od,
+            incremental=incremental,
+            checkpoint_path=path,
+            checkpoint_every=2,
+            metrics=Metrics(InterruptingSink(5)),
+        )
+    # the checkpoint of iteration 5 is written in the background
+    for thread in threading.enumerate():
+        if "_write" in thread.name:
+            thread.join()
+    assert checkpoint.load_checkpoint(path)["iter_flag"] == 5
+
+    result = run_model(
+        grid_network(),
+        od,
+        incremental=incremental,
+        checkpoint_path=path,
+        resume=True,
+    )
+    assert result == expected
+
+
+def test_run_ends_when_all_pairs_are_cut_off():
+    # 0 - 1 - 2 chain; the demand is above the capacity of the links
+    inputs = road_network([(0.0, 0.0), (1000.0, 0.0), (2000.0, 0.0)], [(0, 1), (1, 2)])
+    od = pd.DataFrame({"origin": [0], "destination": [2], "count": [1e5]})
+    speeds, flows, capacities, summary = run_model(inputs, od)
+
+    assert summary["iterations"] == 2
+    assert np.isclose(
+        summary["non_allocated_flow"] + max(flows.values()), od["count"].sum()
+    )
+    assert min(capacities.values()) < 1
@@ -0,0 +1,59 @@
+import numpy as np
+
+import functions as func
+import kernels
+from conftest import SPEED_PARAMETERS
+
+LABELS = np.array(["M", "A_single", "A_dual", "B"], dtype=object)
+
+
+def test_speed_flow_array_matches_speed_flow_func():
+    rng = np.random.default_rng(0)
+    labels = rng.choice(LABELS, 2000)
+    urban = rng.integers(0, 2, 2000)
+    flow = rng.uniform(0, 20_000, 2000)
+    expected = [
+        func.speed_flow_func(label, isurban, vp, **SPEED_PARAMETERS)
+        for label, isurban, vp in zip(labels, urban, flow)
+    ]
+    actual = kernels.speed_flow_array(
+        kernels.encode_road_classes(labels), urban, flow, **SPEED_PARAMETERS
+    )
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_initial_speed_array_matches_initial_speed_func():
+    road_types = np.array(["M", "A", "A", "B", "A"], dtype=object)
+    forms = np.array(
+        ["Dual", "Single Carriageway", "Dual Carriageway", "Single", "Slip Road"],
+        dtype=object,
+    )
+    free_flow_speed_dict = SPEED_PARAMETERS["free_flow_speed_dict"]
+    expected = [
+        func.initial_speed_func(road_type, form, free_flow_speed_dict)
+        for road_type, form in zip(road_types, forms)
+    ]
+    actual = kernels.initial_speed_array(
+        kernels.encode_initial_classes(road_types, forms), free_flow_speed_dict
+    )
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_voc_and_cost_arrays_match_scalar_functions():
+    rng = np.random.default_rng(1)
+    speed = rng.uniform(10, 70, 1000)
+    length = rng.uniform(0.01, 5, 1000)
+    toll = np.where(rng.random(1000) < 0.1, 2.5, 0.0)
+
+    voc = kernels.voc_array(speed)
+    np.testing.assert_array_equal(voc, [func.voc_func(s) for s in speed])
+
+    expected = np.array(
+        [
+            func.cost_func(t, d, v, c)
+            for t, d, v, c in zip(length / speed, length, voc, toll)
+        ]
+    )
+    actual = kernels.cost_array(length / speed, length, voc, toll)
+    for column, array in enumerate(actual):
+        np.testing.assert_array_equal(array, expected[:, column])
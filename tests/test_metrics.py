@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from conftest import grid_network
+from metrics import JSONLSink, MemorySink, Metrics
+from test_flow_model import run_model
+
+
+def test_metrics_records_do_not_change_results(grid, tmp_path):
+    inputs, od = grid
+    expected = run_model(inputs, od)
+
+    sink = MemorySink()
+    metrics = Metrics(sink)
+    assert run_model(grid_network(), od, metrics=metrics) == expected
+    events = [record["event"] for record in sink.records]
+    assert events[0] == "run_start" and events[-1] == "run_end"
+
+    iterations = [r for r in sink.records if r["event"] == "iteration"]
+    assert [r["iteration"] for r in iterations] == list(
+        range(1, expected[3]["iterations"] + 1)
+    )
+    assert iterations[-1]["total_cost"] == expected[3]["total_cost"]
+    assert iterations[0]["routed_pairs"] == len(od)
+    for record in iterations:
+        stages = [
+            r
+            for r in sink.records
+            if r["event"] == "stage" and r["iteration"] == record["iteration"]
+        ]
+        assert "routing" in record["stages"]
+        # repeated stages add up in the iteration record
+        assert sum(r["seconds"] for r in stages) == pytest.approx(
+            sum(record["stages"].values())
+        )
+        assert sum(record["stages"].values()) <= record["seconds"]
+
+    path = tmp_path / "metrics.jsonl"
+    metrics = Metrics(JSONLSink(path), stage_records=False)
+    run_model(grid_network(), od, metrics=metrics)
+    metrics.close()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["event"] for r in lines] == [e for e in events if e != "stage"]
@@ -0,0 +1,84 @@
+import numpy as np
+
+import constants as cons
+import functions as func
+from conftest import (
+    SPEED_PARAMETERS,
+    compile_network,
+    grid_pairs,
+    grid_points,
+    road_network,
+)
+from edge_state import EdgeState
+
+
+def build_per_row(name_to_index, road_links, road_nodes, initial_speeds):
+    """Graph and cost dicts built one table row at a time"""
+    vertices = [
+        (name_to_index[node.id], {"lon": node.geometry.x, "lat": node.geometry.y})
+        for _, node in road_nodes.iterrows()
+    ]
+    edges, names, costs, time_costs, operate_costs = [], [], {}, {}, {}
+    for _, link in road_links.iterrows():
+        length = link.geometry.length * cons.CONV_METER_TO_MILE
+        speed = func.initial_speed_func(
+            link.road_classification[0], link.form_of_way, initial_speeds
+        )
+        cost, time_cost, operate_cost = func.cost_func(
+            length / speed, length, func.voc_func(speed), link.average_toll_cost
+        )
+        edges.append((name_to_index[link.from_id], name_to_index[link.to_id]))
+        names.append(link.e_id)
+        costs[link.e_id] = cost
+        time_costs[link.e_id] = time_cost
+        operate_costs[link.e_id] = operate_cost
+    return vertices, edges, names, costs, time_costs, operate_costs
+
+
+def test_create_igraph_network_matches_per_row_build():
+    inputs = road_network(grid_points(8), grid_pairs(8))
+    road_links, road_nodes = inputs["road_links"], inputs["road_nodes"]
+    road_links["average_toll_cost"] = np.random.default_rng(0).choice(
+        [0.0, 2.5], len(road_links)
+    )
+    initial_speeds = SPEED_PARAMETERS["free_flow_speed_dict"]
+    name_to_index = inputs["node_name_to_index"]
+
+    network, costs, time_costs, operate_costs = func.create_igraph_network(
+        name_to_index, road_links, road_nodes, initial_speeds
+    )
+    vertices, edges, names, *expected_costs = build_per_row(
+        name_to_index, road_links, road_nodes, initial_speeds
+    )
+    assert network.vs["name"] == vertices
+    assert network.vs["nd_id"] == road_nodes.id.tolist()
+    assert network.get_edgelist() == edges
+    assert network.es["edge_name"] == names
+    assert network.es["weight"] == [expected_costs[0][name] for name in names]
+    assert [costs, time_costs, operate_costs] == expected_costs
+
+
+def test_compiled_network_matches_built_network(tmp_path):
+    inputs = road_network(grid_points(8), grid_pairs(8))
+    network = inputs["network"]
+    compiled_network = compile_network(inputs, tmp_path)
+
+    graph = compiled_network.to_igraph()
+    assert graph.get_edgelist() == network.get_edgelist()
+    assert graph.vs["nd_id"] == network.vs["nd_id"]
+    assert graph.es["edge_name"] == network.es["edge_name"]
+    assert graph.es["weight"] == network.es["weight"]
+
+    # costs preloaded in the edge state equal those loaded from the dicts
+    expected = EdgeState.from_road_links(inputs["road_links"])
+    expected.load_costs(
+        inputs["edge_cost_dict"],
+        inputs["edge_timeC_dict"],
+        inputs["edge_operateC_dict"],
+    )
+    edge_state = compiled_network.edge_state()
+    edge_state.load_costs(None, None, None)
+    for field in EdgeState.FIELDS:
+        np.testing.assert_array_equal(
+            getattr(edge_state, field), getattr(expected, field)
+        )
@@ -0,0 +1,118 @@
+import numpy as np
+
+from conftest import grid_network
+from routing import ParallelRouter, PathCache, find_shortest_paths
+from test_flow_model import run_model
+
+
+def od_lists(od):
+    groups = od.groupby("origin")["destination"]
+    origins = sorted(groups.groups)
+    return origins, [groups.get_group(o).tolist() for o in origins]
+
+
+def test_parallel_router_matches_serial_routing(grid):
+    inputs, od = grid
+    network = inputs["network"]
+    origins, destinations = od_lists(od)
+    router = ParallelRouter(n_workers=2)
+    try:
+        router.update(network)
+        assert router.route(origins, destinations) == find_shortest_paths(
+            network, origins, destinations, progress=False
+        )
+
+        # re-weighted and closed edges, published incrementally
+        rng = np.random.default_rng(0)
+        changed = rng.choice(network.ecount(), 20, replace=False)
+        weights = np.array(network.es["weight"])
+        weights[changed[:15]] *= 3.0
+        weights[changed[15:]] = np.inf
+        network.es["weight"] = weights.tolist()
+        router.update(network, changed_edges=changed)
+        assert router.route(origins, destinations) == find_shortest_paths(
+            network, origins, destinations, closed=np.isinf(weights), progress=False
+        )
+    finally:
+        router.close()
+
+
+def test_parallel_flow_model_matches_serial(grid):
+    inputs, od = grid
+    expected = run_model(inputs, od)
+    assert run_model(grid_network(), od, n_workers=2) == expected
+
+
+def test_closed_edges_route_like_deleted_edges(grid):
+    inputs, od = grid
+    network = inputs["network"]
+    origins, destinations = od_lists(od)
+    rng = np.random.default_rng(1)
+    # random closures, plus vertex 0 cut off from the rest of the grid
+    closed_edges = set(rng.choice(network.ecount(), 15, replace=False).tolist())
+    closed_edges |= set(network.incident(0))
+    weights = np.array(network.es["weight"])
+
+    deleted = network.copy()
+    deleted.delete_edges(sorted(closed_edges))
+    kept_edges = np.array([e for e in range(network.ecount()) if e not in closed_edges])
+    expected = find_shortest_paths(deleted, origins, destinations, progress=False)
+
+    closed = np.zeros(network.ecount(), dtype=bool)
+    closed[list(closed_edges)] = True
+    network.es[list(closed_edges)]["weight"] = np.inf
+    actual = find_shortest_paths(
+        network, origins, destinations, closed=closed, progress=False
+    )
+    for paths, deleted_paths in zip(actual, expected):
+        for path, deleted_path in zip(paths, deleted_paths):
+            assert bool(path) == bool(deleted_path)
+            assert np.isclose(
+                weights[path].sum(), weights[kept_edges[deleted_path]].sum()
+            )
+    assert any(not path for paths in actual for path in paths)
+
+
+def test_path_cache_reroutes_only_affected_origins(grid):
+    inputs, od = grid
+    network = inputs["network"]
+    origins, destinations = od_lists(od)
+    weights = np.array(network.es["weight"])
+    cache = PathCache(weights)
+    routed = []
+
+    def route(origins, destinations):
+        routed.extend(origins)
+        return find_shortest_paths(network, origins, destinations, progress=False)
+
+    cache.route(route, origins, destinations)
+    assert routed == origins
+
+    # heavier edges drop only the origins whose cached paths use them
+    changed = np.unique(np.concatenate([p for p in cache.paths[origins[0]].values()]))
+    weights[changed] *= 2.0
+    network.es["weight"] = weights.tolist()
+    affected = [o for o in origins if np.isin(cache.edges[o], changed).any()]
+    routed.clear()
+    cache.update_weights(changed, weights[changed])
+    paths = cache.route(route, origins, destinations)
+    assert routed == affected
+    assert 0 < len(affected) < len(origins)
+    for actual, expected in zip(
+        paths, find_shortest_paths(network, origins, destinations, progress=False)
+    ):
+        for path, reference in zip(actual, expected):
+            assert np.isclose(weights[path].sum(), weights[reference].sum())
+
+    # a cheaper edge drops the whole cache
+    weights[changed[0]] /= 4.0
+    routed.clear()
+    cache.update_weights(changed[:1], weights[changed[:1]])
+    cache.route(route, origins, destinations)
+    assert routed == origins
+
+
+def test_incremental_flow_model_matches_full_rerouting(grid):
+    inputs, od = grid
+    expected = run_model(inputs, od)
+    assert run_model(grid_network(), od, incremental=True) == expected
@@ -0,0 +1,50 @@
+import copy
+
+import numpy as np
+
+import scenarios
+from conftest import SPEED_PARAMETERS, compile_network, grid_network, od_dicts
+from test_flow_model import run_model
+
+
+def test_scenarios_match_single_runs(grid, tmp_path):
+    _, od = grid
+    inputs = grid_network()
+    compile_network(inputs, tmp_path / "network")
+    od_inputs = od_dicts(od)
+    original_od_inputs = copy.deepcopy(od_inputs)
+    e_id = inputs["road_links"]["e_id"].tolist()
+    closed_links = e_id[:: len(e_id) // 10]
+    batch = [{"name": "base"}, {"name": "closed", "closed_links": closed_links}]
+
+    summary = scenarios.run_scenarios(
+        batch,
+        tmp_path / "network",
+        od_inputs,
+        dict(col_eid="e_id", **SPEED_PARAMETERS),
+        tmp_path / "serial",
+    )
+    # the OD inputs are shared by the scenarios, not modified
+    assert od_inputs == original_od_inputs
+
+    speed_dict, flow_dict, capacity_dict, expected = run_model(grid_network(), od)
+    base = np.load(tmp_path / "serial" / "base.npz")
+    assert base["flow"].tolist() == [flow_dict[e] for e in e_id]
+    assert base["speed"].tolist() == [speed_dict[e] for e in e_id]
+    assert summary.loc[0, "total_cost"] == expected["total_cost"]
+
+    closed = np.load(tmp_path / "serial" / "closed.npz")
+    assert not closed["flow"][np.isin(e_id, closed_links)].any()
+    # model output and progress bars are in the logs
+    log = (tmp_path / "serial" / "closed.log").read_text()
+    assert "iteration starts" in log and "Processing" in log
+
+    parallel = scenarios.run_scenarios(
+        batch,
+        tmp_path / "network",
+        od_inputs,
+        dict(col_eid="e_id", **SPEED_PARAMETERS),
+        tmp_path / "parallel",
+        n_workers=2,
+    )
+    assert parallel.equals(summary)
@@ -0,0 +1,49 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+import functions as func
+from snapping import snap_zones
+
+
+def points(n, seed):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 1000, (n, 2))
+    return gpd.GeoDataFrame(geometry=gpd.points_from_xy(xy[:, 0], xy[:, 1])), xy
+
+
+def zones_and_nodes():
+    zones, zone_xy = points(200, 0)
+    zones["code"] = [f"z{i}" for i in range(len(zones))]
+    road_nodes, node_xy = points(500, 1)
+    road_nodes["nd_id"] = [f"n{i}" for i in range(len(road_nodes))]
+    distances = np.linalg.norm(zone_xy[:, None] - node_xy[None], axis=2)
+    return zones, road_nodes, distances
+
+
+def test_find_nearest_node_matches_brute_force(tmp_path):
+    zones, road_nodes, distances = zones_and_nodes()
+    expected = dict(
+        zip(zones["code"], road_nodes["nd_id"].to_numpy()[distances.argmin(axis=1)])
+    )
+    cache_path = tmp_path / "snap.npz"
+    assert func.find_nearest_node(zones, road_nodes, cache_path=cache_path) == expected
+    # read back from the cache
+    assert func.find_nearest_node(zones, road_nodes, cache_path=cache_path) == expected
+
+
+def test_snap_zones_candidates_within_distance():
+    zones, road_nodes, distances = zones_and_nodes()
+    max_distance = 30.0
+    candidates = snap_zones(zones, road_nodes, k=3, max_distance=max_distance)
+
+    rows = []
+    for i, code in enumerate(zones["code"]):
+        nearest = np.argsort(distances[i])[:3]
+        for rank, node in enumerate(nearest):
+            if distances[i, node] <= max_distance:
+                rows.append((code, rank, f"n{node}", distances[i, node]))
+    expected = pd.DataFrame(rows, columns=["code", "rank", "nd_id", "distance"])
+    assert candidates["rank"].max() == 2
+    assert candidates["code"].nunique() < len(zones)
+    pd.testing.assert_frame_equal(candidates, expected, check_dtype=False)
@@ -0,0 +1,66 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import LineString
+
+import functions as func
+from urban_mask import build_urban_mask, load_or_build_urban_mask
+
+
+def random_lines(n, seed, length=300.0):
+    rng = np.random.default_rng(seed)
+    start = rng.uniform(0, 20_000, (n, 2))
+    end = start + rng.uniform(-length, length, (n, 2))
+    return [LineString([a, b]) for a, b in zip(start, end)]
+
+
+def test_label_urban_roads_matches_sjoin(tmp_path):
+    road_links = gpd.GeoDataFrame(
+        {"e_id": [f"e{i}" for i in range(400)]},
+        geometry=random_lines(400, 0),
+        crs="27700",
+    )
+    centres = np.random.default_rng(1).uniform(0, 20_000, (15, 2))
+    urban_mask = gpd.GeoDataFrame(
+        geometry=shapely.buffer(shapely.points(centres), 1500), crs="27700"
+    )
+
+    # per-link maximum of the left spatial join
+    joined = road_links.sjoin(urban_mask, how="left")
+    joined["urban"] = joined["index_right"].notna().astype(int)
+    expected = road_links.merge(
+        joined.groupby("e_id")["urban"].max(), on="e_id", how="left"
+    )["urban"]
+
+    cache_path = tmp_path / "urban.npz"
+    for _ in range(2):  # built, then read from the cache
+        labelled = func.label_urban_roads(road_links, urban_mask, cache_path)
+        assert 0 < labelled["urban"].sum() < len(labelled)
+        assert labelled["urban"].tolist() == expected.tolist()
+
+
+def test_tiled_urban_mask_matches_global_union(tmp_path):
+    urban_roads = gpd.GeoDataFrame(
+        {"Urban": np.ones(300, dtype=int)},
+        geometry=random_lines(300, 2, length=600.0),
+        crs="27700",
+    )
+    # global union of the buffers, split into hulls
+    union = urban_roads.geometry.buffer(500).union_all()
+    expected = shapely.convex_hull(shapely.get_parts(union))
+
+    # small tiles, so that many hulls span several tiles
+    for n_workers in (1, 2):
+        urban_mask = build_urban_mask(urban_roads, tile_size=2000, n_workers=n_workers)
+        hulls = urban_mask.geometry.to_numpy()
+        assert len(hulls) == len(expected)
+        # pair the hulls by their largest overlap
+        for hull in expected:
+            match = hulls[np.argmax(shapely.area(shapely.intersection(hulls, hull)))]
+            assert shapely.area(shapely.symmetric_difference(match, hull)) < 1e-6 * (
+                hull.area
+            )
+
+    cached = load_or_build_urban_mask(urban_roads, cache_dir=tmp_path, tile_size=2000)
+    reread = load_or_build_urban_mask(urban_roads, cache_dir=tmp_path, tile_size=2000)
+    assert cached.geometry.equals(reread.geometry)